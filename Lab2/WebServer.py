@@ -1,52 +1,1016 @@
 #import socket module
+import argparse
+import gzip
+import heapq
+import itertools
+import json
+import mimetypes
 import os
+import selectors
+import signal
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 from socket import *
+from urllib.parse import unquote
 
-serverSocket = socket(AF_INET, SOCK_STREAM)
-#Prepare a sever socket
-#Fill in start
-serverPort = 7030
-serverSocket.bind(("localhost", serverPort))
-serverSocket.listen(1)
-#Fill in end
-# print("Current working directory:", os.getcwd())
-while True:
-    #Establish the connection
-    print('Ready to serve...')
-    connectionSocket, addr =  serverSocket.accept() #Fill in start #Fill in end
-    try:
-        message =  connectionSocket.recv(1024).decode() #Fill in start #Fill in end
-        filename = message.split()[1]
-        print("Requested file:", filename[1:])
-        f = open(filename[1:])
-
-        outputdata = f.read() # Fill in start # Fill in end
-
-        #Send one HTTP header line into socket
-        #Fill in start
-        header = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n"
-        connectionSocket.send(header.encode())
-        #Fill in end
-        #Send the content of the requested file to the client
-        for i in range(0, len(outputdata)):
-            connectionSocket.send(outputdata[i].encode())
-        connectionSocket.send("\r\n".encode())
-        connectionSocket.close()
+try:
+    from socket import SO_REUSEPORT
+except ImportError:
+    SO_REUSEPORT = None
+
+DEFAULT_PORT = 7030
+DEFAULT_BACKLOG = 128   # pending connections the kernel queues for us
+DEFAULT_THREADS = 16    # connections served at the same time in pool mode
+DEFAULT_WORKERS = 1     # server processes; more than one forks a supervised group
+SHUTDOWN_GRACE = 10.0   # seconds workers get to finish in-flight requests
+RESTART_DELAY = 1.0     # pause before restarting a worker that died right away
+CHUNK_SIZE = 64 * 1024  # read size when the platform has no sendfile
+RECV_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+DEFAULT_IDLE_TIMEOUT = 5.0   # seconds a keep-alive connection may sit idle
+DEFAULT_MAX_REQUESTS = 100   # requests served on one connection before closing
+KEEP_ALIVE_LINGER = 0.005    # seconds a pool thread waits for the next request before parking
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024   # bytes of responses kept in memory
+DEFAULT_CACHE_MAX_ENTRY = 1024 * 1024   # larger files always go through sendfile
+DEFAULT_CACHE_VALIDATE = 1.0            # seconds between os.stat checks of a cached file
+DEFAULT_COMPRESS_MIN = 256             # smaller bodies are not worth compressing
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript",
+                      "application/xml", "image/svg+xml")
+ENCODINGS = ("gzip", "deflate")         # in order of preference
+STATS_PATH = "/__stats"
+
+REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    501: "Not Implemented",
+    505: "HTTP Version Not Supported",
+}
+
+verbose = True
+root = "."
+idle_timeout = DEFAULT_IDLE_TIMEOUT
+max_requests = DEFAULT_MAX_REQUESTS
+cache = None
+cache_max_entry = DEFAULT_CACHE_MAX_ENTRY
+compress_min = DEFAULT_COMPRESS_MIN     # None turns compression off
+
+
+def log(*args):
+    if verbose:
+        print(*args)
+
+
+def content_type(path):
+    ctype, encoding = mimetypes.guess_type(path)
+    if ctype is None or encoding is not None:
+        return "application/octet-stream"
+    if ctype.startswith("text/"):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def send_file(connectionSocket, f, offset, count):
+    # let the kernel copy file pages straight into the socket when it can,
+    # otherwise stream fixed size chunks so large files never sit in memory
+    if count <= 0:
+        # an empty file (or one truncated since stat); socket.sendfile
+        # raises ValueError for a count of 0
+        return
+    if hasattr(os, "sendfile"):
+        connectionSocket.sendfile(f, offset, count)
+        return
+    f.seek(offset)
+    remaining = count
+    while remaining > 0:
+        chunk = f.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        connectionSocket.sendall(chunk)
+        remaining -= len(chunk)
+
+
+class Shutdown(Exception):
+    # raised from the SIGTERM handler to unwind the accept loop
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"{status} {REASONS[status]}")
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # lower-cased names
+
+    def keep_alive(self):
+        tokens = [t.strip().lower() for t in self.headers.get("connection", "").split(",")]
+        if "close" in tokens:
+            return False
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in tokens
+        return True
+
+
+class RequestParser:
+    """Incremental HTTP/1.x request parser.
+
+    Bytes are fed in as they arrive from the socket; complete requests come
+    out of next_request() in order, so a request split over several reads
+    or several pipelined requests in one read are both handled.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pos = 0            # start of the first unparsed request
+        self.pending = None     # parsed head still waiting for its body
+        self.body_left = 0
+
+    def feed(self, data):
+        if self.pos and self.pos == len(self.buffer):
+            # everything so far was consumed, start over instead of growing
+            del self.buffer[:]
+            self.pos = 0
+        self.buffer += data
+
+    def next_request(self):
+        if self.pending is None:
+            end = self.buffer.find(b"\r\n\r\n", self.pos)
+            if end < 0:
+                if len(self.buffer) - self.pos > MAX_HEADER_SIZE:
+                    raise HTTPError(431)
+                return None
+            head = bytes(self.buffer[self.pos:end]).decode("latin-1")
+            self.pos = end + 4
+            self.pending = self._parse_head(head)
+            if self.pending is None:
+                # stray blank lines between requests are allowed
+                return self.next_request()
+
+        # we never look at request bodies, but they must be skipped so the
+        # next pipelined request starts in the right place
+        available = len(self.buffer) - self.pos
+        skipped = min(available, self.body_left)
+        self.pos += skipped
+        self.body_left -= skipped
+        if self.body_left:
+            return None
+
+        request, self.pending = self.pending, None
+        if self.pos == len(self.buffer):
+            del self.buffer[:]
+            self.pos = 0
+        elif self.pos > RECV_SIZE:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        return request
+
+    def _parse_head(self, head):
+        lines = head.lstrip("\r\n").split("\r\n")
+        if not lines[0]:
+            return None
+        parts = lines[0].split()
+        if len(parts) != 3:
+            raise HTTPError(400)
+        method, target, version = parts
+        if not version.startswith("HTTP/1."):
+            raise HTTPError(505)
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPError(400)
+            name = name.strip().lower()
+            value = value.strip()
+            if name in headers:
+                headers[name] += ", " + value
+            else:
+                headers[name] = value
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            # no chunked request bodies here
+            raise HTTPError(501)
+        try:
+            self.body_left = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400)
+        if self.body_left < 0:
+            raise HTTPError(400)
+        return Request(method, target, version, headers)
+
+
+class FileInfo:
+    # what we need to know about a file to answer (conditional) requests for it
+    def __init__(self, path, st):
+        self.path = path
+        self.content_type = content_type(path)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.mtime = st.st_mtime_ns // 1_000_000_000
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.compressible = (
+            compress_min is not None
+            and self.size >= compress_min
+            and self.content_type.startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def encoded_etag(self, encoding):
+        # each encoding is a different representation and needs its own tag
+        if encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    def headers(self, encoding=None):
+        headers = [
+            ("Content-Type", self.content_type),
+            ("ETag", self.encoded_etag(encoding)),
+            ("Last-Modified", self.last_modified),
+            ("Accept-Ranges", "bytes"),
+        ]
+        if encoding is not None:
+            headers.append(("Content-Encoding", encoding))
+        if self.compressible:
+            headers.append(("Vary", "Accept-Encoding"))
+        return headers
+
+
+class Variant:
+    # one representation (identity, gzip, deflate) of a file held in memory
+    def __init__(self, info, encoding, body):
+        self.encoding = encoding
+        self.body = body
+        # encoded status and header lines of the full 200, minus Connection
+        self.header = build_header(200, info.headers(encoding) + [("Content-Length", len(body))])
+
+    def cost(self):
+        return len(self.header) + len(self.body)
+
+
+class CacheEntry:
+    def __init__(self, info, body):
+        self.info = info
+        self.body = body
+        self.variants = {None: Variant(info, None, body)}
+        self.checked = time.monotonic()
+
+    def cost(self):
+        return sum(v.cost() for v in self.variants.values())
+
+
+class FileCache:
+    """LRU cache of ready-to-send responses, bounded by total bytes.
+
+    Entries are revalidated against os.stat (mtime and size) at most once
+    every validate_interval seconds, so a hot file is served from memory
+    without any filesystem calls in between.
+    """
+
+    def __init__(self, capacity, max_entry, validate_interval):
+        self.capacity = capacity
+        self.max_entry = max_entry
+        self.validate_interval = validate_interval
+        self.entries = OrderedDict()    # path -> CacheEntry, oldest first
+        self.used = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            now = time.monotonic()
+            if now - entry.checked < self.validate_interval:
+                self.hits += 1
+                return entry
+
+        # stat outside the lock, it may block on the disk
+        try:
+            st = os.stat(path)
+            valid = st.st_mtime_ns == entry.info.mtime_ns and st.st_size == entry.info.size
+        except OSError:
+            valid = False
+
+        with self.lock:
+            if valid:
+                entry.checked = now
+                self.hits += 1
+                return entry
+            if self.entries.get(path) is entry:
+                self._remove(path)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, path, entry):
+        if entry.cost() > self.max_entry or entry.cost() > self.capacity:
+            return
+        with self.lock:
+            if path in self.entries:
+                self._remove(path)
+            self.entries[path] = entry
+            self.used += entry.cost()
+            while self.used > self.capacity:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def add_variant(self, path, entry, variant):
+        # compressed bodies count against the same memory budget
+        with self.lock:
+            if variant.encoding in entry.variants:
+                return
+            entry.variants[variant.encoding] = variant
+            if self.entries.get(path) is not entry:
+                return
+            self.used += variant.cost()
+            while self.used > self.capacity and self.entries:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, path):
+        entry = self.entries.pop(path)
+        self.used -= entry.cost()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "bytes": self.used,
+                "capacity": self.capacity,
+            }
+
+
+def resolve_path(target):
+    # map a request target onto a file under root, refusing to leave it
+    path = unquote(target.split("?", 1)[0])
+    relative = os.path.normpath(path.lstrip("/"))
+    if relative == "." or relative.startswith(".."):
+        return None
+    return os.path.join(root, relative)
+
+
+def build_header(status, headers):
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}"]
+    for name, value in headers:
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+
+def connection_header(keep_alive):
+    if keep_alive:
+        return f"Connection: keep-alive\r\nKeep-Alive: timeout={int(idle_timeout)}, max={max_requests}\r\n\r\n".encode()
+    return b"Connection: close\r\n\r\n"
+
+
+def send_header(connectionSocket, status, headers, keep_alive):
+    connectionSocket.sendall(build_header(status, headers) + connection_header(keep_alive))
+
+
+def send_error(connectionSocket, status, keep_alive=False, head_only=False):
+    body = f"<html><body><h1>{status} {REASONS[status]}</h1></body></html>".encode()
+    headers = [("Content-Type", "text/html"), ("Content-Length", len(body))]
+    send_header(connectionSocket, status, headers, keep_alive)
+    if not head_only:
+        connectionSocket.sendall(body)
+
+
+def send_stats(connectionSocket, keep_alive, head_only):
+    stats = cache.stats() if cache is not None else {"enabled": False}
+    stats["worker"] = os.getpid()   # each worker process has its own cache
+    body = json.dumps(stats).encode()
+    headers = [("Content-Type", "application/json"), ("Content-Length", len(body)),
+               ("Cache-Control", "no-store")]
+    send_header(connectionSocket, 200, headers, keep_alive)
+    if not head_only:
+        connectionSocket.sendall(body)
+
+
+def send_variant(connectionSocket, variant, keep_alive, head_only):
+    # header and body in a single write
+    if head_only:
+        connectionSocket.sendall(variant.header + connection_header(keep_alive))
+    else:
+        connectionSocket.sendall(b"".join((variant.header, connection_header(keep_alive), variant.body)))
+
+
+def choose_encoding(request, info):
+    # pick the preferred coding the client accepts; ranges always get identity
+    if not info.compressible or "range" in request.headers:
+        return None
+    accepted = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding] = q
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def sidecar_path(info):
+    # a precompressed file.gz next to the file, if it is at least as new
+    gz_path = info.path + ".gz"
+    try:
+        st = os.stat(gz_path)
+    except OSError:
+        return None
+    if st.st_mtime_ns < info.mtime_ns:
+        return None
+    return gz_path
+
+
+def compress(info, body, encoding):
+    if encoding == "gzip":
+        gz_path = sidecar_path(info)
+        if gz_path is not None:
+            try:
+                with open(gz_path, "rb") as f:
+                    return f.read()
+            except OSError:
+                pass
+        return gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(body, COMPRESS_LEVEL)
+
+
+def precompress(directory):
+    # write .gz sidecars for every compressible file under directory
+    written = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name.endswith(".gz"):
+                continue
+            try:
+                info = FileInfo(path, os.stat(path))
+                if not info.compressible or sidecar_path(info) is not None:
+                    continue
+                with open(path, "rb") as f:
+                    data = gzip.compress(f.read(), 9, mtime=0)
+                # write then rename so readers never see half a sidecar
+                tmp_path = f"{path}.gz.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path + ".gz")
+                written += 1
+            except OSError as e:
+                log("Could not precompress", path, e)
+    return written
+
+
+def not_modified(request, info, etag):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    tags = request.headers.get("if-none-match")
+    if tags is not None:
+        if tags.strip() == "*":
+            return True
+        for tag in tags.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    since = request.headers.get("if-modified-since")
+    if since is not None:
+        try:
+            return info.mtime <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def requested_range(request, info):
+    """Return the (first, last) byte positions asked for, or None for the whole file.
+
+    Only a single byte range is honoured; multiple ranges, malformed headers
+    and a stale If-Range all fall back to the full response.
+    """
+    value = request.headers.get("range")
+    if value is None or request.method != "GET":
+        return None
+    condition = request.headers.get("if-range")
+    if condition is not None and condition.strip() not in (info.etag, info.last_modified):
+        return None
+
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first == "":
+            # suffix range: the final `last` bytes
+            length = int(last)
+            if length <= 0:
+                raise HTTPError(416)
+            return max(0, info.size - length), info.size - 1
+        first = int(first)
+        last = int(last) if last else info.size - 1
+    except ValueError:
+        return None
+    if first >= info.size:
+        raise HTTPError(416)
+    if first > last:
+        return None
+    return first, min(last, info.size - 1)
+
+
+def send_encoded(connectionSocket, request, info, entry, encoding, keep_alive):
+    # compressed response: from memory when the file is small, otherwise
+    # straight from a .gz sidecar. Returns False if there is nothing to send.
+    head_only = request.method == "HEAD"
+    if entry is not None:
+        variant = entry.variants.get(encoding)
+        if variant is None:
+            variant = Variant(info, encoding, compress(info, entry.body, encoding))
+            if cache is not None:
+                cache.add_variant(info.path, entry, variant)
+        send_variant(connectionSocket, variant, keep_alive, head_only)
+        return True
+
+    gz_path = sidecar_path(info) if encoding == "gzip" else None
+    if gz_path is None:
+        return False
+    try:
+        f = open(gz_path, "rb")
+    except OSError:
+        return False
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        send_header(connectionSocket, 200, info.headers(encoding) + [("Content-Length", size)], keep_alive)
+        if not head_only:
+            send_file(connectionSocket, f, 0, size)
+    return True
+
+
+def send_file_response(connectionSocket, request, info, entry, f, keep_alive):
+    head_only = request.method == "HEAD"
+    encoding = choose_encoding(request, info)
+    if encoding is not None and entry is None and (encoding != "gzip" or sidecar_path(info) is None):
+        # too big to compress in memory and nothing precompressed on disk
+        encoding = None
+
+    if not_modified(request, info, info.encoded_etag(encoding)):
+        headers = [h for h in info.headers(encoding) if h[0] not in ("Content-Type", "Content-Encoding")]
+        send_header(connectionSocket, 304, headers, keep_alive)
+        return
+
+    if encoding is not None and send_encoded(connectionSocket, request, info, entry, encoding, keep_alive):
+        return
+
+    try:
+        byte_range = requested_range(request, info)
+    except HTTPError:
+        headers = [("Content-Range", f"bytes */{info.size}"), ("Content-Length", 0)]
+        send_header(connectionSocket, 416, headers, keep_alive)
+        return
+
+    if byte_range is None:
+        if entry is not None:
+            send_variant(connectionSocket, entry.variants[None], keep_alive, head_only)
+            return
+        first, count = 0, info.size
+        send_header(connectionSocket, 200, info.headers() + [("Content-Length", count)], keep_alive)
+    else:
+        first, last = byte_range
+        count = last - first + 1
+        headers = info.headers() + [
+            ("Content-Range", f"bytes {first}-{last}/{info.size}"),
+            ("Content-Length", count),
+        ]
+        send_header(connectionSocket, 206, headers, keep_alive)
+
+    if head_only:
+        return
+    #Send the content of the requested file to the client
+    if entry is not None:
+        connectionSocket.sendall(memoryview(entry.body)[first:first + count])
+    else:
+        send_file(connectionSocket, f, first, count)
+
+
+def respond(connectionSocket, request, keep_alive):
+    if request.method not in ("GET", "HEAD"):
+        send_error(connectionSocket, 501, keep_alive)
+        return
+
+    if request.target.split("?", 1)[0] == STATS_PATH:
+        send_stats(connectionSocket, keep_alive, request.method == "HEAD")
+        return
+
+    log("Requested file:", request.target[1:])
+    path = resolve_path(request.target)
+    if path is not None and cache is not None:
+        entry = cache.get(path)
+        if entry is not None:
+            send_file_response(connectionSocket, request, entry.info, entry, None, keep_alive)
+            return
+
+    try:
+        if path is None:
+            raise FileNotFoundError(request.target)
+        f = open(path, "rb")
     except IOError as e:
         #Send response message for file not found
         # Fill in start
-        print("IOError: ", e)
-        print("Error finding file:", filename[1:])
-        header = "HTTP/1.1 404 Not Found\r\nContent-Type: text/html\r\n\r\n"
-        body = "<html><body><h1>404 Not Found</h1></body></html>"
-        connectionSocket.send(header.encode())
-        connectionSocket.send(body.encode())
+        log("IOError: ", e)
+        log("Error finding file:", request.target[1:])
+        send_error(connectionSocket, 404, keep_alive, request.method == "HEAD")
         # Fill in end
+        return
+
+    with f:
+        info = FileInfo(path, os.fstat(f.fileno()))
+        entry = None
+        if info.size <= cache_max_entry:
+            # small enough to keep: read it once and serve from memory next time
+            body = f.read()
+            if len(body) == info.size:
+                entry = CacheEntry(info, body)
+                if cache is not None:
+                    cache.put(path, entry)
+            else:
+                # the file changed under us, stream it instead of caching
+                f.seek(0)
+                info = FileInfo(path, os.fstat(f.fileno()))
+        send_file_response(connectionSocket, request, info, entry, f, keep_alive)
+
+
+class Connection:
+    """A client connection and the requests read from it but not yet served."""
+
+    def __init__(self, connectionSocket, addr):
+        self.socket = connectionSocket
+        self.addr = addr
+        self.parser = RequestParser()
+        self.served = 0
+        self.deadline = None    # when it is closed for idling, while parked
+        connectionSocket.settimeout(idle_timeout)
+        # header and body go out in separate writes; without this Nagle holds the
+        # body back until the client's delayed ACK on every keep-alive request
+        connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+    def read(self):
+        # False once the client has closed its end
+        data = self.socket.recv(RECV_SIZE)
+        if not data:
+            return False
+        self.parser.feed(data)
+        return True
+
+    def readable(self, wait):
+        # whether the next request starts arriving within `wait` seconds
+        self.socket.settimeout(wait)
+        try:
+            return bool(self.socket.recv(1, MSG_PEEK))
+        except timeout:
+            return False
+        finally:
+            self.socket.settimeout(idle_timeout)
+
+    def serve_buffered(self):
+        # answer every complete request read so far; True if the connection
+        # stays open for more, False if it should be closed
+        while self.served < max_requests:
+            try:
+                request = self.parser.next_request()
+            except HTTPError as e:
+                send_error(self.socket, e.status)
+                return False
+            if request is None:
+                return True
+            self.served += 1
+            keep_alive = request.keep_alive() and self.served < max_requests
+            respond(self.socket, request, keep_alive)
+            if not keep_alive:
+                return False
+        return False
 
+
+def handle_connection(connectionSocket, addr):
+    # serve requests on one connection until the client closes it, it idles
+    # past idle_timeout, asks for close, or hits max_requests
+    connection = Connection(connectionSocket, addr)
+    try:
+        while connection.serve_buffered() and connection.read():
+            pass
+    except timeout:
+        # idle keep-alive connection, reclaim the worker
+        pass
+    except OSError as e:
+        # the client went away part way through
+        log("Connection error:", e)
+    finally:
         #Close client socket
         # Fill in start
         connectionSocket.close()
         # Fill in end
 
-serverSocket.close()
 
+def serve_serial(serverSocket):
+    # one connection at a time, the original lab behaviour
+    while True:
+        #Establish the connection
+        log('Ready to serve...')
+        connectionSocket, addr = serverSocket.accept()
+        handle_connection(connectionSocket, addr)
+
+
+def serve_pool(serverSocket, threads):
+    # the main thread select()s over the listening socket and every idle
+    # connection; a connection only gets a pool thread once it has something
+    # to read, and goes back to the selector when its requests are answered,
+    # so idle keep-alive clients never hold a thread. A client that sends its
+    # next request right away is served on the same thread, saving the trip
+    # through the selector, unless other connections are waiting for one.
+    # With threads * 2
+    # connections being served or queued we stop accepting, and further
+    # clients wait in the kernel backlog instead of in our memory.
+    limit = threads * 2
+    selector = selectors.DefaultSelector()
+    wake_r, wake_w = socketpair()   # a byte here wakes select() when a thread is done
+    wake_r.setblocking(False)
+    finished = deque()              # (connection, keep it open), from the pool threads
+    idle = []                       # heap of (deadline, serial, connection)
+    serial = itertools.count()
+    busy = 0
+
+    def run(connection):
+        keep = False
+        try:
+            while True:
+                # a response cut short by a timeout or error leaves the
+                # stream mid-body: such a connection must close, not park
+                keep = False
+                keep = connection.read() and connection.serve_buffered()
+                if not keep or busy > threads or not connection.readable(KEEP_ALIVE_LINGER):
+                    break
+        except timeout:
+            pass
+        except OSError as e:
+            log("Connection error:", e)
+        finally:
+            finished.append((connection, keep))
+            wake_w.send(b"\0")
+
+    def park(connection):
+        connection.deadline = time.monotonic() + idle_timeout
+        selector.register(connection.socket, selectors.EVENT_READ, connection)
+        heapq.heappush(idle, (connection.deadline, next(serial), connection))
+
+    selector.register(wake_r, selectors.EVENT_READ)
+    selector.register(serverSocket, selectors.EVENT_READ)
+    accepting = True
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="Worker") as pool:
+            log(f'Ready to serve with {threads} threads...')
+            while True:
+                wait = max(0.0, idle[0][0] - time.monotonic()) if idle else None
+                for key, _ in selector.select(wait):
+                    if key.fileobj is serverSocket:
+                        connectionSocket, addr = serverSocket.accept()
+                        park(Connection(connectionSocket, addr))
+                    elif key.fileobj is wake_r:
+                        while True:
+                            try:
+                                wake_r.recv(4096)
+                            except BlockingIOError:
+                                break
+                    else:
+                        connection = key.data
+                        selector.unregister(connection.socket)
+                        connection.deadline = None
+                        busy += 1
+                        pool.submit(run, connection)
+
+                while finished:
+                    connection, keep = finished.popleft()
+                    busy -= 1
+                    if keep:
+                        park(connection)
+                    else:
+                        connection.socket.close()
+
+                if accepting and busy >= limit:
+                    selector.unregister(serverSocket)
+                    accepting = False
+                elif not accepting and busy < limit:
+                    selector.register(serverSocket, selectors.EVENT_READ)
+                    accepting = True
+
+                # close connections idle past idle_timeout; entries for ones
+                # served since they were parked are stale
+                now = time.monotonic()
+                while idle and idle[0][0] <= now:
+                    deadline, _, connection = heapq.heappop(idle)
+                    if connection.deadline == deadline:
+                        selector.unregister(connection.socket)
+                        connection.socket.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            if isinstance(key.data, Connection):
+                key.data.socket.close()
+        selector.close()
+        wake_r.close()
+        wake_w.close()
+
+
+def make_server_socket(port, backlog, reuse_port=False):
+    serverSocket = socket(AF_INET, SOCK_STREAM)
+    #Prepare a sever socket
+    #Fill in start
+    serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    serverSocket.bind(("localhost", port))
+    serverSocket.listen(backlog)
+    #Fill in end
+    return serverSocket
+
+
+def raise_shutdown(signum, frame):
+    raise Shutdown()
+
+
+def serve(serverSocket, mode, threads):
+    # print("Current working directory:", os.getcwd())
+    try:
+        if mode == "serial":
+            serve_serial(serverSocket)
+        else:
+            serve_pool(serverSocket, threads)
+    except (KeyboardInterrupt, Shutdown):
+        log("Exiting server.")
+    finally:
+        serverSocket.close()
+
+
+def start_worker(args, inherited):
+    pid = os.fork()
+    if pid:
+        return pid
+    # child: with SO_REUSEPORT every worker has its own listening socket and
+    # the kernel spreads new connections across them; otherwise all workers
+    # accept from the one socket inherited from the supervisor
+    status = 0
+    try:
+        signal.signal(signal.SIGTERM, raise_shutdown)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)   # the supervisor handles Ctrl-C
+        if inherited is None:
+            serverSocket = make_server_socket(args.port, args.backlog, reuse_port=True)
+        else:
+            serverSocket = inherited
+        serve(serverSocket, args.mode, args.threads)
+    except BaseException as e:
+        print(f"Worker {os.getpid()} failed: {e!r}")
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def supervise(args):
+    """Prefork args.workers server processes and keep that many running.
+
+    Workers that exit unexpectedly are restarted. SIGTERM or Ctrl-C stops
+    the group: workers get SIGTERM, finish what they are serving, and are
+    killed if they are still around after SHUTDOWN_GRACE seconds.
+    """
+    inherited = None
+    if SO_REUSEPORT is None:
+        inherited = make_server_socket(args.port, args.backlog)
+
+    signal.signal(signal.SIGTERM, raise_shutdown)
+    children = {}   # pid -> start time
+    try:
+        for _ in range(args.workers):
+            children[start_worker(args, inherited)] = time.monotonic()
+        print(f"Supervisor {os.getpid()} started {args.workers} workers on port {args.port}")
+
+        while True:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            print(f"Worker {pid} exited with status {status}, restarting")
+            if time.monotonic() - started < RESTART_DELAY:
+                # crashing on startup; don't spin forking
+                time.sleep(RESTART_DELAY)
+            children[start_worker(args, inherited)] = time.monotonic()
+    except (KeyboardInterrupt, Shutdown):
+        print("Stopping workers...")
+
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + SHUTDOWN_GRACE
+    while children and time.monotonic() < deadline:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.05)
+            continue
+        children.pop(pid, None)
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    if inherited is not None:
+        inherited.close()
+    print("Exiting server.")
+
+
+def main():
+    global verbose, root, idle_timeout, max_requests, cache, cache_max_entry, compress_min
+
+    parser = argparse.ArgumentParser(description="Simple HTTP web server.")
+    parser.add_argument("--port", help="Port.", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backlog", help="Listen backlog.", type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument("--threads", help="Threads per process in pool mode.", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--workers", help="Server processes to prefork (Unix only).",
+                        type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--mode",
+        help="serial serves one connection at a time, pool serves them concurrently.",
+        choices=["serial", "pool"],
+        default="pool",
+    )
+    parser.add_argument("--root", help="Directory files are served from.", default=".")
+    parser.add_argument("--idle-timeout", help="Seconds an idle keep-alive connection is kept open.",
+                        type=float, default=DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument("--max-requests", help="Requests served per connection before closing it.",
+                        type=int, default=DEFAULT_MAX_REQUESTS)
+    parser.add_argument("--cache-size", help="Bytes of responses cached in memory, 0 disables the cache.",
+                        type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--cache-max-entry", help="Largest file kept in the cache, in bytes.",
+                        type=int, default=DEFAULT_CACHE_MAX_ENTRY)
+    parser.add_argument("--cache-validate", help="Seconds between mtime/size checks of a cached file.",
+                        type=float, default=DEFAULT_CACHE_VALIDATE)
+    parser.add_argument("--compress-min", help="Smallest body in bytes that is sent compressed.",
+                        type=int, default=DEFAULT_COMPRESS_MIN)
+    parser.add_argument("--no-compress", help="Never compress responses.", action="store_true")
+    parser.add_argument("--precompress", help="Write .gz sidecars for compressible files under root at startup.",
+                        action="store_true")
+    parser.add_argument("-q", "--quiet", help="Do not print per-request messages.", action="store_true")
+    args = parser.parse_args()
+    verbose = not args.quiet
+    root = args.root
+    idle_timeout = args.idle_timeout
+    max_requests = args.max_requests
+    cache_max_entry = args.cache_max_entry
+    compress_min = None if args.no_compress else args.compress_min
+    if args.cache_size > 0:
+        cache = FileCache(args.cache_size, args.cache_max_entry, args.cache_validate)
+    if args.precompress and compress_min is not None:
+        print(f"Precompressed {precompress(root)} files.")
+
+    if args.workers > 1:
+        if not hasattr(os, "fork"):
+            parser.error("--workers needs os.fork, run a single process on this platform")
+        supervise(args)
+        return
+
+    signal.signal(signal.SIGTERM, raise_shutdown)
+    serve(make_server_socket(args.port, args.backlog), args.mode, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+# WebServerBench.py
+# Load generator for WebServer.py: reports requests/sec and p50/p99 latency
+# at several levels of client concurrency, or file transfer throughput
+# for files of several sizes.
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from socket import *
+
+LAB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    k = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return samples[k]
+
+
+def fetch(host, port, path):
+    # one exchange per connection: connect, send, read until the server closes
+    clientSocket = socket(AF_INET, SOCK_STREAM)
+    clientSocket.connect((host, port))
+    clientSocket.sendall(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    received = 0
+    while True:
+        data = clientSocket.recv(65536)
+        if not data:
+            break
+        received += len(data)
+    clientSocket.close()
+    return received
+
+
+class KeepAliveClient:
+    # reuses one connection for many requests, reading responses by Content-Length
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.buffer = b""
+        self.bytes_received = 0
+        self.status = None
+        self.headers = {}
+
+    def connect(self):
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.sock.connect((self.host, self.port))
+        self.buffer = b""
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request_bytes(self, path, headers=()):
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        self.bytes_received += len(data)
+        return data
+
+    def read_response(self):
+        while b"\r\n\r\n" not in self.buffer:
+            data = self._recv()
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.buffer += data
+        head, _, rest = self.buffer.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        self.status = int(lines[0].split()[1])
+        self.headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            self.headers[name.strip().lower()] = value.strip()
+        length = int(self.headers.get("content-length", 0))
+        while len(rest) < length:
+            data = self._recv()
+            if not data:
+                raise ConnectionError("short response body")
+            rest += data
+        self.buffer = rest[length:]
+        if self.headers.get("connection", "").lower() == "close":
+            self.close()
+        return length
+
+    def get(self, path, headers=()):
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(self.request_bytes(path, headers))
+        return self.read_response()
+
+    def fetch_many(self, path, count):
+        # send `count` pipelined requests in one write, then read the answers
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(self.request_bytes(path) * count)
+        for _ in range(count):
+            self.read_response()
+
+
+def run_level(host, port, path, clients, total_requests, keep_alive=False, pipeline=1):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = max(1, total_requests // clients)
+
+    def client():
+        mine = []
+        conn = KeepAliveClient(host, port)
+        batch = pipeline if keep_alive else 1
+        for _ in range(max(1, per_client // batch)):
+            start = time.perf_counter()
+            try:
+                if keep_alive:
+                    conn.fetch_many(path, batch)
+                else:
+                    fetch(host, port, path)
+            except OSError:
+                conn.close()
+                with lock:
+                    errors[0] += 1
+                continue
+            # a pipelined batch counts as `batch` requests sharing one latency
+            mine.extend([time.perf_counter() - start] * batch)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies, errors[0]
+
+
+def run_level_procs(host, port, path, clients, total_requests, keep_alive=False, pipeline=1, procs=1):
+    # spread the clients over several processes so the load generator's own
+    # GIL is not what limits a multi-process server
+    if procs <= 1:
+        return run_level(host, port, path, clients, total_requests, keep_alive, pipeline)
+    share = [(host, port, path, max(1, clients // procs), max(1, total_requests // procs),
+              keep_alive, pipeline)] * procs
+    with multiprocessing.Pool(procs) as pool:
+        results = pool.starmap(run_level, share)
+    rps = sum(r[0] for r in results)
+    latencies = [l for r in results for l in r[1]]
+    errors = sum(r[2] for r in results)
+    return rps, latencies, errors
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def make_files(directory, sizes):
+    # random-ish binary content so nothing along the way can shortcut it
+    names = []
+    block = os.urandom(1024 * 1024)
+    for text in sizes:
+        size = parse_size(text)
+        name = f"bench_{text}.bin"
+        with open(os.path.join(directory, name), "wb") as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:min(len(block), remaining)])
+                remaining -= min(len(block), remaining)
+        names.append((text, name, size))
+    return names
+
+
+def run_files(host, port, files, min_bytes, min_requests, max_requests):
+    print(f"{'file':>8} {'requests':>9} {'MB/s':>10} {'req/s':>10}")
+    for text, name, size in files:
+        requests = min(max_requests, max(min_requests, min_bytes // max(size, 1)))
+        start = time.perf_counter()
+        for _ in range(requests):
+            received = fetch(host, port, "/" + name)
+            if received < size:
+                raise RuntimeError(f"short response for {name}: {received} < {size}")
+        elapsed = time.perf_counter() - start
+        mbps = requests * size / elapsed / (1024 * 1024)
+        print(f"{text:>8} {requests:>9} {mbps:>10.1f} {requests / elapsed:>10.1f}")
+
+
+def process_cpu(pid):
+    # user + system CPU seconds of a process, from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run_compression(host, port, paths, requests, pid):
+    # wire bytes and server CPU per request for each Accept-Encoding
+    conn = KeepAliveClient(host, port)
+    print(f"{'path':>20} {'accept':>9} {'served as':>10} {'wire B/req':>11} {'server CPU us/req':>18}")
+    for path in paths:
+        for accept in ("identity", "gzip", "deflate"):
+            headers = [("Accept-Encoding", accept)]
+            conn.get(path, headers)    # warm up (and fill the cache)
+            served = conn.headers.get("content-encoding", "identity")
+            cpu_before = process_cpu(pid) if pid else None
+            before = conn.bytes_received
+            for _ in range(requests):
+                conn.get(path, headers)
+            wire = (conn.bytes_received - before) / requests
+            if cpu_before is None:
+                cpu = "n/a"
+            else:
+                cpu = f"{(process_cpu(pid) - cpu_before) / requests * 1e6:.1f}"
+            print(f"{path:>20} {accept:>9} {served:>10} {wire:>11.0f} {cpu:>18}")
+    conn.close()
+
+
+def run_repeat_visit(host, port, paths, visits):
+    # a browser-like client: the first visit fetches everything, later visits
+    # revalidate with the ETag / Last-Modified it was given
+    conn = KeepAliveClient(host, port)
+    validators = {}
+    print(f"{'visit':>6} {'200':>5} {'304':>5} {'wire bytes':>12} {'saved':>8}")
+    first_bytes = None
+    for visit in range(1, visits + 1):
+        before = conn.bytes_received
+        counts = {200: 0, 304: 0}
+        for path in paths:
+            headers = []
+            if path in validators:
+                etag, modified = validators[path]
+                headers = [("If-None-Match", etag), ("If-Modified-Since", modified)]
+            conn.get(path, headers)
+            counts[conn.status] = counts.get(conn.status, 0) + 1
+            if conn.status == 200:
+                validators[path] = (conn.headers.get("etag", ""), conn.headers.get("last-modified", ""))
+        wire = conn.bytes_received - before
+        if first_bytes is None:
+            first_bytes = wire
+        saved = 100 * (1 - wire / first_bytes) if first_bytes else 0
+        print(f"{visit:>6} {counts[200]:>5} {counts[304]:>5} {wire:>12} {saved:>7.1f}%")
+    conn.close()
+
+
+def run_resume(host, port, path, size, cut):
+    # download the first `cut` bytes, then resume the rest with a Range request
+    conn = KeepAliveClient(host, port)
+    conn.get(path, [("Range", f"bytes=0-{cut - 1}")])
+    first = conn.headers.get("content-range")
+    etag = conn.headers.get("etag", "")
+    before = conn.bytes_received
+    conn.get(path, [("Range", f"bytes={cut}-"), ("If-Range", etag)])
+    print(f"first part: {first}, status {conn.status} resumed: {conn.headers.get('content-range')}")
+    print(f"resume moved {conn.bytes_received - before} bytes instead of {size}")
+    conn.close()
+
+
+def wait_for_port(host, port, deadline=5.0):
+    end = time.time() + deadline
+    while time.time() < end:
+        try:
+            s = create_connection((host, port), timeout=0.2)
+            s.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def start_server(port, server_args, cwd=LAB_DIR):
+    script = os.path.join(LAB_DIR, "WebServer.py")
+    cmd = [sys.executable, script, "--port", str(port), "--quiet"] + server_args
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL)
+    wait_for_port("localhost", port)
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebServer load generator.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=7031)
+    parser.add_argument("--path", default="/HelloWorld.html")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per concurrency level.")
+    parser.add_argument(
+        "--connection",
+        choices=["close", "keep-alive", "both"],
+        default="close",
+        help="Open a new connection per request, reuse one per client, or compare the two.",
+    )
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="Requests written back to back per round trip on keep-alive connections.")
+    parser.add_argument(
+        "--no-spawn",
+        action="store_true",
+        help="Benchmark an already running server instead of starting one.",
+    )
+    parser.add_argument(
+        "--file-sizes",
+        nargs="+",
+        metavar="SIZE",
+        help="Measure transfer throughput for generated files of these sizes (e.g. 1K 1M 100M).",
+    )
+    parser.add_argument("--min-bytes", type=parse_size, default=parse_size("256M"),
+                        help="Bytes to move per file size in --file-sizes mode.")
+    parser.add_argument(
+        "--repeat-visit",
+        type=int,
+        metavar="VISITS",
+        help="Fetch --paths this many times, revalidating with ETags after the first.",
+    )
+    parser.add_argument(
+        "--compression",
+        type=int,
+        metavar="REQUESTS",
+        help="Compare wire bytes and server CPU per request for identity, gzip and deflate on --paths.",
+    )
+    parser.add_argument("--paths", nargs="+", default=["/HelloWorld.html", "/HelloStyle.html"],
+                        help="Paths used by --repeat-visit and --compression.")
+    parser.add_argument(
+        "--scale-workers",
+        type=int,
+        nargs="+",
+        metavar="N",
+        help="Start the server with --workers N for each N and report throughput at the largest --clients.",
+    )
+    parser.add_argument("--load-procs", type=int, default=1,
+                        help="Processes generating load (use about as many as the server has cores).")
+    parser.add_argument("--min-requests", type=int, default=5)
+    parser.add_argument("--max-requests", type=int, default=5000)
+    args, server_args = parser.parse_known_args()
+
+    if args.file_sizes:
+        directory = tempfile.mkdtemp(prefix="webbench")
+        proc = None
+        try:
+            files = make_files(directory, args.file_sizes)
+            if not args.no_spawn:
+                # serve from the temp dir by running the server there
+                proc = start_server(args.port, server_args, cwd=directory)
+            run_files(args.host, args.port, files, args.min_bytes, args.min_requests,
+                      args.max_requests)
+            text, name, size = files[-1]
+            run_resume(args.host, args.port, "/" + name, size, size // 2)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+            shutil.rmtree(directory)
+        return
+
+    if args.scale_workers:
+        keep_alive = args.connection == "keep-alive"
+        clients = max(args.clients)
+        print(f"cores: {os.cpu_count()}, clients: {clients}, connection: {args.connection}")
+        print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8} {'speedup':>8}")
+        base = None
+        for workers in args.scale_workers:
+            proc = start_server(args.port, server_args + ["--workers", str(workers)])
+            try:
+                rps, latencies, errors = run_level_procs(args.host, args.port, args.path, clients, args.requests,
+                                                         keep_alive, args.pipeline, args.load_procs)
+            finally:
+                proc.terminate()
+                proc.wait()
+            base = base or rps
+            p50 = percentile(latencies, 50) * 1000
+            p99 = percentile(latencies, 99) * 1000
+            print(f"{workers:>8} {rps:>10.1f} {p50:>10.2f} {p99:>10.2f} {errors:>8} {rps / base:>7.2f}x")
+        return
+
+    proc = None
+    if not args.no_spawn:
+        proc = start_server(args.port, server_args)
+
+    try:
+        if args.repeat_visit:
+            run_repeat_visit(args.host, args.port, args.paths, args.repeat_visit)
+            return
+        if args.compression:
+            run_compression(args.host, args.port, args.paths, args.compression, proc.pid if proc else None)
+            return
+        modes = ["close", "keep-alive"] if args.connection == "both" else [args.connection]
+        print(f"{'connection':>10} {'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+        for mode in modes:
+            for clients in args.clients:
+                rps, latencies, errors = run_level_procs(args.host, args.port, args.path, clients, args.requests,
+                                                         mode == "keep-alive", args.pipeline, args.load_procs)
+                p50 = percentile(latencies, 50) * 1000
+                p99 = percentile(latencies, 99) * 1000
+                print(f"{mode:>10} {clients:>8} {rps:>10.1f} {p50:>10.2f} {p99:>10.2f} {errors:>8}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# CacheStore.py
+# On-disk object store for WebProxy.py that follows HTTP caching rules:
+# responses are kept with their headers, expire according to Cache-Control
+# and Expires, can be revalidated with their ETag / Last-Modified, and the
+# whole store is kept under a disk quota by evicting the least recently used.
+#
+# Each object is two files: the body, and a small JSON .meta file next to
+# it. Files are named by the SHA-256 of the URL and spread over 256 shard
+# directories by its first two hex digits, so names stay short whatever the
+# URL and no single directory grows huge. Both files are written under a
+# temporary name and renamed into place, so a reader never sees a partial
+# object; the .meta file is renamed last, and an object without one is
+# ignored. All lookups go through an index kept in memory, rebuilt from the
+# .meta files at startup.
+import hashlib
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+META_SUFFIX = ".meta"
+TMP_SUFFIX = ".tmp"
+SHARD_DIGITS = 2    # hex digits of the hash naming the shard directory, 256 shards
+
+# hop-by-hop headers describe one connection and are never stored
+HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-connection", b"proxy-authenticate",
+    b"proxy-authorization", b"te", b"trailer", b"upgrade", b"age",
+}
+
+
+def parse_header(header):
+    # b"HTTP/1.1 200 OK\r\nName: value..." -> (200, [(b"name", b"value"), ...])
+    lines = header.split(b"\r\n")
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        status = 0
+    fields = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(b":")
+        if sep:
+            fields.append((name.strip().lower(), value.strip()))
+    return status, fields
+
+
+def header_value(fields, name):
+    for field, value in fields:
+        if field == name:
+            return value
+    return None
+
+
+def cache_control(fields):
+    # b"max-age=60, no-cache" -> {"max-age": "60", "no-cache": ""}
+    directives = {}
+    for field, value in fields:
+        if field != b"cache-control":
+            continue
+        for item in value.decode("latin-1").split(","):
+            name, _, arg = item.strip().partition("=")
+            if name:
+                directives[name.lower()] = arg.strip('"')
+    return directives
+
+
+def http_date(value):
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value.decode("latin-1")).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def end_to_end(header):
+    # status line plus the headers worth storing / forwarding
+    lines = header.split(b"\r\n")
+    kept = [lines[0]]
+    for line in lines[1:]:
+        if line.partition(b":")[0].strip().lower() not in HOP_BY_HOP:
+            kept.append(line)
+    return b"\r\n".join(kept)
+
+
+class CacheEntry:
+    def __init__(self, key, path, size, header, stored_at, expires_at):
+        self.key = key
+        self.path = path            # body file
+        self.size = size
+        self.header = header        # end-to-end header block, no trailing blank line
+        self.stored_at = stored_at  # when the response (or its last revalidation) arrived
+        self.expires_at = expires_at
+        fields = parse_header(header)[1]
+        self.etag = header_value(fields, b"etag")
+        self.last_modified = header_value(fields, b"last-modified")
+
+    def fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def age(self, now=None):
+        return max(0, int((now or time.time()) - self.stored_at))
+
+    def validators(self):
+        # conditional request headers for revalidating this entry
+        headers = []
+        if self.etag is not None:
+            headers.append(b"If-None-Match: " + self.etag)
+        if self.last_modified is not None:
+            headers.append(b"If-Modified-Since: " + self.last_modified)
+        return headers
+
+    def to_json(self):
+        return {
+            "key": self.key,
+            "size": self.size,
+            "header": self.header.decode("latin-1"),
+            "stored_at": self.stored_at,
+            "expires_at": self.expires_at,
+        }
+
+
+class CacheStore:
+    """Index of cached objects, bounded by `quota` bytes on disk."""
+
+    def __init__(self, directory, quota, default_ttl):
+        self.directory = directory
+        self.quota = quota
+        self.default_ttl = default_ttl  # freshness for responses that give none
+        self.entries = OrderedDict()    # key -> CacheEntry, least recently used first
+        self.used = 0
+        self.evictions = 0
+        self.revalidated = 0
+        self.serial = itertools.count()  # keeps temp file names unique
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # rebuild the index from the .meta files left by an earlier run
+        loaded = []
+        for meta_path in self._scan():
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                path = meta_path[:-len(META_SUFFIX)]
+                if os.path.getsize(path) != meta["size"]:
+                    raise ValueError("size mismatch")
+            except (OSError, ValueError, KeyError):
+                os.remove(meta_path)
+                continue
+            entry = CacheEntry(meta["key"], path, meta["size"], meta["header"].encode("latin-1"),
+                               meta["stored_at"], meta["expires_at"])
+            loaded.append((os.path.getatime(path), entry))
+        for _, entry in sorted(loaded, key=lambda item: item[0]):
+            self.entries[entry.key] = entry
+            self.used += entry.size
+        self._evict()
+
+    def _scan(self):
+        # .meta files in the shard directories; leftover temp files are removed
+        with os.scandir(self.directory) as shards:
+            shard_dirs = [d.path for d in shards if d.is_dir() and len(d.name) == SHARD_DIGITS]
+        for shard in shard_dirs:
+            with os.scandir(shard) as files:
+                for f in files:
+                    if f.name.endswith(TMP_SUFFIX):
+                        os.remove(f.path)
+                    elif f.name.endswith(META_SUFFIX):
+                        yield f.path
+
+    def path_for(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:SHARD_DIGITS], digest)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def storable(self, header):
+        status, fields = parse_header(header)
+        if status != 200:
+            return False
+        directives = cache_control(fields)
+        if "no-store" in directives or "private" in directives:
+            return False
+        # worth keeping if it stays fresh for a while or can be revalidated
+        return (
+            self.lifetime(fields) > 0
+            or header_value(fields, b"etag") is not None
+            or header_value(fields, b"last-modified") is not None
+        )
+
+    def lifetime(self, fields):
+        # freshness lifetime in seconds (RFC 9111 section 4.2.1), shared-cache view
+        directives = cache_control(fields)
+        if "no-cache" in directives:
+            return 0
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                try:
+                    return max(0, int(directives[name]))
+                except ValueError:
+                    return 0
+        expires = header_value(fields, b"expires")
+        if expires is not None:
+            expires_at = http_date(expires)
+            date = http_date(header_value(fields, b"date")) or time.time()
+            return max(0, expires_at - date) if expires_at is not None else 0
+        return self.default_ttl
+
+    def expiry(self, fields, response_time):
+        # response_time minus the age the response already had when it arrived
+        age = header_value(fields, b"age")
+        try:
+            initial_age = max(0, int(age)) if age is not None else 0
+        except ValueError:
+            initial_age = 0
+        date = http_date(header_value(fields, b"date"))
+        if date is not None:
+            initial_age = max(initial_age, response_time - date)
+        return response_time - initial_age + self.lifetime(fields)
+
+    def begin(self, key):
+        # the body is written to a temp file and renamed by commit()
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{next(self.serial)}{TMP_SUFFIX}"
+        # unbuffered, so clients joining late can replay what is written so far
+        return open(tmp_path, "wb", buffering=0), tmp_path
+
+    def commit(self, key, tmp_path, header, response_time, complete):
+        if not complete:
+            os.remove(tmp_path)
+            return None
+        path = self.path_for(key)
+        header = end_to_end(header)
+        fields = parse_header(header)[1]
+        entry = CacheEntry(key, path, os.path.getsize(tmp_path), header,
+                           response_time, self.expiry(fields, response_time))
+        self.remove(key)
+        os.replace(tmp_path, path)
+        self._write_meta(entry)
+        self.entries[key] = entry
+        self.used += entry.size
+        self._evict()
+        return entry
+
+    def refresh(self, key, header_304, response_time):
+        """Apply a 304 Not Modified to a stored entry and make it fresh again."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        # headers in the 304 replace the stored ones of the same name
+        updates = end_to_end(header_304).split(b"\r\n")[1:]
+        names = {line.partition(b":")[0].strip().lower() for line in updates}
+        lines = entry.header.split(b"\r\n")
+        kept = [lines[0]] + [l for l in lines[1:] if l.partition(b":")[0].strip().lower() not in names]
+        header = b"\r\n".join(kept + updates)
+        fields = parse_header(header)[1]
+        refreshed = CacheEntry(key, entry.path, entry.size, header, response_time,
+                               self.expiry(fields, response_time))
+        self._write_meta(refreshed)
+        self.entries[key] = refreshed
+        self.entries.move_to_end(key)
+        self.revalidated += 1
+        return refreshed
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.used -= entry.size
+        # meta first: a body without meta is ignored on reload
+        for path in (entry.path + META_SUFFIX, entry.path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write_meta(self, entry):
+        tmp_path = f"{entry.path}{META_SUFFIX}.{os.getpid()}{TMP_SUFFIX}"
+        with open(tmp_path, "w") as f:
+            json.dump(entry.to_json(), f)
+        os.replace(tmp_path, entry.path + META_SUFFIX)
+
+    def _evict(self):
+        while self.used > self.quota and self.entries:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.used,
+            "quota": self.quota,
+            "evictions": self.evictions,
+            "revalidated": self.revalidated,
+        }
@@ -0,0 +1,154 @@
+# OriginPool.py
+# Persistent upstream connections for WebProxy.py. Instead of a DNS lookup,
+# a TCP handshake and a Connection: close for every miss, finished origin
+# connections are parked per (host, port) and reused by the next request to
+# the same origin. Parked connections are dropped after an idle timeout, and
+# host names are resolved through a small cache with a TTL.
+import asyncio
+import time
+from socket import SOCK_STREAM
+
+
+class Connection:
+    def __init__(self, key, reader, writer):
+        self.key = key          # (host, port)
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0       # responses read on this connection so far
+        self.idle_since = None
+
+    def reused(self):
+        return self.requests > 0
+
+    def usable(self):
+        # an origin that closed a parked connection leaves EOF in the reader
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class DNSCache:
+    """getaddrinfo() results per (host, port), kept for `ttl` seconds.
+
+    getaddrinfo does not report the record's real TTL, so one fixed TTL is
+    used for everything.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}   # (host, port) -> (addresses, expires_at)
+        self.lookups = 0
+        self.hits = 0
+
+    async def resolve(self, host, port):
+        now = time.monotonic()
+        cached = self.entries.get((host, port))
+        if cached is not None and now < cached[1]:
+            self.hits += 1
+            return cached[0]
+        self.lookups += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if self.ttl > 0:
+            self.entries[(host, port)] = (addresses, now + self.ttl)
+        return addresses
+
+    def forget(self, host, port):
+        # after a failed connect, look the name up again next time
+        self.entries.pop((host, port), None)
+
+
+class OriginPool:
+    def __init__(self, dns, idle_timeout, max_idle, connect_timeout):
+        self.dns = dns
+        self.idle_timeout = idle_timeout    # seconds a parked connection is kept, 0 disables reuse
+        self.max_idle = max_idle            # parked connections per origin
+        self.connect_timeout = connect_timeout
+        self.idle = {}                      # (host, port) -> [Connection], most recently parked last
+        self.reaper = None                  # the reap() task, between start() and close()
+        self.connects = 0
+        self.reuses = 0
+
+    async def acquire(self, host, port, fresh=False):
+        key = (host, port)
+        parked = self.idle.get(key)
+        while parked and not fresh:
+            conn = parked.pop()
+            if conn.usable() and time.monotonic() - conn.idle_since < self.idle_timeout:
+                self.reuses += 1
+                return conn
+            conn.close()
+        return await self._connect(key)
+
+    async def _connect(self, key):
+        host, port = key
+        addresses = await self.dns.resolve(host, port)
+        error = OSError(f"no addresses for {host}")
+        for address in addresses:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(address, port), self.connect_timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                error = e
+                continue
+            self.connects += 1
+            return Connection(key, reader, writer)
+        self.dns.forget(host, port)
+        raise error
+
+    def release(self, conn, reusable):
+        conn.requests += 1
+        parked = self.idle.setdefault(conn.key, [])
+        if not reusable or self.idle_timeout <= 0 or not conn.usable() or len(parked) >= self.max_idle:
+            conn.close()
+            return
+        conn.idle_since = time.monotonic()
+        parked.append(conn)
+
+    def expire(self):
+        now = time.monotonic()
+        for key, parked in list(self.idle.items()):
+            keep = []
+            for conn in parked:
+                if conn.usable() and now - conn.idle_since < self.idle_timeout:
+                    keep.append(conn)
+                else:
+                    conn.close()
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+
+    async def reap(self):
+        # close idle connections even when no new requests come in
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            self.expire()
+
+    def start(self):
+        # the loop only holds tasks weakly: keep a reference to the reaper
+        self.reaper = asyncio.create_task(self.reap())
+
+    async def close(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            try:
+                await self.reaper
+            except asyncio.CancelledError:
+                pass
+            self.reaper = None
+        for parked in self.idle.values():
+            for conn in parked:
+                conn.close()
+        self.idle.clear()
+
+    def stats(self):
+        return {
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "idle": sum(len(parked) for parked in self.idle.values()),
+            "dns_lookups": self.dns.lookups,
+            "dns_hits": self.dns.hits,
+        }
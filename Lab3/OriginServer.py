@@ -0,0 +1,172 @@
+# OriginServer.py
+# A local stand-in for the origin web servers WebProxy.py talks to, so the
+# proxy can be exercised without the internet.
+#
+#   GET /<name>?size=N&delay=MS    N bytes (default 1024) of generated
+#                                  content, sent after MS milliseconds
+#       &cache=DIRECTIVES          Cache-Control to send, e.g. max-age=60 or no-store
+#       &version=V                 changes the ETag, as if the object was edited
+#       &chunked=1                 send the body with chunked transfer-encoding
+#
+# Every object carries an ETag and Last-Modified, and a matching
+# If-None-Match / If-Modified-Since gets a 304 Not Modified.
+#   GET /__stats                   connection and request counters as JSON
+#
+# --connect-delay MS holds every new connection for MS milliseconds before
+# reading from it, standing in for the handshake round trips (TCP, TLS) a
+# real origin across the internet costs.
+import argparse
+import asyncio
+import json
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qs
+
+DEFAULT_PORT = 8080
+DEFAULT_SIZE = 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class Origin:
+    def __init__(self, connect_delay=0.0):
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.not_modified = 0
+        self.started = int(time.time())    # Last-Modified of every object
+
+    def stats(self):
+        return {"connections": self.connections, "requests": self.requests,
+                "not_modified": self.not_modified, "bytes_sent": self.bytes_sent}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split()
+                if len(parts) != 3:
+                    return
+                method, target, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                self.requests += 1
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                await self.respond(writer, method, target, headers, keep_alive)
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, target, headers, keep_alive):
+        path, _, query = target.partition("?")
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        connection = "keep-alive" if keep_alive else "close"
+
+        if path == "/__stats":
+            body = json.dumps(self.stats()).encode()
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Cache-Control: no-store\r\nConnection: {connection}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            return
+
+        delay = float(params.get("delay", 0)) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+
+        size = int(params.get("size", DEFAULT_SIZE))
+        etag = f'"{path.strip("/")}-{size}-{params.get("version", "1")}"'
+        validators = (
+            f"ETag: {etag}\r\n"
+            f"Last-Modified: {formatdate(self.started, usegmt=True)}\r\n"
+            f"Date: {formatdate(usegmt=True)}\r\n"
+        )
+        if "cache" in params:
+            validators += f"Cache-Control: {params['cache']}\r\n"
+        if self.unchanged(headers, etag):
+            self.not_modified += 1
+            writer.write(f"HTTP/1.1 304 Not Modified\r\n{validators}Connection: {connection}\r\n\r\n".encode())
+            await writer.drain()
+            return
+
+        chunked = params.get("chunked") == "1"
+        framing = "Transfer-Encoding: chunked" if chunked else f"Content-Length: {size}"
+        header = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/octet-stream\r\n"
+            f"{framing}\r\n"
+            f"{validators}"
+            f"Connection: {connection}\r\n"
+            "\r\n"
+        )
+        writer.write(header.encode())
+        if method != "HEAD":
+            # content is a repeating pattern derived from the path, so a client
+            # can check what it got without the origin holding it in memory
+            unit = len(path.encode()) + 1
+            pattern = expected_body(path, CHUNK_SIZE + unit)
+            remaining = size
+            offset = 0
+            while remaining > 0:
+                chunk = pattern[offset:offset + min(CHUNK_SIZE, remaining)]
+                if chunked:
+                    writer.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+                else:
+                    writer.write(chunk)
+                remaining -= len(chunk)
+                offset = (offset + len(chunk)) % unit
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+            self.bytes_sent += size
+        await writer.drain()
+
+    def unchanged(self, headers, etag):
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if "if-none-match" in headers:
+            return etag in [tag.strip() for tag in headers["if-none-match"].split(",")] \
+                or headers["if-none-match"] == "*"
+        if "if-modified-since" in headers:
+            try:
+                return parsedate_to_datetime(headers["if-modified-since"]).timestamp() >= self.started
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def expected_body(path, size):
+    # what the origin sends for `path` (no query string) with ?size=`size`
+    unit = path.encode() + b"\n"
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+async def serve(port, connect_delay):
+    origin = Origin(connect_delay)
+    server = await asyncio.start_server(origin.handle, "localhost", port)
+    print(f"Origin serving on port {port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in origin server.")
+    parser.add_argument("--port", help="Port.", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--connect-delay", help="Milliseconds to stall each new connection.",
+                        type=float, default=0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.connect_delay / 1000))
+    except KeyboardInterrupt:
+        print("Exiting origin.")
@@ -0,0 +1,315 @@
+# ProxyBench.py
+# Benchmarks for WebProxy.py against the local OriginServer.py.
+#
+#   python ProxyBench.py large --size 500M
+#       time to first byte, total time and proxy peak RSS for one large
+#       object, fetched once through the origin and once from the cache
+#
+#   python ProxyBench.py stampede --clients 100
+#       many clients miss on the same object at once; counts how many
+#       requests actually reached the origin
+#
+#   python ProxyBench.py small --objects 2000
+#       many distinct small objects, all misses, with and without reuse of
+#       origin connections
+#
+#   python ProxyBench.py store --entries 20000
+#       CacheStore alone: commit rate, startup index rebuild time and the
+#       largest directory, for many objects with long URLs
+#
+#   python ProxyBench.py revalidate --max-age 1
+#       repeated requests for objects that expire quickly; stale copies are
+#       revalidated with the origin instead of fetched again
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from socket import *
+
+LAB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def wait_for_port(port, deadline=5.0):
+    end = time.time() + deadline
+    while time.time() < end:
+        try:
+            s = create_connection(("localhost", port), timeout=0.2)
+            s.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+def start(script, port, extra_args=()):
+    cmd = [sys.executable, os.path.join(LAB_DIR, script), "--port", str(port)] + list(extra_args)
+    proc = subprocess.Popen(cmd, cwd=LAB_DIR, stdout=subprocess.DEVNULL)
+    wait_for_port(port)
+    return proc
+
+
+def stop(proc):
+    proc.terminate()
+    proc.wait()
+
+
+def peak_rss_mb(pid):
+    # high-water mark of resident memory, from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def timed_get(proxy_port, target):
+    # returns (time to first byte, total time, bytes received)
+    start_time = time.perf_counter()
+    s = create_connection(("localhost", proxy_port))
+    s.sendall(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    buf = bytearray(1024 * 1024)
+    first = None
+    received = 0
+    while True:
+        n = s.recv_into(buf)
+        if not n:
+            break
+        if first is None:
+            first = time.perf_counter() - start_time
+        received += n
+    s.close()
+    return first or 0.0, time.perf_counter() - start_time, received
+
+
+def get_json(port, target):
+    s = create_connection(("localhost", port))
+    s.sendall(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+    data = b""
+    while True:
+        chunk = s.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    s.close()
+    return json.loads(data.partition(b"\r\n\r\n")[2])
+
+
+def run_stampede(args):
+    cache_dir = tempfile.mkdtemp(prefix="proxybench")
+    origin = start("OriginServer.py", args.origin_port)
+    proxy = start("WebProxy.py", args.proxy_port, ["-q", "--cache-dir", cache_dir] + args.proxy_args)
+    try:
+        size = parse_size(args.size)
+        for round_no in range(args.rounds):
+            target = f"/localhost:{args.origin_port}/hot{round_no}?size={size}&delay={args.delay}"
+            results = []
+            lock = threading.Lock()
+
+            def client():
+                result = timed_get(args.proxy_port, target)
+                with lock:
+                    results.append(result)
+
+            threads = [threading.Thread(target=client) for _ in range(args.clients)]
+            start_time = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start_time
+            short = sum(1 for r in results if r[2] < size)
+            print(f"round {round_no}: {args.clients} clients in {elapsed:.2f} s, {short} short responses")
+
+        proxy_stats = get_json(args.proxy_port, "/__stats")
+        origin_stats = get_json(args.origin_port, "/__stats")
+        print(f"client requests:          {proxy_stats['requests']}")
+        print(f"origin requests:          {origin_stats['requests']}")
+        print(f"coalesced onto in-flight: {proxy_stats['coalesced']}")
+        print(f"served from cache:        {proxy_stats['cache_hits']}")
+        print(f"origin fetches avoided:   {proxy_stats['origin_fetches_avoided']}")
+    finally:
+        stop(proxy)
+        stop(origin)
+        shutil.rmtree(cache_dir)
+
+
+def run_revalidate(args):
+    cache_dir = tempfile.mkdtemp(prefix="proxybench")
+    origin = start("OriginServer.py", args.origin_port)
+    proxy = start("WebProxy.py", args.proxy_port, ["-q", "--cache-dir", cache_dir] + args.proxy_args)
+    try:
+        size = parse_size(args.size)
+        targets = [f"/localhost:{args.origin_port}/obj{i}?size={size}&cache=max-age={args.max_age}"
+                   for i in range(args.objects)]
+        client_bytes = 0
+        start_time = time.perf_counter()
+        for round_no in range(args.rounds):
+            for target in targets:
+                client_bytes += timed_get(args.proxy_port, target)[2]
+            # let everything go stale before the next pass
+            time.sleep(args.max_age + 0.1)
+        elapsed = time.perf_counter() - start_time
+        proxy_stats = get_json(args.proxy_port, "/__stats")
+        origin_stats = get_json(args.origin_port, "/__stats")
+        print(f"{args.objects} objects x {args.rounds} rounds in {elapsed:.1f} s")
+        print(f"client requests:          {proxy_stats['requests']}")
+        print(f"origin requests:          {origin_stats['requests']}")
+        print(f"answered 304:             {origin_stats['not_modified']}")
+        print(f"bytes to clients:         {client_bytes}")
+        print(f"body bytes from origin:   {origin_stats['bytes_sent']}")
+        print(f"cache:                    {proxy_stats['cache']}")
+    finally:
+        stop(proxy)
+        stop(origin)
+        shutil.rmtree(cache_dir)
+
+
+def run_small(args):
+    size = parse_size(args.size)
+    print(f"{args.objects} objects of {size} bytes, {args.clients} clients, "
+          f"origin connect delay {args.connect_delay} ms")
+    print(f"{'origin connections':>20} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'connects':>9} {'reuses':>7} {'dns lookups':>12}")
+    for label, extra in (("new per request", ["--origin-idle-timeout", "0", "--dns-ttl", "0"]), ("pooled", [])):
+        cache_dir = tempfile.mkdtemp(prefix="proxybench")
+        origin = start("OriginServer.py", args.origin_port, ["--connect-delay", str(args.connect_delay)])
+        proxy = start("WebProxy.py", args.proxy_port, ["-q", "--cache-dir", cache_dir] + extra + args.proxy_args)
+        try:
+            targets = [f"/localhost:{args.origin_port}/small{i}?size={size}" for i in range(args.objects)]
+            latencies = []
+            lock = threading.Lock()
+
+            def client(mine):
+                times = [timed_get(args.proxy_port, target)[1] for target in mine]
+                with lock:
+                    latencies.extend(times)
+
+            threads = [threading.Thread(target=client, args=(targets[i::args.clients],))
+                       for i in range(args.clients)]
+            start_time = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start_time
+            latencies.sort()
+            pool = get_json(args.proxy_port, "/__stats")["origin"]
+            print(f"{label:>20} {len(latencies) / elapsed:>8.0f} {latencies[len(latencies) // 2] * 1000:>8.2f} "
+                  f"{latencies[int(len(latencies) * 0.99)] * 1000:>8.2f} {pool['connects']:>9} {pool['reuses']:>7} "
+                  f"{pool['dns_lookups']:>12}")
+        finally:
+            stop(proxy)
+            stop(origin)
+            shutil.rmtree(cache_dir)
+
+
+def run_store(args):
+    sys.path.insert(0, LAB_DIR)
+    from CacheStore import CacheStore
+
+    cache_dir = tempfile.mkdtemp(prefix="proxybench")
+    try:
+        store = CacheStore(cache_dir, 2 ** 40, 60)
+        header = f"HTTP/1.1 200 OK\r\nContent-Length: {args.size}".encode()
+        body = b"x" * args.size
+        pad = "p" * args.url_length
+        start_time = time.perf_counter()
+        for i in range(args.entries):
+            key = f"localhost:8080/{pad}/object{i}"
+            f, tmp_path = store.begin(key)
+            f.write(body)
+            f.close()
+            store.commit(key, tmp_path, header, time.time(), True)
+        commit_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        reloaded = CacheStore(cache_dir, 2 ** 40, 60)
+        load_time = time.perf_counter() - start_time
+        widest = max(len(files) for _, _, files in os.walk(cache_dir))
+        print(f"{args.entries} objects, URLs of {args.url_length + 30} chars")
+        print(f"commits/s:              {args.entries / commit_time:.0f}")
+        print(f"index rebuild:          {load_time:.2f} s ({len(reloaded.entries)} entries)")
+        print(f"largest directory:      {widest} files")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def run_large(args):
+    cache_dir = tempfile.mkdtemp(prefix="proxybench")
+    origin = start("OriginServer.py", args.origin_port)
+    proxy = start("WebProxy.py", args.proxy_port, ["-q", "--cache-dir", cache_dir] + args.proxy_args)
+    try:
+        size = parse_size(args.size)
+        target = f"/localhost:{args.origin_port}/large?size={size}"
+        print(f"object: {args.size} ({size} bytes)")
+        print(f"{'fetch':>8} {'TTFB ms':>10} {'total s':>9} {'MB/s':>9} {'proxy peak RSS MB':>18}")
+        for label in ("miss", "hit"):
+            ttfb, total, received = timed_get(args.proxy_port, target)
+            if received < size:
+                print(f"short response: {received} bytes")
+            print(f"{label:>8} {ttfb * 1000:>10.1f} {total:>9.2f} {received / total / 2 ** 20:>9.1f} "
+                  f"{peak_rss_mb(proxy.pid):>18.1f}")
+    finally:
+        stop(proxy)
+        stop(origin)
+        shutil.rmtree(cache_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebProxy benchmarks.")
+    parser.add_argument("--proxy-port", type=int, default=7032)
+    parser.add_argument("--origin-port", type=int, default=8082)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    large = sub.add_parser("large", help="TTFB and peak RSS for one large object.")
+    large.add_argument("--size", default="500M")
+    large.set_defaults(func=run_large)
+
+    stampede = sub.add_parser("stampede", help="Concurrent misses on the same object.")
+    stampede.add_argument("--clients", type=int, default=100)
+    stampede.add_argument("--size", default="1M")
+    stampede.add_argument("--delay", type=int, default=200, help="Origin delay in ms.")
+    stampede.add_argument("--rounds", type=int, default=3, help="Distinct objects, one stampede each.")
+    stampede.set_defaults(func=run_stampede)
+
+    small = sub.add_parser("small", help="Many small misses, with and without origin keep-alive.")
+    small.add_argument("--objects", type=int, default=2000)
+    small.add_argument("--size", default="1K")
+    small.add_argument("--clients", type=int, default=8)
+    small.add_argument("--connect-delay", type=float, default=0, help="Origin connection setup delay in ms.")
+    small.set_defaults(func=run_small)
+
+    store = sub.add_parser("store", help="CacheStore commit and startup costs.")
+    store.add_argument("--entries", type=int, default=20000)
+    store.add_argument("--size", type=int, default=1024)
+    store.add_argument("--url-length", type=int, default=300)
+    store.set_defaults(func=run_store)
+
+    revalidate = sub.add_parser("revalidate", help="Conditional requests for expired objects.")
+    revalidate.add_argument("--objects", type=int, default=20)
+    revalidate.add_argument("--size", default="256K")
+    revalidate.add_argument("--max-age", type=int, default=1)
+    revalidate.add_argument("--rounds", type=int, default=3)
+    revalidate.set_defaults(func=run_revalidate)
+
+    args, args.proxy_args = parser.parse_known_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,140 +1,538 @@
-from socket import *
-import os
-
-# Create a server socket, bind it to a port and start listening
-proxySerSock = socket(AF_INET, SOCK_STREAM)
-#fill in start.
-serverPort = 7030
-proxySerSock.bind(("localhost", serverPort))
-proxySerSock.listen(1)
-#fill in end.
-
-while 1:
-    print('Ready to serve...')
-    #accept connection from clients
-    proxyCliSock, addr = proxySerSock.accept()
-    print('Received a connection from:', addr)
-
-    # get the http request from client
-    message = proxyCliSock.recv(1024).decode()
-    print(message)
-
-    # if message is not a GET request send a response 400 Bad request to the client
-    #close the connection and go to the next iteration of while loop waiting for another request
-    #from the same or a different client
-    if not message.startswith("GET"):
-        print("message is not a GET")
-        # fill in start.
-        header = "400 BAD REQUEST\r\n\r\n"
-        proxyCliSock.send(header.encode())
-        # fill in end.
-        continue
-
-    # Extract the pathname(including the filename) and hostname from the given message
-    slashPlusUrl = message.split()[1]
-    url = slashPlusUrl.partition("/")[2]
-    # fill in start
-    hostn = url.split("/")[0]
-    pathname = "/".join(url.split("/")[1:])
-    # fill in end.
+import argparse
+import asyncio
+import json
+import mmap
+import time
+
+from CacheStore import CacheStore, end_to_end, header_value, parse_header
+from OriginPool import DNSCache, OriginPool
+
+DEFAULT_PORT = 7030
+ORIGIN_PORT = 80
+DEFAULT_ORIGIN_LIMIT = 8    # concurrent connections the proxy opens to one origin
+RECV_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+CLIENT_TIMEOUT = 30.0       # seconds to wait for a client's request
+ORIGIN_TIMEOUT = 30.0       # seconds to wait on an origin connect or read
+STATS_PATH = "/__stats"
+DEFAULT_CACHE_QUOTA = 1024 ** 3     # bytes of cached objects kept on disk
+DEFAULT_TTL = 60    # seconds a response without Cache-Control/Expires stays fresh
+DEFAULT_ORIGIN_IDLE = 15.0  # seconds an unused origin connection is kept open
+DEFAULT_DNS_TTL = 60        # seconds a resolved origin address is reused
+
+verbose = True
+
+
+def log(*args):
+    if verbose:
+        print(*args)
+
+
+def parse_target(target):
+    # the client asks for either /host[:port]/path (the lab's browser form)
+    # or http://host[:port]/path (the form real proxy clients send)
+    if target.startswith("http://"):
+        url = target[len("http://"):]
+    else:
+        url = target.partition("/")[2]
+    hostn, _, pathname = url.partition("/")
     pathname = "/" + pathname
     # remove "www." from the hostname if it starts with "www."
     if hostn.startswith("www."):
         hostn = hostn.replace("www.", "", 1)
+    port = ORIGIN_PORT
+    if ":" in hostn:
+        hostn, _, port_S = hostn.rpartition(":")
+        port = int(port_S)
+    return hostn, port, pathname, url
 
-    print("pathname: " , pathname)
-    print("hostname: ", hostn)
 
-    fileExist = "false"
+async def send_stored(writer, entry):
+    # answer from the cache: stored header, our Age, then the body, which
+    # never passes through Python bytes
+    with open(entry.path, "rb") as f:
+        header = entry.header + f"\r\nAge: {entry.age()}\r\nConnection: close\r\n\r\n".encode()
+        writer.write(header)
+        await writer.drain()
+        if entry.size == 0:
+            return
+        try:
+            # the kernel copies the file straight to the socket
+            await asyncio.get_running_loop().sendfile(writer.transport, f, 0, entry.size, fallback=False)
+        except asyncio.SendfileNotAvailableError:
+            # transports without sendfile (SSL, some platforms) get slices of
+            # a mapping of the file instead of read() copies
+            view = memoryview(mmap.mmap(f.fileno(), entry.size, access=mmap.ACCESS_READ))
+            for offset in range(0, entry.size, RECV_SIZE):
+                writer.write(view[offset:offset + RECV_SIZE])
+                await writer.drain()
+            # the transport may still hold slices, so the mapping is left to
+            # be unmapped once the last of them is gone
 
-    directory = "./" + url.replace("/", "_")
-    #print(f"Directory name: {directory}\n")
 
-    try:
-        # Check whether the file exist in the cache using open() method
-        # If file exists it opens file and reads otherwise it throws as exception
-        f = open(directory, "rb")
-        object = f.read()
-
-        # Send http response header and object
-        #fill in start
-        header = "HTTP/1.1 200 OK\r\n\r\n"
-        proxyCliSock.send(header.encode())
-        proxyCliSock.send(object)
-        #fill in end
-
-        fileExist = "true"
-        print('Read from cache')
-        #close socket and file
-        #fill in start
-        proxyCliSock.close()
-        f.close()
-        #fill in end
-
-    except IOError: # Error handling for file not found in cache
-
-        if fileExist == "false":
-            # Create a socket on the proxyserver to connect to the original server on port 80
-            proxyAsClientSocket = socket(AF_INET, SOCK_STREAM)
-            # Connect to the original server on port 80
-            proxyAsClientSocket.connect((hostn, 80))
-
-
-            #create a get request message and send the message to the server using the socket just created in above lines
-            
-            # Hint : use pathname and hostn in the request message
-
-            #fill in start
-            request = f"GET {pathname} HTTP/1.1\r\nHost: {hostn}\r\nConnection: close\r\n\r\n"
-            proxyAsClientSocket.send(request.encode())
-            #fill in end
-
-            # initialize response to empty in binary format - works for any type of document
-            total_response = b''
-
-            # receive data from web server
-            #Hint: You can use a while loop and get response in chunks until it is finished.
-            #Fill in start
+class Fetch:
+    """One origin request, relayed to its clients as the bytes arrive.
+
+    The response is never assembled in memory: each chunk read from the
+    origin is written to the clients and to the cache file before the next
+    one is read, so memory use stays at a few chunks whatever the object
+    size, and a slow client slows the origin read down (but a client that
+    goes away does not stop the object from being cached).
+
+    Clients asking for the same object while it is in flight attach to it
+    instead of starting their own origin request: they replay the part
+    already written to the cache file, then receive the rest live.
+
+    Given a stale cache entry the request is made conditional; a 304 makes
+    the entry fresh again and the clients are answered from the cache.
+    """
+
+    def __init__(self, hostn, port, pathname, key, store, pool, registry, stale=None):
+        self.hostn = hostn
+        self.port = port
+        self.pathname = pathname
+        self.key = key
+        self.store = store
+        self.pool = pool            # upstream connections
+        self.registry = registry    # in-flight fetches by key, we remove ourselves
+        self.stale = stale          # cache entry being revalidated, if any
+        self.subscribers = {}       # StreamWriter -> Future resolved when we are done with it
+        self.header = None          # header block as sent to clients
+        self.tmp_path = None
+        self.received = 0           # body bytes relayed so far
+        self.finished = False
+        registry[key] = self
+
+    def subscribe(self, writer):
+        done = asyncio.get_running_loop().create_future()
+        self.subscribers[writer] = done
+        return done
+
+    async def attach(self, writer):
+        """Join a fetch that is already under way.
+
+        Returns the future to wait on, or None if the response is not one
+        we store, in which case the caller fetches for itself.
+        """
+        if self.header is None:
+            return self.subscribe(writer)
+        if self.tmp_path is None:
+            return None
+        # open before any await: the fetch may rename the file meanwhile,
+        # but an open descriptor keeps reading the same data
+        with open(self.tmp_path, "rb") as f:
+            writer.write(self.header)
+            offset = 0
             while True:
-                data = proxyAsClientSocket.recv(4096)
+                if offset < self.received:
+                    chunk = f.read(min(RECV_SIZE, self.received - offset))
+                    writer.write(chunk)
+                    offset += len(chunk)
+                    await writer.drain()
+                    continue
+                # caught up; nothing can happen between this check and subscribing
+                if self.finished:
+                    done = asyncio.get_running_loop().create_future()
+                    done.set_result(True)
+                    return done
+                return self.subscribe(writer)
+
+    def _drop(self, writer, error=None):
+        done = self.subscribers.pop(writer, None)
+        if done is not None and not done.done():
+            if error is None:
+                done.set_result(True)
+            else:
+                done.set_exception(error)
+
+    async def _deliver(self, data):
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self._drop(writer)
+                continue
+            writer.write(data)
+        for writer in list(self.subscribers):
+            try:
+                await writer.drain()
+            except ConnectionError:
+                log("Client went away, still caching", self.pathname)
+                self._drop(writer)
+
+    def _finish(self):
+        # from here on new requests go to the cache (or a new fetch)
+        self.finished = True
+        if self.registry.get(self.key) is self:
+            del self.registry[self.key]
+
+    async def run(self, slots):
+        try:
+            async with slots:
+                await self._relay()
+        except Exception as e:
+            for writer in list(self.subscribers):
+                self._drop(writer, e)
+            raise
+        finally:
+            self._finish()
+            for writer in list(self.subscribers):
+                self._drop(writer)
+
+    async def _revalidated(self, header, response_time):
+        # 304: the stale copy is still good
+        entry = self.store.refresh(self.key, header, response_time)
+        self._finish()
+        if entry is None:
+            raise asyncio.IncompleteReadError(header, None)
+        log("Revalidated", self.key)
+        for writer in list(self.subscribers):
+            try:
+                await send_stored(writer, entry)
+            except ConnectionError:
+                pass
+            self._drop(writer)
+
+    async def _relay(self):
+        # reuse a parked connection to the origin if there is one
+        conn = await self.pool.acquire(self.hostn, self.port)
+        reusable = False
+        try:
+            try:
+                header, data = await self._request(conn)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # the origin closed the parked connection meanwhile; GET is
+                # safe to send again, once, on a new connection
+                if not conn.reused():
+                    raise
+                conn.close()
+                conn = await self.pool.acquire(self.hostn, self.port, fresh=True)
+                header, data = await self._request(conn)
+            reusable = await self._relay_body(conn, header, data)
+        finally:
+            # park the connection for the next request, or close it
+            self.pool.release(conn, reusable)
+            self._finish()
+
+    async def _request(self, conn):
+        # HTTP/1.1 without Connection: close, so the origin keeps the connection open
+        request = f"GET {self.pathname} HTTP/1.1\r\nHost: {self.hostn}\r\n"
+        if self.stale is not None:
+            request += b"".join(v + b"\r\n" for v in self.stale.validators()).decode("latin-1")
+        conn.writer.write((request + "\r\n").encode("latin-1"))
+        await conn.writer.drain()
+
+        # find the end of the header incrementally; only the header is
+        # ever buffered, the body is passed on chunk by chunk
+        head = bytearray()
+        searched = 0
+        while True:
+            data = await asyncio.wait_for(conn.reader.read(RECV_SIZE), ORIGIN_TIMEOUT)
+            if not data:
+                raise asyncio.IncompleteReadError(bytes(head), None)
+            head += data
+            end = head.find(b"\r\n\r\n", max(0, searched - 3))
+            if end >= 0:
+                return bytes(head[:end]), bytes(head[end + 4:])
+            searched = len(head)
+            if searched > MAX_HEADER_SIZE:
+                raise asyncio.LimitOverrunError("origin header too large", searched)
+
+    async def _relay_body(self, conn, header, data):
+        # returns whether the connection can carry another request
+        response_time = time.time()
+        status = status_code(header)
+        if status == 304 and self.stale is not None:
+            await self._revalidated(header, response_time)
+            return keep_alive(header)
+
+        # work out where the body ends: Content-Length, the end of a chunked
+        # body, or (for neither) the origin closing the connection
+        body_length = content_length(header)
+        chunked = None
+        if status in (204, 304) or 100 <= status < 200:
+            body_length = 0
+        elif is_chunked(header):
+            body_length = None
+            chunked = ChunkedBody()
+        cache_file = tmp_path = None
+        if self.store.storable(header):
+            # write the object into the cache as it streams past
+            cache_file, tmp_path = self.store.begin(self.key)
+            self.tmp_path = tmp_path
+        elif self.stale is not None:
+            # the origin no longer lets us keep this
+            self.store.remove(self.key)
+        self.header = end_to_end(header) + b"\r\nConnection: close\r\n\r\n"
+
+        received = 0
+        ended = body_length == 0
+        overrun = False     # the origin sent more than the response held
+        complete = False
+        try:
+            await self._deliver(self.header)
+            while not ended:
+                if data:
+                    if body_length is not None:
+                        overrun = len(data) > body_length - received
+                        data = data[:body_length - received]
+                        ended = received + len(data) >= body_length
+                    elif chunked is not None:
+                        end = chunked.feed(data)
+                        if end is not None:
+                            overrun = end < len(data)
+                            data = data[:end]
+                            ended = True
+                    if cache_file is not None:
+                        cache_file.write(data)
+                    received += len(data)
+                    self.received = received
+                    await self._deliver(data)
+                    if ended:
+                        break
+                data = await asyncio.wait_for(conn.reader.read(RECV_SIZE), ORIGIN_TIMEOUT)
                 if not data:
                     break
-                total_response += data
-            #Fill in end
-
-            #Separate header and object
-            #Hint use split function. Check the lecture notes to see what separates the response header and object
-            response_header = total_response.split(b"\r\n\r\n", 1)[0]
-            response_object = total_response.split(b"\r\n\r\n", 1)[1]
-
-            #print(f"header response code: {response_header.decode()}\n")
-            if b'200 OK' in response_header:
-                # if the response is a 200 OK response create the directory and file and write the object into the file
-                # Then, send http response header and object to the client
-                #Fill in start
-                with open(directory, "wb") as cacheFile:
-                    cacheFile.write(response_object)
-
-                proxyCliSock.sendall(response_header + "\r\n\r\n".encode() + response_object)
-                #Fill in end
+            complete = ended or (body_length is None and chunked is None)
+        finally:
+            self._finish()
+            if cache_file is not None:
+                cache_file.close()
+                self.store.commit(self.key, tmp_path, header, response_time, complete)
+        return ended and not overrun and keep_alive(header)
+
+
+class ChunkedBody:
+    """Finds where a chunked body ends, passing the bytes through undecoded."""
+
+    def __init__(self):
+        self.line = bytearray()     # partial chunk-size or trailer line
+        self.remaining = 0          # chunk data (plus its CRLF) still to skip
+        self.last = False           # saw the zero-size chunk, reading trailers
+
+    def feed(self, data):
+        # returns how many bytes of data are left of the body once it ends, else None
+        i = 0
+        while i < len(data):
+            if self.remaining:
+                step = min(self.remaining, len(data) - i)
+                self.remaining -= step
+                i += step
+                continue
+            end = data.find(b"\n", i)
+            if end < 0:
+                self.line += data[i:]
+                if len(self.line) > MAX_HEADER_SIZE:
+                    raise asyncio.LimitOverrunError("chunk header too large", len(self.line))
+                return None
+            self.line += data[i:end]
+            i = end + 1
+            line = bytes(self.line).strip()
+            self.line.clear()
+            if self.last:
+                if not line:
+                    return i
+                continue
+            try:
+                size = int(line.split(b";")[0], 16)
+            except ValueError:
+                raise asyncio.IncompleteReadError(line, None) from None
+            if size == 0:
+                self.last = True
             else:
-                #Otherwise, i.e., if response is not a 200 OK message,send 400 bad response
-                #Fill in start
-                proxyCliSock.send("HTTP/1.1 400 BAD REQUEST\r\n\r\n".encode())
-                #Fill in end
-
-            # close socket between proxy and origin server
-            proxyAsClientSocket.close()
-        else:
-            break
-    except:
-        print("An Exception Occurred")
+                self.remaining = size + 2
+        return None
+
+
+def status_code(header):
+    try:
+        return int(header.split(b"\r\n", 1)[0].split()[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def content_length(header):
+    for line in header.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def is_chunked(header):
+    value = header_value(parse_header(header)[1], b"transfer-encoding")
+    return value is not None and b"chunked" in value.lower()
+
+
+def keep_alive(header):
+    # can the origin connection that carried this response be reused?
+    version = header.split(b" ", 1)[0]
+    connection = (header_value(parse_header(header)[1], b"connection") or b"").lower()
+    if version == b"HTTP/1.0":
+        return b"keep-alive" in connection
+    return b"close" not in connection
+
+
+class Proxy:
+    def __init__(self, store, pool, origin_limit):
+        self.store = store
+        self.pool = pool
+        self.origin_limit = origin_limit
+        self.origin_slots = {}  # (host, port) -> Semaphore bounding connections to it
+        self.tasks = set()      # origin fetches still running
+        self.inflight = {}      # cache key -> Fetch, for coalescing concurrent misses
+        self.requests = 0
+        self.cache_hits = 0
+        self.origin_fetches = 0
+        self.coalesced = 0      # misses served by joining a fetch already in flight
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "origin_fetches": self.origin_fetches,
+            "coalesced": self.coalesced,
+            "origin_fetches_avoided": self.cache_hits + self.coalesced,
+            "in_flight": len(self.inflight),
+            "cache": self.store.stats(),
+            "origin": self.pool.stats(),
+        }
+
+    def slots_for(self, hostn, port):
+        slots = self.origin_slots.get((hostn, port))
+        if slots is None:
+            slots = asyncio.Semaphore(self.origin_limit)
+            self.origin_slots[(hostn, port)] = slots
+        return slots
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        log('Received a connection from:', addr)
+        try:
+            await self.serve_request(reader, writer)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            log("Client connection error:", e)
+        except Exception as e:
+            print("An Exception Occurred:", repr(e))
+        finally:
+            # close socket between proxy and client
+            writer.close()
+
+    async def serve_request(self, reader, writer):
+        # get the http request from client
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), CLIENT_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return
+        message = head.decode("latin-1")
+        log(message)
+
+        # if message is not a GET request send a response 400 Bad request to the client
+        parts = message.split()
+        if not message.startswith("GET") or len(parts) < 2:
+            log("message is not a GET")
+            writer.write(b"HTTP/1.1 400 BAD REQUEST\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+
+        try:
+            hostn, port, pathname, url = parse_target(parts[1])
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 BAD REQUEST\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        if parts[1] == STATS_PATH:
+            body = json.dumps(self.stats()).encode()
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+            return
+        self.requests += 1
+        log("pathname: ", pathname)
+        log("hostname: ", hostn)
+
+        key = url
+        entry = self.store.lookup(key)
+        # a client asking for no-cache gets a revalidated copy
+        lowered = message.lower()
+        must_revalidate = "no-cache" in lowered and ("\r\ncache-control:" in lowered or "\r\npragma:" in lowered)
+        if entry is not None and entry.fresh() and not must_revalidate:
+            try:
+                await send_stored(writer, entry)
+                log('Read from cache')
+                self.cache_hits += 1
+                return
+            except FileNotFoundError:
+                self.store.remove(key)
+                entry = None
+
+        fetch = self.inflight.get(key)
+        done = None
+        if fetch is not None:
+            done = await fetch.attach(writer)
+            if done is not None:
+                log('Joined in-flight fetch')
+                self.coalesced += 1
+        if done is None:
+            # fetch from the origin as its own task: it keeps going (and fills the
+            # cache) even if this client gives up, and never blocks other clients
+            stale = entry if entry is not None and entry.validators() else None
+            fetch = Fetch(hostn, port, pathname, key, self.store, self.pool, self.inflight, stale)
+            done = fetch.subscribe(writer)
+            task = asyncio.create_task(fetch.run(self.slots_for(hostn, port)))
+            self.tasks.add(task)
+            task.add_done_callback(self._fetch_finished)
+            self.origin_fetches += 1
+        try:
+            await done
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            log("Origin fetch failed:", e)
+            if fetch.header is None:
+                writer.write(b"HTTP/1.1 502 BAD GATEWAY\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+
+    def _fetch_finished(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log("Origin fetch error:", repr(task.exception()))
+
+
+async def serve(port, store, origin_limit, origin_idle, dns_ttl):
+    pool = OriginPool(DNSCache(dns_ttl), origin_idle, origin_limit, ORIGIN_TIMEOUT)
+    pool.start()
+    try:
+        proxy = Proxy(store, pool, origin_limit)
+        server = await asyncio.start_server(proxy.handle_client, "localhost", port, limit=MAX_HEADER_SIZE)
+        print('Ready to serve...')
+        async with server:
+            await server.serve_forever()
     finally:
-        # close socket between proxy and client
-        proxyCliSock.close()
-    break #to test file with multiple objects. If the tested URLs have only one object you can remove "break"
+        await pool.close()
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caching web proxy.")
+    parser.add_argument("--port", help="Port.", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache-dir", help="Directory cached objects are stored in.", default="cache")
+    parser.add_argument("--cache-quota", help="Bytes of cached objects kept on disk.",
+                        type=int, default=DEFAULT_CACHE_QUOTA)
+    parser.add_argument("--default-ttl", help="Seconds a response without expiry information stays fresh.",
+                        type=int, default=DEFAULT_TTL)
+    parser.add_argument("--origin-limit", help="Concurrent connections to one origin host.",
+                        type=int, default=DEFAULT_ORIGIN_LIMIT)
+    parser.add_argument("--origin-idle-timeout", help="Seconds an idle origin connection is kept for reuse, 0 to close after every request.",
+                        type=float, default=DEFAULT_ORIGIN_IDLE)
+    parser.add_argument("--dns-ttl", help="Seconds origin host name lookups are cached, 0 to always resolve.",
+                        type=float, default=DEFAULT_DNS_TTL)
+    parser.add_argument("-q", "--quiet", help="Do not print per-request messages.", action="store_true")
+    args = parser.parse_args()
+    verbose = not args.quiet
 
-#close the main proxy listening socket
-proxySerSock.close()
-print("finish")
+    try:
+        store = CacheStore(args.cache_dir, args.cache_quota, args.default_ttl)
+        asyncio.run(serve(args.port, store, args.origin_limit, args.origin_idle_timeout, args.dns_ttl))
+    except KeyboardInterrupt:
+        pass
+    #close the main proxy listening socket
+    print("finish")
@@ -0,0 +1,592 @@
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import os
+import random
+import socket
+import threading
+import time
+
+import Congestion
+import Emulator
+import Metrics
+import Mux
+import Network
+import SWRDT
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def connect_pair(port, **kwargs):
+    # the receiver's constructor blocks in accept(), so it is built in a thread
+    made = {}
+    accept = threading.Thread(target=lambda: made.update(receiver=SWRDT.SWRDT("receiver", None, port, **kwargs)))
+    accept.start()
+    while True:
+        try:
+            sender = SWRDT.SWRDT("sender", "localhost", port, **kwargs)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.01)
+    accept.join()
+    return sender, made["receiver"]
+
+
+def run_transfer(count, size, loss, corr, reorder, seed=0, **kwargs):
+    """Send `count` messages of `size` characters one way.
+
+    Returns (seconds, whether the receiver got exactly the messages sent,
+    the sender's RTO and congestion statistics in one dict).
+    """
+    Network.NetworkLayer.prob_pkt_loss = loss
+    Network.NetworkLayer.prob_byte_corr = corr
+    Network.NetworkLayer.prob_pkt_reorder = reorder
+    random.seed(seed)
+    messages = [f"{i:08d}".ljust(size, "x")[:size] for i in range(count)]
+
+    # NetworkLayer still prints its role on connecting; keep that out of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender, receiver = connect_pair(free_port(), **kwargs)
+        received = []
+        all_received = threading.Event()
+
+        def receive():
+            while len(received) < count:
+                received.append(receiver.swrdt_receive(timeout=None))
+            all_received.set()
+
+        receive_thread = threading.Thread(target=receive)
+        receive_thread.start()
+        start = time.perf_counter()
+        for msg in messages:
+            sender.swrdt_send(msg)
+        sender.swrdt_flush()
+        all_received.wait()
+        elapsed = time.perf_counter() - start
+        receive_thread.join()
+        sender.disconnect()
+        receiver.disconnect()
+    return elapsed, received == messages, dict(sender.rto_stats(), **sender.congestion_stats())
+
+
+def run_stream(args):
+    # one large buffer through swrdt_sendall / swrdt_recv_into per mode
+    modes = [("sw", 1)] + [(mode, args.window) for mode in ("gbn", "sr")]
+    size = int(args.megabytes * 1e6)
+    data = random.Random(args.seed).randbytes(size)
+    print(f"{size} bytes, MSS {args.mss}, window {args.window}")
+    print(f"{'loss':>5} {'corr':>5} " + "".join(f"{f'{mode}({window}) MB/s':>16}" for mode, window in modes))
+    for loss in args.loss:
+        row = f"{loss:>5} {args.corr:>5} "
+        for mode, window in modes:
+            Network.NetworkLayer.prob_pkt_loss = loss
+            Network.NetworkLayer.prob_byte_corr = args.corr
+            Network.NetworkLayer.prob_pkt_reorder = 0.0
+            random.seed(args.seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                sender, receiver = connect_pair(free_port(), mode=mode, window=window, mss=args.mss)
+                received = bytearray(size)
+
+                def receive():
+                    view = memoryview(received)
+                    got = 0
+                    while got < size:
+                        got += receiver.swrdt_recv_into(view[got:])
+
+                receive_thread = threading.Thread(target=receive)
+                receive_thread.start()
+                start = time.perf_counter()
+                sender.swrdt_sendall(data)
+                receive_thread.join()
+                elapsed = time.perf_counter() - start
+                sender.disconnect()
+                receiver.disconnect()
+            row += f"{size / elapsed / 1e6:>16.2f}" if received == data else f"{'WRONG DATA':>16}"
+        print(row, flush=True)
+
+
+def emulated_transfer(args, mode, congestion, loss, delay, new_metrics=None):
+    """Send args.segments segments of args.size bytes over the emulator.
+
+    The receiving application reads everything delivered every
+    args.read_interval virtual seconds. new_metrics(), if given, makes each
+    end's Metrics. Returns (real seconds, the
+    simulator, sender, digest of what arrived plus the sender's statistics
+    -- equal digests mean identical runs, None if the data came out wrong).
+    """
+    sim, a, b = Emulator.emulated_pair(args.seed, loss=loss, corr=args.corr, reorder=args.reorder,
+                                       delay=delay, jitter=args.jitter, bandwidth=args.bandwidth,
+                                       queue_limit=args.queue_limit)
+    window = 1 if mode == "sw" else args.window
+    data = random.Random(args.seed).randbytes(args.segments * args.size)
+    received = bytearray(len(data))
+    view = memoryview(received)
+    got = 0
+    kwargs = dict(mode=mode, window=window, mss=args.size, congestion=congestion, rcv_window=args.rcv_window)
+    sender = SWRDT.SWRDT("sender", None, None, network=a, metrics=new_metrics and new_metrics(), **kwargs)
+    receiver = SWRDT.SWRDT("receiver", None, None, network=b, metrics=new_metrics and new_metrics(), **kwargs)
+
+    def read():
+        nonlocal got
+        while got < len(data):
+            n = receiver.swrdt_recv_into(view[got:], timeout=0)
+            if n == 0:
+                sim.call_later(args.read_interval, read)
+                return
+            got += n
+
+    sim.call_later(args.read_interval, read)
+    start = time.perf_counter()
+    sender.swrdt_sendall(data)
+    sender.swrdt_flush()
+    sim.run_until(lambda: got == len(data))
+    elapsed = time.perf_counter() - start
+    sender.disconnect()
+    receiver.disconnect()
+    if received != data:
+        return elapsed, sim, sender, None
+    digest = hashlib.sha256(received + repr(sorted(sender.rto_stats().items())).encode())
+    digest.update(repr(sender.congestion_trace()).encode())
+    return elapsed, sim, sender, digest.hexdigest()
+
+
+def run_emulate(args):
+    # whole protocol runs on virtual time; each is repeated to show it is deterministic
+    print(f"{args.segments} segments of {args.size} bytes, loss {args.loss}, corr {args.corr}, "
+          f"reorder {args.reorder}, delay {args.delay * 1000:g} ms, jitter {args.jitter * 1000:g} ms, "
+          f"bandwidth {args.bandwidth or 'unlimited'} B/s, {args.congestion}, seed {args.seed}")
+    print(f"{'mode':>8} {'real s':>7} {'segments/s':>11} {'events':>9} {'virtual s':>10} "
+          f"{'goodput B/s':>12} {'retransmits':>12} {'repeatable':>11}")
+    for mode in args.modes:
+        label = mode if mode == "sw" else f"{mode}({args.window})"
+        runs = [emulated_transfer(args, mode, args.congestion, args.loss, args.delay) for _ in range(args.repeat)]
+        elapsed, sim, sender, digest = runs[0]
+        if digest is None:
+            print(f"{label:>8} WRONG DATA")
+            continue
+        repeatable = all(run[3] == digest for run in runs)
+        print(f"{label:>8} {elapsed:>7.2f} {args.segments / elapsed:>11.0f} {sim.processed:>9} {sim.now:>10.3f} "
+              f"{args.segments * args.size / sim.now if sim.now else 0:>12.0f} "
+              f"{sender.rto_stats()['retransmits']:>12} {'yes' if repeatable else 'NO':>11}", flush=True)
+
+
+def run_metrics(args):
+    # cost of instrumentation: the same emulated transfer with every event
+    # printed (as SWRDT used to, here into /dev/null), counted, traced, or
+    # nothing recorded at all. CPU time, best of args.repeat runs each: the
+    # differences are smaller than the noise of a single wall-clock run.
+    variants = (
+        ("print", lambda: Metrics.Metrics(log=print)),
+        ("counters", Metrics.Metrics),
+        ("trace", lambda: Metrics.Metrics(trace_size=args.trace_size)),
+        ("off", None),
+    )
+    print(f"{args.segments} segments of {args.size} bytes, loss {args.loss}, corr {args.corr}, "
+          f"delay {args.delay * 1000:g} ms, {args.congestion}, seed {args.seed}")
+    print(f"{'mode':>8} {'metrics':>9} {'CPU s':>7} {'segments/s':>11} {'vs print':>9} {'same run':>9}")
+    for mode in args.modes:
+        label = mode if mode == "sw" else f"{mode}({args.window})"
+        printed = None
+        digest = None
+        for name, new_metrics in variants:
+            runs = []
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for _ in range(args.repeat):
+                    start = time.process_time()
+                    run_digest = emulated_transfer(args, mode, args.congestion, args.loss, args.delay, new_metrics)[3]
+                    runs.append((time.process_time() - start, run_digest))
+            elapsed = min(cpu for cpu, _ in runs)
+            run_digest = runs[0][1] if all(run[1] == runs[0][1] for run in runs) else None
+            printed = printed or elapsed
+            digest = digest or run_digest
+            print(f"{label:>8} {name:>9} {elapsed:>7.2f} {args.segments / elapsed:>11.0f} "
+                  f"{printed / elapsed:>8.2f}x {'yes' if run_digest and run_digest == digest else 'NO':>9}",
+                  flush=True)
+
+
+def run_congestion(args):
+    # goodput per congestion control across loss and delay, on the emulator;
+    # --trace writes each run's cwnd/ssthresh history for plotting
+    print(f"{args.mode}({args.window}), {args.segments} segments of {args.size} bytes, corr {args.corr}, "
+          f"bandwidth {args.bandwidth or 'unlimited'} B/s, queue {args.queue_limit or 'unlimited'}, "
+          f"receiver window {args.rcv_window}")
+    print(f"{'loss':>5} {'delay ms':>9} " + "".join(f"{f'{cc} B/s':>12} {'rexmit':>7}" for cc in args.algorithms))
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+    for loss in args.loss:
+        for delay in args.delay:
+            row = f"{loss:>5} {delay * 1000:>9g} "
+            for cc in args.algorithms:
+                _, sim, sender, digest = emulated_transfer(args, args.mode, cc, loss, delay)
+                if digest is None:
+                    row += f"{'WRONG DATA':>20}"
+                    continue
+                row += f"{args.segments * args.size / sim.now:>12.0f} {sender.rto_stats()['retransmits']:>7}"
+                if args.trace:
+                    path = os.path.join(args.trace, f"{args.mode}-{cc}-loss{loss}-delay{delay * 1000:g}ms.csv")
+                    with open(path, "w", newline="") as f:
+                        writer = csv.writer(f)
+                        writer.writerow(["time", "cwnd", "ssthresh"])
+                        writer.writerows(sender.congestion_trace())
+            print(row, flush=True)
+
+
+def add_emulator_arguments(parser):
+    parser.add_argument("--segments", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=100, help="Payload bytes per segment.")
+    parser.add_argument("--window", type=int, default=32)
+    parser.add_argument("--corr", type=float, default=0.02)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay, up to this many seconds.")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes per second each way.")
+    parser.add_argument("--queue-limit", type=int, default=None,
+                        help="Segments that can wait for the bandwidth before the link drops them.")
+    parser.add_argument("--rcv-window", type=int, default=1024, help="Receiver buffer in segments.")
+    parser.add_argument("--read-interval", type=float, default=0.01,
+                        help="Virtual seconds between the receiving application's reads.")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def mux_pairs(count, port, **kwargs):
+    # `count` connections multiplexed on one socket between two Muxes
+    server = Mux.Mux(kwargs["wire"])
+    server.listen(port)
+    client = Mux.Mux(kwargs["wire"])
+    peer = client.connect("localhost", port)
+    senders = [SWRDT.SWRDT("sender", None, None, network=client.open(peer), **kwargs) for _ in range(count)]
+    # the server hears of a channel with its first segment
+    for sender in senders:
+        sender.swrdt_send(b"hello")
+    receivers = [SWRDT.SWRDT("receiver", None, None, network=server.accept(), **kwargs) for _ in range(count)]
+    receivers.sort(key=lambda receiver: receiver.conn_id)
+    return senders, receivers, [client, server]
+
+
+def socket_pairs(count, port, **kwargs):
+    # one NetworkLayer (socket, collector thread) and timer thread per end
+    pairs = [connect_pair(free_port(), **kwargs) for _ in range(count)]
+    for sender, _ in pairs:
+        sender.swrdt_send(b"hello")
+    return [s for s, _ in pairs], [r for _, r in pairs], []
+
+
+def run_mux(args):
+    # many connections: one socket per connection vs all on one socket
+    Network.NetworkLayer.prob_pkt_loss = args.loss
+    Network.NetworkLayer.prob_byte_corr = args.corr
+    Network.NetworkLayer.prob_pkt_reorder = 0.0
+    random.seed(args.seed)
+    print(f"{args.messages} messages of {args.size} bytes per connection, {args.mode}({args.window}), "
+          f"{args.wire}, loss {args.loss}, corr {args.corr}")
+    print(f"{'connections':>11} {'transport':>10} {'threads':>8} {'setup s':>8} {'send s':>7} {'msgs/s':>8} {'ok':>4}")
+    for count in args.connections:
+        for label, setup in (("sockets", socket_pairs), ("mux", mux_pairs)):
+            baseline = threading.active_count()
+            with contextlib.redirect_stdout(None):
+                start = time.perf_counter()
+                senders, receivers, muxes = setup(count, free_port(), mode=args.mode, window=args.window,
+                                                  wire=args.wire)
+                # both start with a round trip measured
+                for receiver in receivers:
+                    receiver.swrdt_receive_bytes(timeout=None)
+                setup_time = time.perf_counter() - start
+                threads = threading.active_count() - baseline
+
+                # one application thread per connection sends its messages
+                def send(sender, k):
+                    for i in range(args.messages):
+                        sender.swrdt_send(f"{k}:{i}".ljust(args.size, "x"))
+                    sender.swrdt_flush()
+
+                workers = [threading.Thread(target=send, args=(sender, k)) for k, sender in enumerate(senders)]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                ok = all(
+                    [receiver.swrdt_receive(timeout=1) for _ in range(args.messages)]
+                    == [f"{k}:{i}".ljust(args.size, "x") for i in range(args.messages)]
+                    for k, receiver in enumerate(receivers)
+                )
+                for rdt in senders + receivers:
+                    rdt.disconnect()
+                for mux in muxes:
+                    mux.close()
+            total = count * args.messages
+            print(f"{count:>11} {label:>10} {threads:>8} {setup_time:>8.2f} {elapsed:>7.2f} {total / elapsed:>8.0f} "
+                  f"{'yes' if ok else 'NO':>4}", flush=True)
+
+
+def run_latency(args):
+    # ping-pong: one message out, the echo back, timed per round trip, with
+    # the CPU time the process burned meanwhile
+    Network.NetworkLayer.prob_pkt_loss = 0.0
+    Network.NetworkLayer.prob_byte_corr = 0.0
+    Network.NetworkLayer.prob_pkt_reorder = 0.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender, receiver = connect_pair(free_port(), mode="sw")
+
+        def echo():
+            while True:
+                msg = receiver.swrdt_receive(timeout=None)
+                if msg == "END":
+                    return
+                receiver.swrdt_send(msg)
+
+        echo_thread = threading.Thread(target=echo)
+        echo_thread.start()
+        latencies = []
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        for i in range(args.count):
+            sent = time.perf_counter()
+            sender.swrdt_send(f"ping {i}")
+            sender.swrdt_receive(timeout=None)
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        sender.swrdt_send("END")
+        echo_thread.join()
+
+        # and what sitting idle costs
+        cpu_start = time.process_time()
+        time.sleep(args.idle)
+        idle_cpu = time.process_time() - cpu_start
+        sender.disconnect()
+        receiver.disconnect()
+
+    latencies.sort()
+    print(f"{args.count} echoes in {elapsed:.2f} s, CPU {cpu:.2f} s ({cpu / elapsed * 100:.0f}% of a core)")
+    print(f"round trip median {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p90 {latencies[int(len(latencies) * 0.9)] * 1000:.2f} ms")
+    print(f"idle for {args.idle} s: CPU {idle_cpu * 1000:.0f} ms")
+
+
+def run_codec(args):
+    # per-segment cost of building and checking segments in each wire format
+    print(f"{'format':>15} {'payload':>8} {'header B':>9} {'overhead':>9} {'encode us':>10} {'parse us':>9}")
+    for size in args.sizes:
+        payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        for name, codec in sorted(SWRDT.codecs.items()):
+            segments = [SWRDT.Segment(seq, payload) for seq in range(args.count)]
+            start = time.perf_counter()
+            encoded = [codec.encode(seg) for seg in segments]
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for raw in encoded:
+                codec.frame_length(raw, 0)
+                _, _, _, intact = codec.parse(raw)
+                assert intact
+            parse_time = time.perf_counter() - start
+            header = len(encoded[0]) - size
+            print(f"{name:>15} {size:>8} {header:>9} {header / len(encoded[0]) * 100:>8.1f}% "
+                  f"{encode_time / args.count * 1e6:>10.2f} {parse_time / args.count * 1e6:>9.2f}")
+
+
+def run_checksum(args):
+    # segments verified per second: one parse() each, as segments used to
+    # be checked, and parse_batch() over bursts, as SWRDT does now
+    formats = sorted(SWRDT.codecs.items())
+    if SWRDT.numpy is not None:
+        scalar = SWRDT.BinaryCodec("internet")
+        scalar.vectorized = False
+        formats.append(("binary-internet (no NumPy)", scalar))
+    print(f"{args.count} segments, bursts of {args.burst}, NumPy {'yes' if SWRDT.numpy is not None else 'no'}")
+    print(f"{'format':>26} {'payload':>8} {'parse seg/s':>12} {'batch seg/s':>12} {'speed-up':>9}")
+    for size in args.sizes:
+        payload = random.Random(args.seed).randbytes(size)
+        for name, codec in formats:
+            raws = [codec.encode(SWRDT.Segment(seq, payload)) for seq in range(args.count)]
+            bursts = [raws[i:i + args.burst] for i in range(0, len(raws), args.burst)]
+            single = batch = float("inf")
+            # best of three: a single pass is short enough to be noisy
+            for _ in range(3):
+                start = time.perf_counter()
+                for raw in raws:
+                    assert codec.parse(raw)[3]
+                single = min(single, time.perf_counter() - start)
+                start = time.perf_counter()
+                for burst in bursts:
+                    assert all(parsed[3] for parsed in codec.parse_batch(burst))
+                batch = min(batch, time.perf_counter() - start)
+            print(f"{name:>26} {size:>8} {args.count / single:>12.0f} {args.count / batch:>12.0f} "
+                  f"{single / batch:>8.2f}x", flush=True)
+
+
+def run_framing(args):
+    # cut a stream of segments back into segments, as the receiver does,
+    # fed the way recv() delivers it and as one large backlog
+    print(f"{args.count} segments of {args.size} bytes, {args.corr * 100:.0f}% corrupted")
+    print(f"{'format':>15} {'fed as':>11} {'segments/s':>11} {'intact':>8}")
+    rng = random.Random(args.seed)
+    for name, codec in sorted(SWRDT.codecs.items()):
+        pieces = []
+        for seq in range(args.count):
+            raw = bytearray(codec.encode(SWRDT.Segment(seq, b"x" * args.size)))
+            if rng.random() < args.corr:
+                # garble a few bytes past the length field, as NetworkLayer does
+                start = rng.randint(codec.length_end, len(raw) - 5)
+                raw[start:start + 3] = b"XXX"
+            pieces.append(bytes(raw))
+        stream = b"".join(pieces)
+        for label, chunk in (("4K chunks", 4096), ("one burst", len(stream))):
+            buffer = SWRDT.SegmentBuffer(codec)
+            intact = 0
+            start = time.perf_counter()
+            for offset in range(0, len(stream), chunk):
+                buffer.feed(stream[offset:offset + chunk])
+                intact += sum(parsed[3] for parsed in codec.parse_batch(buffer.segments()))
+            elapsed = time.perf_counter() - start
+            print(f"{name:>15} {label:>11} {args.count / elapsed:>11.0f} {intact:>8}")
+
+
+def run_rto(args):
+    # Sender.py's ten messages, stop-and-wait, with the old fixed 2 s timeout and adaptive
+    print(f"{args.count} messages, stop-and-wait, {args.runs} runs each")
+    print(f"{'loss':>5} {'corr':>5} {'RTO':>9} {'time s':>8} {'timeouts':>9} {'final RTO ms':>13} {'SRTT ms':>8}")
+    for loss in args.loss:
+        for timeout in (2.0, None):
+            total = timeouts = 0
+            wrong = False
+            for run in range(args.runs):
+                elapsed, ok, stats = run_transfer(args.count, args.size, loss, args.corr, 0.0, seed=run,
+                                                  mode="sw", timeout=timeout)
+                total += elapsed
+                timeouts += stats["timeouts"]
+                wrong = wrong or not ok
+            label = "fixed 2s" if timeout else "adaptive"
+            srtt = f"{stats['srtt'] * 1000:.2f}" if stats["srtt"] is not None else "-"
+            print(f"{loss:>5} {args.corr:>5} {label:>9} {total / args.runs:>8.2f} {timeouts / args.runs:>9.1f} "
+                  f"{stats['rto'] * 1000:>13.1f} {srtt:>8}" + ("  WRONG DATA" if wrong else ""), flush=True)
+
+
+def run_goodput(args):
+    modes = [("sw", 1)] + [(mode, args.window) for mode in ("gbn", "sr")]
+    rto = "adaptive RTO" if args.timeout is None else f"RTO {args.timeout} s"
+    print(f"{args.count} messages of {args.size} chars, {rto}, window {args.window}")
+    print(f"{'loss':>5} {'corr':>5} " + "".join(f"{f'{mode}({window}) B/s':>16}" for mode, window in modes))
+    for loss in args.loss:
+        for corr in args.corr:
+            row = f"{loss:>5} {corr:>5} "
+            for mode, window in modes:
+                elapsed, ok, _ = run_transfer(args.count, args.size, loss, corr, args.reorder, seed=args.seed,
+                                           mode=mode, window=window, timeout=args.timeout,
+                                           seq_space=args.seq_space, wire=args.wire)
+                row += f"{args.count * args.size / elapsed:>16.0f}" if ok else f"{'WRONG DATA':>16}"
+            print(row, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SWRDT benchmarks.")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    goodput = sub.add_parser("goodput", help="Goodput of stop-and-wait, Go-Back-N and Selective Repeat.")
+    goodput.add_argument("--count", type=int, default=200, help="Messages per run.")
+    goodput.add_argument("--size", type=int, default=100, help="Characters per message.")
+    goodput.add_argument("--window", type=int, default=8)
+    goodput.add_argument("--seq-space", type=int, default=None,
+                         help="Sequence number modulus; small values exercise wrap-around.")
+    goodput.add_argument("--timeout", type=float, default=None, help="Fixed RTO in seconds (default: adaptive).")
+    goodput.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.1, 0.2])
+    goodput.add_argument("--corr", type=float, nargs="+", default=[0.0, 0.1])
+    goodput.add_argument("--reorder", type=float, default=0.0)
+    goodput.add_argument("--seed", type=int, default=0)
+    goodput.add_argument("--wire", choices=sorted(SWRDT.codecs), default="binary")
+    goodput.set_defaults(func=run_goodput)
+
+    rto = sub.add_parser("rto", help="Completion time of Sender.py's messages, fixed vs adaptive RTO.")
+    rto.add_argument("--count", type=int, default=10)
+    rto.add_argument("--size", type=int, default=20)
+    rto.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.1, 0.2])
+    rto.add_argument("--corr", type=float, default=0.1)
+    rto.add_argument("--runs", type=int, default=3)
+    rto.set_defaults(func=run_rto)
+
+    stream = sub.add_parser("stream", help="Bulk transfer through the stream calls.")
+    stream.add_argument("--megabytes", type=float, default=2.0)
+    stream.add_argument("--mss", type=int, default=SWRDT.DEFAULT_MSS)
+    stream.add_argument("--window", type=int, default=32)
+    stream.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05])
+    stream.add_argument("--corr", type=float, default=0.0)
+    stream.add_argument("--seed", type=int, default=0)
+    stream.set_defaults(func=run_stream)
+
+    emulate = sub.add_parser("emulate", help="Transfers over the in-process emulator, on virtual time.")
+    add_emulator_arguments(emulate)
+    emulate.add_argument("--modes", nargs="+", choices=SWRDT.SWRDT.modes, default=list(SWRDT.SWRDT.modes))
+    emulate.add_argument("--loss", type=float, default=0.05)
+    emulate.add_argument("--delay", type=float, default=0.005, help="One-way delay in seconds.")
+    emulate.add_argument("--congestion", choices=sorted(Congestion.congestion_algorithms), default="reno")
+    emulate.add_argument("--repeat", type=int, default=2, help="Runs per mode, compared for equality.")
+    emulate.set_defaults(func=run_emulate)
+
+    metrics = sub.add_parser("metrics", help="Transfer speed with events printed, counted, traced or off.")
+    add_emulator_arguments(metrics)
+    metrics.add_argument("--modes", nargs="+", choices=SWRDT.SWRDT.modes, default=["gbn", "sr"])
+    metrics.add_argument("--loss", type=float, default=0.05)
+    metrics.add_argument("--delay", type=float, default=0.005, help="One-way delay in seconds.")
+    metrics.add_argument("--congestion", choices=sorted(Congestion.congestion_algorithms), default="reno")
+    metrics.add_argument("--trace-size", type=int, default=65536, help="Events kept by the trace variant.")
+    metrics.add_argument("--repeat", type=int, default=3)
+    metrics.set_defaults(func=run_metrics)
+
+    congestion = sub.add_parser("congestion", help="Goodput per congestion control under loss and delay.")
+    add_emulator_arguments(congestion)
+    congestion.add_argument("--mode", choices=("gbn", "sr"), default="sr")
+    congestion.add_argument("--algorithms", nargs="+", choices=sorted(Congestion.congestion_algorithms),
+                            default=["none", "tahoe", "reno"])
+    congestion.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.01, 0.05])
+    congestion.add_argument("--delay", type=float, nargs="+", default=[0.005, 0.05], help="One-way delays, seconds.")
+    congestion.add_argument("--trace", metavar="DIR", help="Write cwnd/ssthresh traces as CSV files here.")
+    congestion.set_defaults(func=run_congestion, segments=20000, window=256, corr=0.0, bandwidth=200000,
+                            queue_limit=20)
+
+    mux = sub.add_parser("mux", help="Many connections, one socket each vs multiplexed on one.")
+    mux.add_argument("--connections", type=int, nargs="+", default=[10, 100, 300])
+    mux.add_argument("--messages", type=int, default=50, help="Messages per connection.")
+    mux.add_argument("--size", type=int, default=100)
+    mux.add_argument("--mode", choices=SWRDT.SWRDT.modes, default="sr")
+    mux.add_argument("--window", type=int, default=16)
+    mux.add_argument("--wire", choices=[name for name, codec in SWRDT.codecs.items() if codec.max_conn_id],
+                     default="binary", help="Wire format; the text format has no connection ids.")
+    mux.add_argument("--loss", type=float, default=0.0)
+    mux.add_argument("--corr", type=float, default=0.0)
+    mux.add_argument("--seed", type=int, default=0)
+    mux.set_defaults(func=run_mux)
+
+    latency = sub.add_parser("latency", help="Echo round trips and CPU time, no loss.")
+    latency.add_argument("--count", type=int, default=200)
+    latency.add_argument("--idle", type=float, default=2.0, help="Seconds to measure idle CPU for.")
+    latency.set_defaults(func=run_latency)
+
+    codec = sub.add_parser("codec", help="Encode/parse cost and header overhead of the wire formats.")
+    codec.add_argument("--count", type=int, default=100000, help="Segments per measurement.")
+    codec.add_argument("--sizes", type=int, nargs="+", default=[3, 100, 1000])
+    codec.set_defaults(func=run_codec)
+
+    checksum = sub.add_parser("checksum", help="Segments verified per second per checksum, one by one vs batched.")
+    checksum.add_argument("--count", type=int, default=100000)
+    checksum.add_argument("--sizes", type=int, nargs="+", default=[3, 100, 1400])
+    checksum.add_argument("--burst", type=int, default=64, help="Segments per parse_batch call.")
+    checksum.add_argument("--seed", type=int, default=0)
+    checksum.set_defaults(func=run_checksum)
+
+    framing = sub.add_parser("framing", help="Receive-side framing and parsing throughput.")
+    framing.add_argument("--count", type=int, default=100000)
+    framing.add_argument("--size", type=int, default=100)
+    framing.add_argument("--corr", type=float, default=0.0, help="Fraction of segments to garble.")
+    framing.add_argument("--seed", type=int, default=0)
+    framing.set_defaults(func=run_framing)
+
+    args = parser.parse_args()
+    args.func(args)
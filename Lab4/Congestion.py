@@ -0,0 +1,122 @@
+# Congestion.py
+# Congestion control for SWRDT's pipelined modes. An algorithm keeps the
+# congestion window (cwnd, in segments) and is told about the events that
+# move it; SWRDT never has more than min(window, cwnd, receiver's window)
+# segments in flight. Windows are counted in segments, not bytes.
+#
+# Interface (see FixedWindow):
+#   window()              -> segments the sender may have in flight
+#   on_ack(acked)         new data ACKed, `acked` segments of it
+#   on_dup_ack(in_flight) -> True if the oldest segment should be fast
+#                            retransmitted now
+#   on_timeout(in_flight) a retransmission timer expired
+# Every change of cwnd or ssthresh is appended to `trace` as
+# (time, cwnd, ssthresh).
+
+
+class FixedWindow:
+    # no congestion control: the configured window is the only limit
+    name = "none"
+    dup_ack_threshold = 3
+
+    def __init__(self, max_window, clock):
+        self.max_window = max_window
+        self.clock = clock
+        self.cwnd = max_window
+        self.ssthresh = max_window
+        self.trace = [(clock(), self.cwnd, self.ssthresh)]
+        self.fast_retransmits = 0
+
+    def window(self):
+        return self.max_window
+
+    def on_ack(self, acked):
+        pass
+
+    def on_dup_ack(self, in_flight):
+        return False
+
+    def on_timeout(self, in_flight):
+        pass
+
+    def _record(self):
+        self.trace.append((self.clock(), self.cwnd, self.ssthresh))
+
+    def stats(self):
+        return {
+            "algorithm": self.name,
+            "cwnd": self.cwnd,
+            "ssthresh": self.ssthresh,
+            "fast_retransmits": self.fast_retransmits,
+        }
+
+
+class Reno(FixedWindow):
+    """Slow start, congestion avoidance, fast retransmit and fast recovery (RFC 5681)."""
+
+    name = "reno"
+
+    def __init__(self, max_window, clock, initial_window=1):
+        super().__init__(max_window, clock)
+        self.cwnd = initial_window
+        self.ssthresh = max_window  # slow start until the window is full or loss
+        self.dup_acks = 0
+        self.recovering = False
+        self.trace = [(clock(), self.cwnd, self.ssthresh)]
+
+    def window(self):
+        return max(1, min(self.max_window, int(self.cwnd)))
+
+    def on_ack(self, acked):
+        self.dup_acks = 0
+        if self.recovering:
+            # recovery ends with the first ACK for new data: deflate
+            self.recovering = False
+            self.cwnd = self.ssthresh
+        elif self.cwnd < self.ssthresh:
+            # one cumulative ACK can cover many segments (after a hole is
+            # filled); grow by at most two per ACK (RFC 3465, L = 2)
+            self.cwnd += min(acked, 2)
+        else:
+            self.cwnd += acked / self.cwnd
+        # growing past what the sender may use anyway only delays the
+        # reaction to the next loss
+        self.cwnd = min(self.cwnd, self.max_window)
+        self._record()
+
+    def on_dup_ack(self, in_flight):
+        self.dup_acks += 1
+        if self.recovering:
+            # each duplicate means another segment has left the network
+            self.cwnd += 1
+            self._record()
+            return False
+        if self.dup_acks != self.dup_ack_threshold:
+            return False
+        self.ssthresh = max(in_flight // 2, 2)
+        self._enter_recovery()
+        self.fast_retransmits += 1
+        self._record()
+        return True
+
+    def _enter_recovery(self):
+        self.cwnd = self.ssthresh + self.dup_ack_threshold
+        self.recovering = True
+
+    def on_timeout(self, in_flight):
+        self.ssthresh = max(in_flight // 2, 2)
+        self.cwnd = 1
+        self.dup_acks = 0
+        self.recovering = False
+        self._record()
+
+
+class Tahoe(Reno):
+    # fast retransmit, but no fast recovery: back to slow start from one segment
+    name = "tahoe"
+
+    def _enter_recovery(self):
+        self.cwnd = 1
+
+
+congestion_algorithms = {cc.name: cc for cc in (FixedWindow, Reno, Tahoe)}
@@ -0,0 +1,200 @@
+# Emulator.py
+# In-process stand-in for Network.NetworkLayer. Two EmulatedNetwork ends
+# pass segments to each other through a discrete-event simulator instead of
+# a TCP socket: time is virtual, nothing runs in a thread, and every random
+# choice comes from one seeded generator, so a run takes as long as its
+# computation does and is repeated exactly by using the same seed.
+#
+# SWRDT notices the `sim` attribute of such a network and waits by running
+# the simulator (see SWRDT._wait_for), so the usual blocking calls still work;
+# they just advance virtual time instead of sleeping. Not from inside a
+# simulator event, though, where time can't pass: a send from an event
+# callback raises BlockingIOError if the window is full rather than wait, so
+# such callbacks have to pace themselves (catch it and schedule a retry).
+import heapq
+import itertools
+import random
+from collections import deque
+
+
+class Simulator:
+    """Virtual clock and the events scheduled on it."""
+
+    def __init__(self, seed=0):
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.events = []                 # heap of (time, serial, callback, args)
+        self.serial = itertools.count()  # same-time events run in the order scheduled
+        self.processed = 0
+        self.running = False
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args):
+        heapq.heappush(self.events, (when, next(self.serial), callback, args))
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(self.now + delay, callback, *args)
+
+    def run_until(self, predicate, timeout=None):
+        # run events until predicate() holds, for at most `timeout` virtual
+        # seconds (None: until nothing is left to run); returns predicate().
+        # Called from inside an event it only checks: time can't pass there.
+        if self.running:
+            return predicate()
+        deadline = None if timeout is None else self.now + timeout
+        events = self.events
+        self.running = True
+        try:
+            while not predicate():
+                if not events or (deadline is not None and events[0][0] > deadline):
+                    if deadline is not None:
+                        self.now = deadline
+                    return predicate()
+                when, _, callback, args = heapq.heappop(events)
+                self.now = when
+                self.processed += 1
+                callback(*args)
+            return True
+        finally:
+            self.running = False
+
+
+class Link:
+    """One direction of an emulated path.
+
+    Segments are sent whole. A segment may be lost, corrupted or held back
+    behind the next one with the given probabilities (as NetworkLayer does),
+    queues behind earlier segments for `len / bandwidth` seconds if a
+    bandwidth in bytes per second is set (and is dropped if `queue_limit`
+    segments are already waiting), then arrives `delay` plus up to
+    `jitter` seconds later. The path is FIFO like the TCP connection it
+    replaces: jitter never lets a segment overtake an earlier one, only
+    `reorder` does.
+    """
+
+    def __init__(self, sim, loss=0.0, corr=0.0, reorder=0.0, delay=0.0, jitter=0.0, bandwidth=None,
+                 queue_limit=None):
+        self.sim = sim
+        self.loss = loss
+        self.corr = corr
+        self.reorder = reorder
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.queue_limit = queue_limit
+        self.queue = deque()        # when each queued segment finishes transmitting
+        self.free_at = 0.0          # when the last queued segment finishes transmitting
+        self.held = None            # segment held back for reordering
+        self.last_arrival = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.overflowed = 0         # dropped because the queue was full
+
+    def send(self, data, corrupt_from, deliver):
+        rng = self.sim.random
+        self.sent += 1
+        if rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if rng.random() < self.corr:
+            # same damage as NetworkLayer: up to five bytes overwritten with X
+            self.corrupted += 1
+            start = rng.randint(corrupt_from, max(corrupt_from, len(data) - 5))
+            num = rng.randint(1, 5)
+            data = data[:start] + b"X" * num + data[start + num:]
+        if rng.random() < self.reorder or self.held is not None:
+            if self.held is None:
+                self.held = data
+                return
+            self._schedule(data, deliver)
+            data, self.held = self.held, None
+        self._schedule(data, deliver)
+
+    def _schedule(self, data, deliver):
+        sim = self.sim
+        arrival = sim.now
+        if self.bandwidth:
+            queue = self.queue
+            while queue and queue[0] <= sim.now:
+                queue.popleft()
+            if self.queue_limit is not None and len(queue) >= self.queue_limit:
+                self.overflowed += 1
+                return
+            self.free_at = max(self.free_at, sim.now) + len(data) / self.bandwidth
+            queue.append(self.free_at)
+            arrival = self.free_at
+        arrival += self.delay
+        if self.jitter:
+            arrival = max(self.last_arrival, arrival + sim.random.uniform(0, self.jitter))
+        self.last_arrival = arrival
+        sim.call_at(arrival, deliver, data)
+
+    def stats(self):
+        return {"sent": self.sent, "dropped": self.dropped, "corrupted": self.corrupted,
+                "overflowed": self.overflowed}
+
+
+class EmulatedNetwork:
+    """One end of an emulated connection, with NetworkLayer's interface."""
+
+    def __init__(self, sim, link):
+        self.sim = sim
+        self.timers = sim           # SWRDT schedules its retransmission timers here
+        self.link = link            # carries what this end sends
+        self.peer = None
+        self.corrupt_from = 0       # set by SWRDT, as for NetworkLayer
+        self.buffer_S = bytearray()
+        self.on_data = None
+        self.closed = False
+
+    @property
+    def reorders(self):
+        return self.link.reorder > 0
+
+    def set_receiver(self, on_data):
+        self.on_data = on_data
+        pending = bytes(self.buffer_S)
+        self.buffer_S.clear()
+        if pending:
+            on_data(pending)
+
+    def network_send(self, msg_S):
+        if self.closed:
+            raise OSError("emulated connection is closed")
+        if isinstance(msg_S, str):
+            msg_S = msg_S.encode("utf-8")
+        self.link.send(msg_S, self.corrupt_from, self.peer._deliver)
+
+    def network_receive(self):
+        ret_S = bytes(self.buffer_S)
+        self.buffer_S.clear()
+        return ret_S
+
+    def _deliver(self, data):
+        # data is None once the peer has disconnected
+        if self.closed:
+            return
+        if data is None:
+            self.closed = True
+        if self.on_data is not None:
+            self.on_data(data)
+        elif data is not None:
+            self.buffer_S += data
+
+    def disconnect(self):
+        if not self.closed:
+            self.closed = True
+            # the peer sees the connection close after one path delay
+            self.sim.call_later(self.link.delay, self.peer._deliver, None)
+
+
+def emulated_pair(seed=0, **link_args):
+    """A simulator and two connected ends, with the same link settings both ways."""
+    sim = Simulator(seed)
+    a = EmulatedNetwork(sim, Link(sim, **link_args))
+    b = EmulatedNetwork(sim, Link(sim, **link_args))
+    a.peer, b.peer = b, a
+    return sim, a, b
@@ -0,0 +1,156 @@
+# Metrics.py
+# Instrumentation for SWRDT, in place of printing every event. Give an
+# SWRDT a Metrics (metrics=) and every protocol event is counted, round trips
+# and send waits go into histograms, and optionally the last `trace_size`
+# events are kept in a binary ring buffer and/or handed to `log` as the line
+# SWRDT used to print. Without one (the default) SWRDT does nothing but
+# check `self.metrics` at each event.
+#
+#   metrics = Metrics.Metrics(trace_size=4096)
+#   rdt = SWRDT.SWRDT("sender", host, port, metrics=metrics)
+#   ...
+#   metrics.snapshot()   # {"counters": ..., "histograms": ..., "trace": [...]}
+#
+# Metrics(log=print) reproduces the old console output.
+import struct
+import time
+
+# event kinds; what `seq` and `arg` mean is in the log line
+SEND = 0
+RETRANSMIT = 1
+FAST_RETRANSMIT = 2
+TIMEOUT = 3
+ACK = 4
+ACK_IGNORED = 5
+DUPLICATE_ACK = 6
+CORRUPT_ACK = 7
+DELIVER = 8
+DUPLICATE = 9
+OUT_OF_ORDER = 10
+OUT_OF_WINDOW = 11
+CORRUPT = 12
+CORRUPT_DROPPED = 13
+WINDOW_UPDATE = 14
+WINDOW_FULL = 15
+WINDOW_PROBE = 16
+
+# kind -> (counter name, log line)
+EVENTS = (
+    ("sent", "Send message {seq}"),
+    ("retransmits", "Resend message {seq}"),
+    ("fast_retransmits", "Fast retransmit message {seq}"),
+    ("timeouts", "Timeout! Resend messages {seq} to {arg}"),
+    ("acks", "Receive ACK {seq}. Message successfully sent!"),
+    ("acks_ignored", "Receive ACK {seq}. Ignored"),
+    ("duplicate_acks", "Receive ACK {seq}, still missing {arg}"),
+    ("corrupt_acks", "Corruption detected in ACK"),
+    ("delivered", "Receive message {seq}. Send ACK {arg}"),
+    ("duplicates", "Receive duplicate message {seq}. Send ACK {arg}"),
+    ("out_of_order", "Receive out-of-order message {seq}. Send ACK {arg}"),
+    ("out_of_window", "Receive message {seq} outside the window. Ignored"),
+    ("corrupt", "Corruption detected! Send ACK {arg}"),
+    ("corrupt_dropped", "Corruption detected! Segment dropped"),
+    ("window_updates", "Window update: {seq} segments"),
+    ("window_full", "Receive message {seq}, no room in the window. Send ACK {arg}"),
+    ("window_probes", "Receive window closed. Probe with empty message {seq}"),
+)
+
+# one trace record: time, kind, seq, arg
+RECORD = struct.Struct("<dBqq")
+
+
+class Histogram:
+    """Durations in power-of-two buckets of microseconds.
+
+    Bucket i holds values under 2**i us (and at least 2**(i-1) us); the
+    last one everything longer. Recording is a few integer operations, and
+    percentiles come out as the upper bound of their bucket.
+    """
+
+    buckets = 32    # up to 2**31 us, about 36 minutes
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), self.buckets - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper bound, in seconds, of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": {2 ** i: n for i, n in enumerate(self.counts) if n},  # upper bound in us -> count
+        }
+
+
+class Metrics:
+    def __init__(self, trace_size=0, log=None, clock=time.time):
+        self.counts = [0] * len(EVENTS)
+        self.histograms = {"rtt": Histogram(), "send_wait": Histogram()}
+        self.clock = clock          # SWRDT sets its own, virtual time on the emulator
+        self.log = log              # called with each event's line, e.g. print
+        self.trace_size = trace_size
+        self.trace = bytearray(trace_size * RECORD.size) if trace_size else None
+        self.events = 0             # recorded so far; the ring holds the last trace_size
+
+    def event(self, kind, seq=0, arg=0):
+        self.counts[kind] += 1
+        if self.trace is not None:
+            RECORD.pack_into(self.trace, self.events % self.trace_size * RECORD.size, self.clock(), kind, seq, arg)
+            self.events += 1
+        if self.log is not None:
+            self.log(EVENTS[kind][1].format(seq=seq, arg=arg))
+
+    def observe(self, histogram, seconds):
+        self.histograms[histogram].record(seconds)
+
+    def counters(self):
+        return {name: n for (name, _), n in zip(EVENTS, self.counts)}
+
+    def trace_records(self):
+        # [(time, kind, seq, arg), ...] oldest first
+        if self.trace is None:
+            return []
+        size = self.trace_size
+        first = max(0, self.events - size)
+        return [RECORD.unpack_from(self.trace, i % size * RECORD.size) for i in range(first, self.events)]
+
+    def write_trace(self, path):
+        # the raw records, oldest first; read back with RECORD.iter_unpack
+        with open(path, "wb") as f:
+            for record in self.trace_records():
+                f.write(RECORD.pack(*record))
+
+    def snapshot(self):
+        return {
+            "counters": self.counters(),
+            "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+            "trace": [(at, EVENTS[kind][0], seq, arg) for at, kind, seq, arg in self.trace_records()],
+        }
@@ -0,0 +1,286 @@
+# Mux.py
+# Many SWRDT connections over one socket. Segments in the binary formats
+# carry a 16-bit connection id; a Mux reads every socket it has from a
+# single I/O thread, cuts the stream into segments and hands each one to
+# the Channel with that id. A Channel looks like a NetworkLayer to SWRDT
+# (pass it as network=), and the same I/O thread also runs the
+# retransmission timers of every SWRDT on it, so a Mux with any number of
+# connections costs one thread instead of two per connection. A Mux's
+# sockets carry one wire format, Mux(wire=...), and the SWRDTs on its
+# channels must be made with the same.
+#
+#   server = Mux.Mux()
+#   server.listen(port)
+#   channel = server.accept()         # a new connection id from any peer
+#   rdt = SWRDT.SWRDT("receiver", None, None, network=channel)
+#
+#   client = Mux.Mux()
+#   peer = client.connect(host, port)
+#   rdt = SWRDT.SWRDT("sender", None, None, network=client.open(peer))
+import heapq
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+
+import Network
+import SWRDT
+
+
+class Channel:
+    """One multiplexed connection; what SWRDT uses as its network."""
+
+    def __init__(self, peer, conn_id):
+        self.peer = peer
+        self.conn_id = conn_id
+        self.timers = peer.mux      # SWRDT runs its timers on the Mux's thread
+        self.lock = threading.Lock()
+        self.buffer_S = bytearray()
+        self.on_data = None
+        self.closed = False
+
+    @property
+    def corrupt_from(self):
+        return self.peer.corrupt_from
+
+    @corrupt_from.setter
+    def corrupt_from(self, value):
+        # set by SWRDT; the peer's socket carries one format, so it's shared
+        self.peer.corrupt_from = value
+
+    @property
+    def reorders(self):
+        return self.peer.reorders
+
+    @property
+    def wire(self):
+        # SWRDT checks it was given the format the Mux reads
+        return self.peer.mux.wire
+
+    def set_receiver(self, on_data):
+        # as NetworkLayer's: what was buffered is handed on before deliver()
+        # can pass on anything newer
+        with self.lock:
+            self.on_data = on_data
+            pending = bytes(self.buffer_S)
+            self.buffer_S.clear()
+            if pending:
+                on_data(pending)
+
+    def network_send(self, msg_S):
+        if self.closed:
+            raise OSError("channel is closed")
+        self.peer.network_send(msg_S)
+
+    def network_receive(self):
+        with self.lock:
+            ret_S = bytes(self.buffer_S)
+            self.buffer_S.clear()
+        return ret_S
+
+    def deliver(self, data):
+        # I/O thread: a segment for this channel, or None once the socket is gone
+        with self.lock:
+            on_data = self.on_data
+            if on_data is None and data is not None:
+                self.buffer_S += data
+        if on_data is not None:
+            on_data(data)
+
+    def disconnect(self):
+        # the other end isn't told: segments that still arrive are dropped
+        self.closed = True
+        self.peer.forget(self.conn_id)
+
+
+class Peer(Network.NetworkLayer):
+    """One TCP connection of a Mux and the channels multiplexed on it.
+
+    Sending is NetworkLayer's, with the same loss, corruption and reordering;
+    receiving is done by the Mux's I/O thread instead of a collector.
+    """
+
+    def __init__(self, mux, conn, accepting):
+        self.mux = mux
+        self.codec = mux.codec
+        self.conn = conn
+        self.accepting = accepting  # unknown ids from the other end are new connections
+        self.corrupt_from = self.codec.length_end
+        self.send_lock = threading.Lock()
+        self.segments = SWRDT.SegmentBuffer(self.codec)
+        self.channels = {}          # conn_id -> Channel
+        self.closed_ids = set()     # channels closed here, whose late segments are dropped
+        self.next_id = itertools.count(1)
+        self.reorder_msg_S = None
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def open(self):
+        with self.mux.lock:
+            conn_id = next(self.next_id)
+            if conn_id > self.codec.max_conn_id:
+                raise OSError("out of connection ids")
+            channel = self.channels[conn_id] = Channel(self, conn_id)
+        return channel
+
+    def forget(self, conn_id):
+        with self.mux.lock:
+            self.channels.pop(conn_id, None)
+            self.closed_ids.add(conn_id)
+
+    def readable(self):
+        # I/O thread: route everything that arrived to its channel
+        try:
+            data = self.conn.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            self.mux.drop_peer(self)
+            for channel in list(self.channels.values()):
+                channel.deliver(None)
+            return
+        self.segments.feed(data)
+        while True:
+            raw = self.segments.next_segment()
+            if raw is None:
+                return
+            conn_id = self.codec.connection(raw)
+            channel = self.channels.get(conn_id)
+            if channel is None:
+                # only an intact segment opens a connection, a damaged id must not
+                if not self.accepting or conn_id in self.closed_ids or not self.codec.parse(raw)[3]:
+                    continue
+                with self.mux.lock:
+                    channel = self.channels[conn_id] = Channel(self, conn_id)
+                self.mux.accepted.put(channel)
+            channel.deliver(raw)
+
+    def disconnect(self):
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Mux:
+    def __init__(self, wire="binary"):
+        if wire not in SWRDT.codecs:
+            raise ValueError(f"unknown wire format {wire!r}")
+        self.wire = wire
+        self.codec = SWRDT.codecs[wire]
+        if self.codec.max_conn_id == 0:
+            raise ValueError(f"the {wire} format has no connection ids to multiplex on")
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.accepted = queue.Queue()   # channels opened by the other ends
+        self.peers = []
+        self.listener = None
+        self.timers = []                # heap of (time, serial, callback, args)
+        self.serial = itertools.count()
+        self.closed = False
+        # writing a byte here wakes the I/O thread from select()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, self._drain_wakeups)
+        self.thread = threading.Thread(name="Mux", target=self._run, daemon=True)
+        self.thread.start()
+
+    # --- endpoints ---
+    def listen(self, port, host="localhost", backlog=64):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self._register(self.listener, self._accept_peer)
+
+    def connect(self, host, port):
+        conn = socket.create_connection((host, port))
+        peer = Peer(self, conn, accepting=False)
+        self._add_peer(peer)
+        return peer
+
+    def open(self, peer):
+        """A new connection to the other end of `peer`."""
+        return peer.open()
+
+    def accept(self, timeout=None):
+        """Next connection opened by any peer, None on timeout."""
+        try:
+            return self.accepted.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self._wake()
+        self.thread.join()
+        for peer in self.peers:
+            peer.disconnect()
+            peer.conn.close()
+        if self.listener is not None:
+            self.listener.close()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+    # --- timers, for the SWRDTs on our channels ---
+    def time(self):
+        return time.time()
+
+    def call_at(self, when, callback, *args):
+        with self.lock:
+            serial = next(self.serial)
+            heapq.heappush(self.timers, (when, serial, callback, args))
+            earliest = self.timers[0][1] == serial
+        if earliest:
+            self._wake()
+
+    # --- I/O thread ---
+    def _register(self, sock, callback):
+        with self.lock:
+            self.selector.register(sock, selectors.EVENT_READ, callback)
+        self._wake()
+
+    def _add_peer(self, peer):
+        self.peers.append(peer)
+        self._register(peer.conn, peer.readable)
+
+    def _accept_peer(self):
+        try:
+            conn, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(True)
+        self._add_peer(Peer(self, conn, accepting=True))
+
+    def drop_peer(self, peer):
+        self.selector.unregister(peer.conn)
+
+    def _wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _drain_wakeups(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        while not self.closed:
+            with self.lock:
+                timeout = max(0.0, self.timers[0][0] - time.time()) if self.timers else None
+            for key, _ in self.selector.select(timeout):
+                key.data()
+            now = time.time()
+            while True:
+                with self.lock:
+                    if not self.timers or self.timers[0][0] > now:
+                        break
+                    _, _, callback, args = heapq.heappop(self.timers)
+                callback(*args)
@@ -16,19 +16,23 @@ class NetworkLayer:
     # class variables
     sock = None
     conn = None
-    buffer_S = ""
+    buffer_S = None
     lock = threading.Lock()
     collect_thread = None
     stop = None
-    socket_timeout = 0.1
     reorder_msg_S = None
+    on_data = None  # if set, called from the collector thread with each chunk received,
+                    # and with None once the connection is gone
 
     def __init__(self, role_S, receiver_S, port):
+        self.buffer_S = bytearray()
+        # bytes at the front corruption never touches, so framing survives
+        # (the text format's length field; SWRDT sets this for its format)
+        self.corrupt_from = SWRDT.Segment.length_S_length
         if role_S == "sender":
             print("Network: role is sender")
             self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.conn.connect((receiver_S, port))
-            self.conn.settimeout(self.socket_timeout)
 
         elif role_S == "receiver":
             print("Network: role is receiver")
@@ -36,16 +40,41 @@ class NetworkLayer:
             self.sock.bind(("localhost", port))
             self.sock.listen(1)
             self.conn, addr = self.sock.accept()
-            self.conn.settimeout(self.socket_timeout)
 
+        # segments are small and each one is waited for: don't let Nagle
+        # hold them back for the peer's delayed ACK
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # the collector and the application can both send (ACKs, data)
+        self.send_lock = threading.Lock()
         # start the thread to receive data on the connection
         self.collect_thread = threading.Thread(name="Collector", target=self.collect)
         self.stop = False
         self.collect_thread.start()
 
+    @property
+    def reorders(self):
+        # whether segments may arrive out of order; SWRDT sizes its sequence space by this
+        return self.prob_pkt_reorder > 0
+
+    def set_receiver(self, on_data):
+        # deliver data as it arrives instead of through network_receive().
+        # What was buffered goes first, under the lock: the collector
+        # can't hand on a newer chunk until it has
+        with self.lock:
+            self.on_data = on_data
+            pending = bytes(self.buffer_S)
+            self.buffer_S.clear()
+            if pending:
+                on_data(pending)
+
     def disconnect(self):
         if self.collect_thread:
             self.stop = True
+            # the collector blocks in recv(); shutting the socket down wakes it
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.collect_thread.join()
 
     def __del__(self):
@@ -55,14 +84,20 @@ class NetworkLayer:
             self.conn.close()
 
     def network_send(self, msg_S):
+        with self.send_lock:
+            self._send(msg_S)
+
+    def _send(self, msg_S):
+        if isinstance(msg_S, str):
+            msg_S = msg_S.encode("utf-8")
         # return without sending if the packet is being dropped
         if random.random() < self.prob_pkt_loss:
             return
         # corrupt a packet
         if random.random() < self.prob_byte_corr:
-            start = random.randint(SWRDT.Segment.length_S_length, len(msg_S) - 5)
+            start = random.randint(self.corrupt_from, max(self.corrupt_from, len(msg_S) - 5))
             num = random.randint(1, 5)
-            repl_S = "".join(random.sample("XXXXX", num))  # sample length >= num
+            repl_S = "".join(random.sample("XXXXX", num)).encode()  # sample length >= num
             msg_S = msg_S[:start] + repl_S + msg_S[start + num :]
         # reorder packets - either hold a packet back, or if one held back then send both
         if random.random() < self.prob_pkt_reorder or self.reorder_msg_S:
@@ -76,33 +111,36 @@ class NetworkLayer:
         # keep calling send until all the bytes are transferred
         totalsent = 0
         while totalsent < len(msg_S):
-            sent = self.conn.send(msg_S[totalsent:].encode("utf-8"))
+            sent = self.conn.send(msg_S[totalsent:])
             if sent == 0:
                 raise RuntimeError("socket connection broken")
             totalsent = totalsent + sent
 
-    ## Receive data from the network and save in internal buffer
+    ## Receive data from the network and hand it on, or save it in the internal buffer
     def collect(self):
-        #         print (threading.currentThread().getName() + ': Starting')
-        while True:
+        # recv() blocks until data arrives, so an idle connection costs no CPU
+        while not self.stop:
             try:
                 recv_bytes = self.conn.recv(4096)
-                with self.lock:
-                    self.buffer_S += recv_bytes.decode("utf-8")
-            # you may need to uncomment the BlockingIOError handling on Windows machines
-            #             except BlockingIOError as err:
-            #                 pass
-            except socket.timeout as err:
-                pass
-            if self.stop:
-                #                 print (threading.currentThread().getName() + ': Ending')
+            except OSError:
+                recv_bytes = b""
+            if not recv_bytes:
+                # peer closed (or disconnect() shut us down)
+                if self.on_data is not None:
+                    self.on_data(None)
                 return
+            with self.lock:
+                on_data = self.on_data
+                if on_data is None:
+                    self.buffer_S += recv_bytes
+            if on_data is not None:
+                on_data(recv_bytes)
 
     ## Deliver collected data to sender
     def network_receive(self):
         with self.lock:
-            ret_S = self.buffer_S
-            self.buffer_S = ""
+            ret_S = bytes(self.buffer_S)
+            self.buffer_S.clear()
         return ret_S
 
 
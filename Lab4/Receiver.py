@@ -1,38 +1,62 @@
 import argparse
-import SWRDT
 import time
+import Congestion
+import Metrics
+import SWRDT
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="SWRDT Receiver.")
     parser.add_argument("port", help="Port.", type=int)
+    parser.add_argument("--mode", help="Transport: stop-and-wait, Go-Back-N or Selective Repeat.",
+                        choices=SWRDT.SWRDT.modes, default="sw")
+    parser.add_argument("--window", help="Window size for gbn and sr.", type=int, default=8)
+    parser.add_argument("--timeout", help="Fixed retransmission timeout in seconds (default: adaptive).",
+                        type=float, default=None)
+    parser.add_argument("--wire", help="Segment format; both ends must match.",
+                        choices=sorted(SWRDT.codecs), default="binary")
+    parser.add_argument("--congestion", help="Congestion control for gbn and sr.",
+                        choices=sorted(Congestion.congestion_algorithms), default="reno")
+    parser.add_argument("--mss", help="Largest payload per segment when sending a file.",
+                        type=int, default=SWRDT.DEFAULT_MSS)
+    parser.add_argument("--file", help="Receive a file from Sender.py --file and write it here.")
+    parser.add_argument("--quiet", help="Don't print every transport event.", action="store_true")
     args = parser.parse_args()
 
     timeout = 10  # close connection if no new data within 10 seconds
-    time_of_last_data = time.time()
 
     # Receiver mode
-    swrdt = SWRDT.SWRDT("receiver", None, args.port)
+    swrdt = SWRDT.SWRDT("receiver", None, args.port, timeout=args.timeout, mode=args.mode, window=args.window,
+                        wire=args.wire, mss=args.mss,
+                        congestion=args.congestion, metrics=Metrics.Metrics(log=None if args.quiet else print))
+
+    if args.file:
+        start = time.perf_counter()
+        try:
+            size = swrdt.swrdt_recv_file(args.file, timeout=timeout)
+        except ConnectionError as e:
+            print(f"File transfer failed: {e}")
+        else:
+            elapsed = time.perf_counter() - start
+            print(f"Received {size} bytes in {elapsed:.2f} s ({size / elapsed / 1e6:.2f} MB/s) into {args.file}")
+        # stay long enough to re-ACK the last segment if that ACK was lost
+        time.sleep(1)
+        swrdt.disconnect()
+        raise SystemExit
 
     last_echoed = None
     while True:
-        # Try to receive message before timeout
-        msg_S = swrdt.swrdt_receive()
+        # Wait for the next message
+        msg_S = swrdt.swrdt_receive(timeout=timeout)
 
         if msg_S is None:
             # If no message after timeout -> terminate
-            if time.time() - time_of_last_data > timeout:
-                break
-            time.sleep(0.05)  # reduce CPU usage
-            continue
+            break
 
         # Check for shutdown signal
         if msg_S == "END":
             print("Shutdown signal received. Exiting.")
             break
 
-        # Message received successfully
-        time_of_last_data = time.time()
-
         # Only echo if this is a new message
         if msg_S != last_echoed:
             print(f"Reply: {msg_S}\n")
@@ -41,4 +65,5 @@ if __name__ == "__main__":
         else:
             print(f"Duplicate message ignored at application layer: {msg_S}\n")
 
+    swrdt.swrdt_flush(timeout=1)
     swrdt.disconnect()
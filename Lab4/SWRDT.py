@@ -1,7 +1,19 @@
+import Congestion
+import Metrics
 import Network
 import argparse
 import hashlib
+import os
+import struct
+import threading
 import time
+import zlib
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Segment:
@@ -10,10 +22,14 @@ class Segment:
     length_S_length = 10
     ## length of md5 checksum in hex
     checksum_length = 32
+    ## sequence numbers wrap around at the largest the field can hold
+    seq_space = 10 ** seq_num_S_length
 
-    def __init__(self, seq_num, msg_S):
+    def __init__(self, seq_num, msg_S, is_ack=False, conn_id=0):
         self.seq_num = seq_num
-        self.msg_S = msg_S  # payload or "ACK"
+        self.msg_S = msg_S  # payload bytes
+        self.is_ack = is_ack
+        self.conn_id = conn_id  # which multiplexed connection (binary format only)
 
     @classmethod
     def from_byte_S(cls, byte_S):
@@ -30,22 +46,27 @@ class Segment:
             return None
         msg_S = byte_S[checksum_off:]
 
+        # the text format marks ACKs by their payload
+        if msg_S.startswith(b"ACK"):
+            return cls(seq_num, msg_S[3:], True)
         return cls(seq_num, msg_S)
 
     def get_byte_S(self):
-        seq_num_S = str(self.seq_num).zfill(self.seq_num_S_length)
+        msg_S = b"ACK" + self.msg_S if self.is_ack else self.msg_S
+        seq_num_S = str(self.seq_num).zfill(self.seq_num_S_length).encode()
         total_length = (
             self.length_S_length +
             len(seq_num_S) +
             self.checksum_length +
-            len(self.msg_S)
+            len(msg_S)
         )
-        length_S = str(total_length).zfill(self.length_S_length)
+        length_S = str(total_length).zfill(self.length_S_length).encode()
 
-        checksum = hashlib.md5((length_S + seq_num_S + self.msg_S).encode("utf-8"))
-        checksum_S = checksum.hexdigest()
+        checksum = hashlib.md5(length_S + seq_num_S)
+        checksum.update(msg_S)
+        checksum_S = checksum.hexdigest().encode()
 
-        return length_S + seq_num_S + checksum_S + self.msg_S
+        return b"".join((length_S, seq_num_S, checksum_S, msg_S))
 
     @staticmethod
     def corrupt(byte_S):
@@ -56,188 +77,942 @@ class Segment:
         ):
             return True
 
-        length_S = byte_S[:Segment.length_S_length]
-        seq_S = byte_S[
-            Segment.length_S_length:
-            Segment.length_S_length + Segment.seq_num_S_length
-        ]
         checksum_start = Segment.length_S_length + Segment.seq_num_S_length
         checksum_S = byte_S[
             checksum_start:
             checksum_start + Segment.checksum_length
         ]
-        msg_S = byte_S[checksum_start + Segment.checksum_length:]
+        msg_S = memoryview(byte_S)[checksum_start + Segment.checksum_length:]
+
+        # hash around the checksum field instead of joining the rest into a copy
+        computed = hashlib.md5(byte_S[:checksum_start])
+        computed.update(msg_S)
+        return checksum_S != computed.hexdigest().encode()
+
+
+# ---------------------------
+# Checksums for the binary format. Like zlib's, each takes the bytes and the
+# value so far, so header and payload are summed without joining them.
+# ---------------------------
+def internet_checksum(data, value=0):
+    # RFC 1071's ones' complement sum of 16-bit words. 2**16 is 1 modulo
+    # 0xFFFF, so that sum is just the bytes read as one number, modulo
+    # 0xFFFF (0 and 0xFFFF are the same in ones' complement). An odd-length
+    # piece is padded with a zero byte, so only the last one may be odd.
+    n = int.from_bytes(data, "big")
+    if len(data) % 2:
+        n <<= 8
+    return (value + n) % 0xFFFF
+
+
+checksums = {"crc32": zlib.crc32, "adler32": zlib.adler32, "internet": internet_checksum}
+
+
+# ---------------------------
+# Wire formats. A codec turns segments into bytes and back, and finds
+# segment boundaries in the received byte stream:
+#   encode(seg)                  -> bytes
+#   frame_length(buffer, offset) -> length of the segment starting at
+#                                   offset, None if more bytes are needed,
+#                                   0 if no segment starts there
+#   resync(buffer, offset)       -> offset of the next place a segment
+#                                   could start, past garbage
+#   parse(raw)                   -> (seq_num, is_ack, payload, intact);
+#                                   seq_num and is_ack are best guesses
+#                                   if not intact
+#   parse_batch(raws)            -> [parse(raw) for raw in raws], with the
+#                                   checksums verified in one go
+#   connection(raw)              -> the connection id, for demultiplexing
+#                                   (ids up to max_conn_id)
+# ---------------------------
+class TextCodec:
+    # the original format: ASCII length and sequence fields, hex MD5 of it all
+    name = "text"
+    header_length = Segment.length_S_length + Segment.seq_num_S_length + Segment.checksum_length
+    length_end = Segment.length_S_length  # the emulated network leaves the length field alone
+    seq_space = Segment.seq_space
+    max_conn_id = 0     # no connection field: one connection per socket
+
+    def encode(self, seg):
+        return seg.get_byte_S()
+
+    def frame_length(self, buffer, offset):
+        if len(buffer) - offset < Segment.length_S_length:
+            return None
+        try:
+            return max(0, int(buffer[offset:offset + Segment.length_S_length]))
+        except ValueError:
+            return 0
+
+    def resync(self, buffer, offset):
+        # no marker to look for: try again one byte on
+        return offset + 1
+
+    def parse(self, raw):
+        seq_off = Segment.length_S_length + Segment.seq_num_S_length
+        payload = raw[seq_off + Segment.checksum_length:]
+        is_ack = payload.startswith(b"ACK")
+        if is_ack:
+            payload = payload[3:]
+        try:
+            seq_num = int(raw[Segment.length_S_length:seq_off])
+        except ValueError:
+            return -1, is_ack, payload, False
+        return seq_num, is_ack, payload, not Segment.corrupt(raw)
+
+    def parse_batch(self, raws):
+        # MD5 has no cheaper way through many segments
+        return [self.parse(raw) for raw in raws]
+
+    def connection(self, raw):
+        return 0
+
+
+class BinaryCodec:
+    # magic, flags, connection id, total length, sequence number, checksum:
+    # 16 bytes of header. The checksum is CRC32 by default ("binary"), or
+    # Adler-32 or the 16-bit Internet checksum ("binary-adler32",
+    # "binary-internet"), cheaper but weaker.
+    MAGIC = 0xA7
+    FLAG_ACK = 0x01
+    header = struct.Struct("!BBHII")
+    header_length = header.size + 4
+    length_end = 8      # magic, flags, connection and length, which the emulated network leaves alone
+    seq_space = 2 ** 32
+    max_conn_id = 2 ** 16 - 1
+    max_length = 1 << 24    # anything claiming to be longer is garbage
+    batch_min = 16          # fewer segments than this aren't worth a NumPy call
+
+    def __init__(self, checksum="crc32"):
+        self.name = "binary" if checksum == "crc32" else f"binary-{checksum}"
+        self.checksum = checksums[checksum]
+        # only the Internet checksum is a plain sum, which NumPy can do for
+        # a whole burst at once
+        self.vectorized = checksum == "internet" and numpy is not None
+
+    def encode(self, seg):
+        flags = self.FLAG_ACK if seg.is_ack else 0
+        head = self.header.pack(self.MAGIC, flags, seg.conn_id, self.header_length + len(seg.msg_S), seg.seq_num)
+        check = self.checksum(seg.msg_S, self.checksum(head))
+        return b"".join((head, check.to_bytes(4, "big"), seg.msg_S))
+
+    def frame_length(self, buffer, offset):
+        if len(buffer) - offset < self.length_end:
+            return None
+        if buffer[offset] != self.MAGIC:
+            return 0
+        length = int.from_bytes(buffer[offset + 4:offset + 8], "big")
+        if not self.header_length <= length <= self.max_length:
+            return 0
+        return length
+
+    def resync(self, buffer, offset):
+        # skip to the next byte that could start a segment
+        found = buffer.find(self.MAGIC, offset + 1)
+        return found if found >= 0 else len(buffer)
+
+    def parse(self, raw):
+        _, flags, _, _, seq_num = self.header.unpack_from(raw)
+        check = int.from_bytes(raw[self.header.size:self.header_length], "big")
+        payload = raw[self.header_length:]
+        intact = check == self.checksum(payload, self.checksum(raw[:self.header.size]))
+        return seq_num, bool(flags & self.FLAG_ACK), payload, intact
+
+    def parse_batch(self, raws):
+        unpack = self.header.unpack_from
+        header_length = self.header_length
+        parsed = []
+        if self.vectorized and len(raws) >= self.batch_min:
+            for raw, intact in zip(raws, self._internet_batch(raws)):
+                _, flags, _, _, seq_num = unpack(raw)
+                parsed.append((seq_num, bool(flags & self.FLAG_ACK), raw[header_length:], intact))
+            return parsed
+        # parse() with the lookups done once for the whole burst
+        checksum = self.checksum
+        head_size = self.header.size
+        for raw in raws:
+            _, flags, _, _, seq_num = unpack(raw)
+            payload = raw[header_length:]
+            intact = int.from_bytes(raw[head_size:header_length], "big") == checksum(payload, checksum(raw[:head_size]))
+            parsed.append((seq_num, bool(flags & self.FLAG_ACK), payload, intact))
+        return parsed
+
+    def _internet_batch(self, raws):
+        # every segment's 16-bit words end to end (odd lengths padded, so
+        # each starts on a word), one sum per segment, and that sum less the
+        # checksum field compared with the field: bytes 12-13 must be zero,
+        # 14-15 the sum of the rest
+        lengths = numpy.fromiter(map(len, raws), dtype=numpy.int64, count=len(raws))
+        lengths += lengths & 1
+        words = numpy.frombuffer(b"".join(raw + b"\0" if len(raw) & 1 else raw for raw in raws), dtype=">u2")
+        starts = numpy.zeros(len(raws), dtype=numpy.int64)
+        numpy.cumsum(lengths[:-1] // 2, out=starts[1:])
+        sums = numpy.add.reduceat(words, starts, dtype=numpy.uint64)
+        high = words[starts + 6]
+        low = words[starts + 7]
+        return ((high == 0) & ((sums - high - low) % 0xFFFF == low)).tolist()
 
-        computed = hashlib.md5((length_S + seq_S + msg_S).encode("utf-8")).hexdigest()
-        return checksum_S != computed
+    def connection(self, raw):
+        return int.from_bytes(raw[2:4], "big")
+
+
+codecs = {codec.name: codec for codec in (TextCodec(), BinaryCodec(), BinaryCodec("adler32"),
+                                         BinaryCodec("internet"))}
+
+
+class SegmentBuffer:
+    """Received bytes not yet cut into segments.
+
+    A bytearray with a read offset: taking a segment off the front moves
+    the offset instead of copying everything behind it, and the consumed
+    prefix is only dropped once it is at least half the buffer, so each
+    byte is moved a bounded number of times however much is queued.
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.data = bytearray()
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def feed(self, data):
+        if self.offset and self.offset * 2 >= len(self.data):
+            del self.data[:self.offset]
+            self.offset = 0
+        self.data += data
+
+    def next_segment(self):
+        # bytes of the next complete segment, or None
+        seg_len = self.codec.frame_length(self.data, self.offset)
+        while seg_len == 0:
+            # garbage where a segment should start
+            self.offset = self.codec.resync(self.data, self.offset)
+            seg_len = self.codec.frame_length(self.data, self.offset)
+
+        if seg_len is None or len(self.data) - self.offset < seg_len:
+            return None
+
+        start = self.offset
+        self.offset += seg_len
+        with memoryview(self.data) as view:
+            return bytes(view[start:self.offset])
+
+    def segments(self):
+        # every complete segment buffered, to be parsed as one burst
+        burst = []
+        while True:
+            raw = self.next_segment()
+            if raw is None:
+                return burst
+            burst.append(raw)
+
+
+class RTOEstimator:
+    # retransmission timeout from measured round trips, as in RFC 6298
+    alpha = 1 / 8
+    beta = 1 / 4
+    k = 4
+    granularity = 0.001     # clock granularity G, in seconds
+
+    def __init__(self, initial=1.0, floor=0.02, ceiling=60.0, fixed=False):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.fixed = fixed      # keep `initial` forever, as the old hard-coded timeout did
+        self.rto = initial
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.min_rtt = None
+        self.max_rtt = None
+        self.timeouts = 0
+        self.retransmits = 0
+
+    def sample(self, rtt):
+        # callers only pass round trips of segments sent once (Karn's rule)
+        self.samples += 1
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        # a clean sample is also the only thing that undoes a backoff (RFC 6298
+        # section 5): an ACK for a resent segment may answer the first copy,
+        # so it says nothing about whether the backed-off timer is too long
+        if not self.fixed:
+            rto = self.srtt + max(self.granularity, self.k * self.rttvar)
+            self.rto = min(self.ceiling, max(self.floor, rto))
+
+    def backoff(self):
+        self.timeouts += 1
+        if not self.fixed:
+            self.rto = min(self.ceiling, self.rto * 2)
+
+    def stats(self):
+        return {
+            "rto": self.rto,
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "samples": self.samples,
+            "min_rtt": self.min_rtt,
+            "max_rtt": self.max_rtt,
+            "timeouts": self.timeouts,
+            "retransmits": self.retransmits,
+        }
+
+
+DEFAULT_MSS = 1400
+FILE_HEADER = struct.Struct("!Q")   # file transfers start with the file size
+RCV_WINDOW = struct.Struct("!I")    # an ACK's payload: segments the receiver can still take
 
 
 class SWRDT:
-    def __init__(self, role, receiver, port, timeout=2.0):
-        self.network = Network.NetworkLayer(role, receiver, port)
+    # sw:  stop-and-wait, swrdt_send returns once the message is ACKed
+    # gbn: Go-Back-N, cumulative ACKs, one timer, resend the whole window
+    # sr:  Selective Repeat, per-segment ACKs and timers, receiver buffers
+    #      segments that arrive ahead of a gap
+    modes = ("sw", "gbn", "sr")
+
+    def __init__(self, role, receiver, port, timeout=None, mode="sw", window=1, seq_space=None,
+                 rto_floor=0.02, rto_ceiling=2.0, wire="binary", mss=DEFAULT_MSS, network=None,
+                 congestion="reno", rcv_window=1024, metrics=None):
+        if mode not in self.modes:
+            raise ValueError(f"unknown mode {mode!r}")
+        if wire not in codecs:
+            raise ValueError(f"unknown wire format {wire!r}")
+        if congestion not in Congestion.congestion_algorithms:
+            raise ValueError(f"unknown congestion control {congestion!r}")
+        # both ends must use the same wire format
+        self.codec = codecs[wire]
+        if mode == "sw":
+            window = 1
+        # sequence numbers count modulo seq_space; GBN needs more numbers
+        # than the window, SR twice the window, or old and new segments mix.
+        # That assumes segments arrive in order. A network that reorders
+        # (`reorders`, checked once, here) can hand over a segment or ACK
+        # after up to a window of newer ones, so it takes another window of
+        # numbers before that late copy can't pass for a current one.
+        seq_space = seq_space or self.codec.seq_space
+        needed = 2 * window if mode == "sr" else window + 1
+        reorders = network.reorders if network is not None else Network.NetworkLayer.prob_pkt_reorder > 0
+        if reorders:
+            needed += window
+        if not needed <= seq_space <= self.codec.seq_space:
+            raise ValueError(f"seq_space must be between {needed} and {self.codec.seq_space}"
+                             + (" on a network that reorders" if reorders else ""))
+
+        # `network` replaces the TCP NetworkLayer, e.g. with an
+        # Emulator.EmulatedNetwork or a Mux.Channel; role, receiver and port
+        # are then unused
+        self.network = network or Network.NetworkLayer(role, receiver, port)
+        # a network that parses segments itself (Mux) reads one format
+        if getattr(self.network, "wire", wire) != wire:
+            raise ValueError(f"the network carries the {self.network.wire} format, not {wire}")
+        self.network.corrupt_from = self.codec.length_end
+        self.conn_id = getattr(self.network, "conn_id", 0)
+        if self.conn_id > self.codec.max_conn_id:
+            raise ValueError(f"the {wire} format can't carry connection id {self.conn_id}")
+        self.mode = mode
+        self.window = window
+        self.seq_space = seq_space
+        self.mss = mss          # largest payload the stream calls put in one segment
 
         # Sender state
-        self.curr_seq = 1
+        self.curr_seq = 1       # sequence number of the next new message
+        self.send_base = 1      # oldest unACKed sequence number
+        self.unacked = {}       # seq -> segment string, in send order
+        self.sent_at = {}       # seq -> time it was last (re)transmitted
+        self.resent = set()     # seqs transmitted more than once, no RTT sample from these
+        self.timer_start = 0.0  # GBN's single timer, for the oldest unACKed
+        self.lost = {}          # unACKed seqs waiting to be resent, oldest first (values unused)
+        self.peer_window = window  # segments the receiver last said it can take
+        self.probe_at = None    # when to next probe the receiver's closed window
+        self.probes = 0
+        self.duplicate_acks = 0
 
         # Receiver state
         self.expected_seq = 1
-        self.last_delivered_seq = 0  # Track last delivered sequence number
+        self.rcv_buffer = {}    # SR: seq -> message that arrived ahead of expected_seq
+        self.rcv_window = min(rcv_window, 2 ** 32 - 1)  # messages buffered for the application
+        self.advertised = self.rcv_window
 
-        self.byte_buffer = ""
-        self.app_buffer = []  # messages delivered to application
-        self.timeout = timeout
+        self.byte_buffer = SegmentBuffer(self.codec)
+        self.app_buffer = deque()  # messages (bytes) delivered to application
+        self.partial = b""      # stream calls: the message being read from
+        self.partial_offset = 0
+        # timeout=None measures the round trip and adapts, never past the
+        # ceiling (by default the old fixed 2 s); a number is used as is
+        if timeout is None:
+            self.rto = RTOEstimator(floor=rto_floor, ceiling=rto_ceiling)
+        else:
+            self.rto = RTOEstimator(initial=timeout, fixed=True)
+
+        # Nothing polls: the network's collector thread runs incoming data
+        # through the protocol as it arrives, a timer thread sleeps until the
+        # next retransmission is due, and callers sleep on the condition
+        # until the state they wait for changes. The lock guards all state.
+        # A network with `timers` (a scheduler with time() and call_at())
+        # runs the retransmission timers instead of a thread of our own:
+        # Mux's I/O thread does that for all its connections. On an emulated
+        # network the simulator is that scheduler and delivers data too, so
+        # nothing runs in a thread and waiting means running the simulator.
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.closed = False
+        self.sim = getattr(self.network, "sim", None)
+        self.timers = getattr(self.network, "timers", None)
+        self.timer_thread = None
+        if self.timers is None:
+            self.now = time.time
+            self.timer_thread = threading.Thread(name="Timers", target=self._run_timers, daemon=True)
+            self.timer_thread.start()
+        else:
+            self.now = self.timers.time
+            self.timer_at = None    # when the scheduled timer event runs
+        # in flight: at most min(window, cwnd, the receiver's window)
+        self.cc = Congestion.congestion_algorithms[congestion](window, self.now)
+        # a Metrics.Metrics counts and traces events; None records nothing
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.clock = self.now
+        self.network.set_receiver(self._on_data)
 
     def disconnect(self):
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
+        if self.timer_thread is not None:
+            self.timer_thread.join()
         self.network.disconnect()
 
+    def _seq_add(self, seq, n):
+        return (seq + n) % self.seq_space
+
+    def _seq_offset(self, seq, base):
+        # how far seq is past base, going forward around the sequence space
+        return (seq - base) % self.seq_space
+
     # ---------------------------
-    # INTERNAL: extract raw seg
+    # INTERNAL: process incoming
+    # returns list: (ack_seq, is_corrupt, receiver window or None)
     # ---------------------------
-    def _extract_segment(self):
-        if len(self.byte_buffer) < Segment.length_S_length:
-            return None
+    def _process_incoming(self):
+        acks = []
+
+        # everything that arrived together is checked at once
+        for seq_num, is_ack, msg_S, intact in self.codec.parse_batch(self.byte_buffer.segments()):
+            if not intact:
+                if is_ack:
+                    acks.append((seq_num, True, None))     # corrupted ACK
+                elif self.mode != "sr":
+                    # corrupted DATA: repeat the cumulative ACK
+                    prev_ack = self._seq_add(self.expected_seq, -1)
+                    if self.metrics is not None:
+                        self.metrics.event(Metrics.CORRUPT, seq_num, prev_ack)
+                    self._send_ack(prev_ack)
+                elif self.metrics is not None:
+                    # SR ACKs name one segment, the sender's timer covers this one
+                    self.metrics.event(Metrics.CORRUPT_DROPPED, seq_num)
+                continue
+
+            # Clean segment
+            if is_ack:
+                window = RCV_WINDOW.unpack(msg_S)[0] if len(msg_S) == RCV_WINDOW.size else None
+                acks.append((seq_num, False, window))
+            elif self.mode == "sr":
+                self._receive_selective(Segment(seq_num, msg_S, conn_id=self.conn_id))
+            else:
+                self._receive_in_order(Segment(seq_num, msg_S, conn_id=self.conn_id))
+
+        return acks
+
+    def _free_window(self):
+        return max(0, self.rcv_window - len(self.app_buffer) - len(self.rcv_buffer))
+
+    def _fits(self, seq):
+        # the receive window runs rcv_window - (unread messages) from
+        # expected_seq, as TCP's does from rcv_nxt: what SR holds ahead of a
+        # gap is inside it, so the next in-order message always has room
+        return self._seq_offset(seq, self.expected_seq) < self.rcv_window - len(self.app_buffer)
+
+    def _window_full(self, seq):
+        # no room: drop the message and ACK what we have, which tells the
+        # sender the window
+        prev_ack = self._seq_add(self.expected_seq, -1)
+        if self.metrics is not None:
+            self.metrics.event(Metrics.WINDOW_FULL, seq, prev_ack)
+        self._send_ack(prev_ack)
 
+    def _send_ack(self, seq):
+        self.advertised = self._free_window()
         try:
-            seg_len = int(self.byte_buffer[:Segment.length_S_length])
-        except:
-            self.byte_buffer = self.byte_buffer[1:]
-            return None
+            self.network.network_send(self.codec.encode(Segment(seq, RCV_WINDOW.pack(self.advertised),
+                                                                is_ack=True, conn_id=self.conn_id)))
+        except OSError:
+            self.closed = True
+            self.changed.notify_all()
 
-        if len(self.byte_buffer) < seg_len:
-            return None
+    def _receive_in_order(self, seg):
+        # stop-and-wait and GBN: accept only the next message, ACK cumulatively
+        if seg.seq_num == self.expected_seq:
+            if not self._fits(seg.seq_num):
+                self._window_full(seg.seq_num)
+                return
+            if self.metrics is not None:
+                self.metrics.event(Metrics.DELIVER, seg.seq_num, seg.seq_num)
+            self.app_buffer.append(seg.msg_S)
+            self._send_ack(seg.seq_num)
+            self.expected_seq = self._seq_add(self.expected_seq, 1)
+            return
+        prev_ack = self._seq_add(self.expected_seq, -1)
+        if self.metrics is not None:
+            if self._seq_offset(self.expected_seq, seg.seq_num) <= self.window:
+                # already delivered, its ACK must have been lost
+                self.metrics.event(Metrics.DUPLICATE, seg.seq_num, prev_ack)
+            else:
+                self.metrics.event(Metrics.OUT_OF_ORDER, seg.seq_num, prev_ack)
+        self._send_ack(prev_ack)
 
-        seg_bytes = self.byte_buffer[:seg_len]
-        self.byte_buffer = self.byte_buffer[seg_len:]
-        return seg_bytes
+    def _receive_selective(self, seg):
+        # SR: ACK every segment in the receive window, deliver in order
+        seq = seg.seq_num
+        if self._seq_offset(seq, self.expected_seq) < self.window:
+            if seq not in self.rcv_buffer and not self._fits(seq):
+                self._window_full(seq)
+                return
+            if self.metrics is not None:
+                # ahead of a gap it waits in rcv_buffer, unless a copy already does
+                if seq in self.rcv_buffer:
+                    kind = Metrics.DUPLICATE
+                elif seq == self.expected_seq:
+                    kind = Metrics.DELIVER
+                else:
+                    kind = Metrics.OUT_OF_ORDER
+                self.metrics.event(kind, seq, seq)
+            self.rcv_buffer.setdefault(seq, seg.msg_S)
+            while self.expected_seq in self.rcv_buffer:
+                self.app_buffer.append(self.rcv_buffer.pop(self.expected_seq))
+                self.expected_seq = self._seq_add(self.expected_seq, 1)
+            # after storing it, so the ACK's window counts this message
+            self._send_ack(seq)
+        elif self._seq_offset(self.expected_seq, seq) <= self.window:
+            # delivered already, the sender missed our ACK
+            if self.metrics is not None:
+                self.metrics.event(Metrics.DUPLICATE, seq, seq)
+            self._send_ack(seq)
+        elif self.metrics is not None:
+            self.metrics.event(Metrics.OUT_OF_WINDOW, seq)
 
     # ---------------------------
-    # INTERNAL: process incoming
-    # returns list: (ack_seq, is_corrupt)
+    # INTERNAL: sender side
     # ---------------------------
-    def _process_incoming(self):
-        acks = []
+    def _transmit(self, seq):
+        self.sent_at[seq] = self.now()
+        try:
+            self.network.network_send(self.unacked[seq])
+        except OSError:
+            # the peer has gone; wake everyone waiting instead of retrying forever
+            self.closed = True
+            self.changed.notify_all()
 
-        while True:
-            raw = self._extract_segment()
-            if raw is None:
-                break
+    def _retransmit(self, seq):
+        self.resent.add(seq)
+        self.rto.retransmits += 1
+        if self.metrics is not None:
+            self.metrics.event(Metrics.RETRANSMIT, seq)
+        self._transmit(seq)
 
-            corrupted = Segment.corrupt(raw)
+    def _acked(self, seq, now):
+        # Karn's rule: an ACK for a resent segment may answer either copy
+        if seq in self.resent:
+            self.resent.discard(seq)
+        else:
+            rtt = now - self.sent_at[seq]
+            self.rto.sample(rtt)
+            if self.metrics is not None:
+                self.metrics.observe("rtt", rtt)
+        del self.unacked[seq]
+        del self.sent_at[seq]
 
-            length_off = Segment.length_S_length
-            seq_off = length_off + Segment.seq_num_S_length
-            checksum_off = seq_off + Segment.checksum_length
+    def rto_stats(self):
+        # current retransmission timeout and what the estimator has seen
+        return self.rto.stats()
 
-            try:
-                seq_num = int(raw[length_off:seq_off])
-            except:
-                seq_num = -1
-                corrupted = True
+    def congestion_stats(self):
+        # the congestion controller's state and the receiver's last window
+        return dict(self.cc.stats(), peer_window=self.peer_window, duplicate_acks=self.duplicate_acks)
 
-            msg_S = raw[checksum_off:]
+    def congestion_trace(self):
+        # [(time, cwnd, ssthresh), ...], one entry per change
+        return self.cc.trace
 
-            if corrupted:
-                if msg_S.startswith("ACK"):
-                    acks.append((seq_num, True))     # corrupted ACK
-                else:
-                    # corrupted DATA
-                    prev_ack = max(0, self.expected_seq - 1)
-                    print(f"Corruption detected! Send ACK {prev_ack}")
-                    ack = Segment(prev_ack, "ACK")
-                    self.network.network_send(ack.get_byte_S())
-                continue
+    def _in_flight(self):
+        # sent and not ACKed, less those known lost and not yet resent
+        return len(self.unacked) - len(self.lost)
 
-            # Clean segment
-            seg = Segment.from_byte_S(raw)
-            
-            if seg is None:
-                # Segment construction failed, skip it
-                continue
+    def _send_limit(self):
+        # a closed receiver window (0) lets no new data through; _probe finds
+        # out when it opens again
+        return min(self.window, self.cc.window(), self.peer_window)
 
-            if seg.msg_S.startswith("ACK"):
-                acks.append((seg.seq_num, False))
-            else:
-                # DATA segment
-                #print(f"[DEBUG] expected_seq={self.expected_seq}, last_delivered_seq={self.last_delivered_seq}, received_seq={seg.seq_num}")
-                if seg.seq_num == self.expected_seq:
-                    # Only deliver to application if not already delivered
-                    if seg.seq_num > self.last_delivered_seq:
-                        print(f"Receive message {seg.seq_num}. Send ACK {seg.seq_num}")
-                        self.app_buffer.append(seg.msg_S)
-                        self.last_delivered_seq = seg.seq_num
-                        ack = Segment(seg.seq_num, "ACK")
-                        self.network.network_send(ack.get_byte_S())
-                        self.expected_seq += 1
-                    else:
-                        # Duplicate, already delivered, just ACK last delivered
-                        prev_ack = self.last_delivered_seq
-                        print(f"Receive duplicate message {seg.seq_num}. Send ACK {prev_ack}")
-                        ack = Segment(prev_ack, "ACK")
-                        self.network.network_send(ack.get_byte_S())
+    def _resend_lost(self):
+        # segments marked lost go again, oldest first, as the window allows;
+        # one at a time into a closed receiver window, which had room for
+        # them when they were first sent, and whose ACK carries the window
+        while self.lost and self._in_flight() < max(1, self._send_limit()):
+            seq = next(iter(self.lost))
+            del self.lost[seq]
+            self._retransmit(seq)
+
+    def _probe(self, now):
+        # zero-window probe: nothing in flight, so the only way to hear that
+        # the window opened if that ACK got lost. An empty copy of the last
+        # ACKed message: the receiver has it already, stores nothing, and
+        # ACKs it with its window. Backs off like the retransmission timer.
+        seq = self._seq_add(self.send_base, -1)
+        if self.metrics is not None:
+            self.metrics.event(Metrics.WINDOW_PROBE, seq)
+        try:
+            self.network.network_send(self.codec.encode(Segment(seq, b"", conn_id=self.conn_id)))
+        except OSError:
+            self.closed = True
+            self.changed.notify_all()
+        self.probes += 1
+        self.probe_at = now + min(self.rto.ceiling, self.rto.rto * 2 ** self.probes)
+
+    def _fast_retransmit(self):
+        seq = self.send_base
+        if self.metrics is not None:
+            self.metrics.event(Metrics.FAST_RETRANSMIT, seq)
+        self.lost.pop(seq, None)
+        if self.mode == "gbn":
+            # the receiver threw away everything after the gap
+            self.lost = dict.fromkeys(later for later in self.unacked if later != seq)
+            self.timer_start = self.now()
+        self._retransmit(seq)
+
+    def _handle_ack(self, ack_seq, is_corrupt, window):
+        if is_corrupt:
+            if self.metrics is not None:
+                self.metrics.event(Metrics.CORRUPT_ACK, ack_seq)
+            if self.mode == "sw" and self.unacked:
+                self._retransmit(self.send_base)
+            return
+
+        window_update = window is not None and window != self.peer_window
+        if window is not None:
+            self.peer_window = window
+            if window > 0:
+                self.probe_at = None
+            elif self.probe_at is None:
+                self.probe_at = self.now() + self.rto.rto
+                self.probes = 0
+
+        if self.mode == "sr":
+            if ack_seq not in self.unacked:
+                if self.metrics is not None:
+                    self.metrics.event(Metrics.ACK_IGNORED, ack_seq)
+                return
+            if self.metrics is not None:
+                self.metrics.event(Metrics.ACK, ack_seq)
+            self._acked(ack_seq, self.now())
+            self.lost.pop(ack_seq, None)
+            if ack_seq != self.send_base:
+                # a later segment got through while the oldest did not: the
+                # selective counterpart of a duplicate ACK
+                self.duplicate_acks += 1
+                if self.metrics is not None:
+                    self.metrics.event(Metrics.DUPLICATE_ACK, ack_seq, self.send_base)
+                if self.send_base not in self.lost and self.cc.on_dup_ack(self._in_flight()):
+                    self._fast_retransmit()
+                return
+            # slide past everything ACKed so far
+            acked = 0
+            while self.send_base != self.curr_seq and self.send_base not in self.unacked:
+                self.send_base = self._seq_add(self.send_base, 1)
+                acked += 1
+            self.cc.on_ack(acked)
+            return
+
+        # cumulative: ack_seq and everything before it have arrived
+        in_flight = self._seq_offset(self.curr_seq, self.send_base)
+        if self._seq_offset(ack_seq, self.send_base) >= in_flight:
+            if (self.unacked and ack_seq == self._seq_add(self.send_base, -1) and not window_update
+                    and self.peer_window > 0):
+                # the receiver is still missing send_base (with the window
+                # closed, it may just have had no room for it)
+                self.duplicate_acks += 1
+                if self.metrics is not None:
+                    self.metrics.event(Metrics.DUPLICATE_ACK, ack_seq, self.send_base)
+                if self.cc.on_dup_ack(self._in_flight()):
+                    self._fast_retransmit()
+            elif self.metrics is not None:
+                self.metrics.event(Metrics.ACK_IGNORED, ack_seq)
+            return
+        if self.metrics is not None:
+            self.metrics.event(Metrics.ACK, ack_seq)
+        now = self.now()
+        end = self._seq_add(ack_seq, 1)
+        acked = 0
+        while self.send_base != end:
+            self._acked(self.send_base, now)
+            self.lost.pop(self.send_base, None)
+            self.send_base = self._seq_add(self.send_base, 1)
+            acked += 1
+        self.cc.on_ack(acked)
+        self.timer_start = now
+
+    def _next_timeout(self):
+        # when the earliest retransmission timer fires, None if none is running;
+        # with nothing in flight, when to probe a closed receiver window
+        if not self.unacked:
+            return self.probe_at
+        if self.mode == "sr":
+            # segments waiting in `lost` are not on the wire, so not timed
+            sent = self.sent_at.values()
+            if self.lost:
+                sent = [at for seq, at in self.sent_at.items() if seq not in self.lost]
+            first = min(sent, default=None)
+            return None if first is None else first + self.rto.rto
+        return self.timer_start + self.rto.rto
+
+    def _check_timers(self):
+        now = self.now()
+        if not self.unacked:
+            if self.probe_at is not None and self.probe_at <= now:
+                self._probe(now)
+            return
+        rto = self.rto.rto
+        if self.mode == "sr":
+            expired = [seq for seq, sent in self.sent_at.items() if sent + rto <= now and seq not in self.lost]
+            if expired:
+                self.cc.on_timeout(self._in_flight())
+                self.rto.backoff()
+            if self.metrics is not None:
+                for seq in expired:
+                    self.metrics.event(Metrics.TIMEOUT, seq, seq)
+            if expired:
+                # unacked is in send order, and so the resends
+                expired = set(expired)
+                self.lost = dict.fromkeys(seq for seq in self.unacked if seq in expired or seq in self.lost)
+        elif self.timer_start + rto <= now:
+            if self.metrics is not None:
+                self.metrics.event(Metrics.TIMEOUT, self.send_base, self._seq_add(self.curr_seq, -1))
+            self.cc.on_timeout(self._in_flight())
+            self.lost = dict.fromkeys(self.unacked)
+            self.timer_start = now
+            self.rto.backoff()
+        self._resend_lost()
+
+    def _on_data(self, data_S):
+        # collector thread: run what arrived through the protocol
+        with self.lock:
+            if data_S is None:
+                # connection closed, nothing more will arrive
+                self.closed = True
+                self.changed.notify_all()
+                return
+            self.byte_buffer.feed(data_S)
+            for ack_seq, is_corrupt, window in self._process_incoming():
+                self._handle_ack(ack_seq, is_corrupt, window)
+            self._resend_lost()
+            self._notify()
+
+    def _run_timers(self):
+        with self.lock:
+            while not self.closed:
+                deadline = self._next_timeout()
+                if deadline is None:
+                    self.changed.wait()
+                elif deadline > self.now():
+                    self.changed.wait(deadline - self.now())
                 else:
-                    # Out of order
-                    prev_ack = self.last_delivered_seq
-                    print(f"Receive out-of-order message {seg.seq_num}. Send ACK {prev_ack}")
-                    ack = Segment(prev_ack, "ACK")
-                    self.network.network_send(ack.get_byte_S())
+                    self._check_timers()
+                    self.changed.notify_all()
 
-        return acks
+    def _notify(self):
+        # state changed: wake waiters, and with a shared scheduler make sure
+        # a timer event is scheduled for the next retransmission deadline
+        self.changed.notify_all()
+        if self.timers is not None and not self.closed:
+            deadline = self._next_timeout()
+            if deadline is not None and (self.timer_at is None or deadline < self.timer_at):
+                self.timer_at = deadline
+                self.timers.call_at(deadline, self._on_timer, deadline)
+
+    def _on_timer(self, at):
+        # scheduler event; stale ones (the timer was moved earlier) do nothing
+        with self.lock:
+            if at != self.timer_at:
+                return
+            self.timer_at = None
+            if self.closed:
+                return
+            self._check_timers()
+            self._notify()
+
+    def _wait_for(self, predicate, timeout=None):
+        # Condition.wait_for, or on an emulated network run the simulator
+        # until predicate holds. The simulator can't run from inside one of
+        # its own events, so there this only checks predicate: code driven
+        # by simulator events has to pace its sends itself (swrdt_send
+        # raises BlockingIOError when the window is full)
+        if self.sim is None:
+            return self.changed.wait_for(predicate, timeout)
+        return self.sim.run_until(predicate, timeout)
 
     # ---------------------------
     # PUBLIC: swrdt_send()
     # ---------------------------
     def swrdt_send(self, msg_S):
-        seg = Segment(self.curr_seq, msg_S)
-        seg_bytes = seg.get_byte_S()
+        # str messages are sent as UTF-8
+        if isinstance(msg_S, str):
+            msg_S = msg_S.encode("utf-8")
+        with self.lock:
+            # wait for room in the window, which starts at the oldest unACKed
+            # message however many after it are ACKed already, and for the
+            # congestion and receiver windows; resending lost segments comes first
+            if self.metrics is not None:
+                waited = self.now()
+            room = self._wait_for(lambda: self.closed or (self._seq_offset(self.curr_seq, self.send_base) < self.window
+                                                          and not self.lost
+                                                          and self._in_flight() < self._send_limit()))
+            if self.closed:
+                raise ConnectionError("SWRDT connection is closed")
+            if not room:
+                # only on an emulated network: called from inside a simulator
+                # event, where time can't pass, or with nothing left to run
+                raise BlockingIOError("no room in the send window")
 
-        print(f"Send message {self.curr_seq}")
-        self.network.network_send(seg_bytes)
-        start = time.time()
-
-        while True:
-            incoming = self.network.network_receive()
-            if incoming:
-                self.byte_buffer += incoming
+            seq = self.curr_seq
+            self.unacked[seq] = self.codec.encode(Segment(seq, msg_S, conn_id=self.conn_id))
+            if len(self.unacked) == 1:
+                self.timer_start = self.now()
+            if self.metrics is not None:
+                self.metrics.observe("send_wait", self.now() - waited)
+                self.metrics.event(Metrics.SEND, seq)
+            self._transmit(seq)
+            self.curr_seq = self._seq_add(seq, 1)
+            # the timer thread may need to wake earlier now
+            self._notify()
 
-            acks = self._process_incoming()
+            if self.mode == "sw":
+                self.swrdt_flush()
 
-            for ack_seq, is_corrupt in acks:
-                if is_corrupt:
-                    print(f"Corruption detected in ACK. Resend message {self.curr_seq}")
-                    self.network.network_send(seg_bytes)
-                    start = time.time()
-                    continue
+    # ---------------------------
+    # PUBLIC: swrdt_flush()
+    # ---------------------------
+    def swrdt_flush(self, timeout=None):
+        # wait until every message sent so far is ACKed; False on timeout
+        with self.lock:
+            self._wait_for(lambda: not self.unacked or self.closed, timeout)
+            return not self.unacked
 
-                if ack_seq == self.curr_seq:
-                    print(f"Receive ACK {ack_seq}. Message successfully sent!")
-                    self.curr_seq += 1
-                    return
+    # ---------------------------
+    # PUBLIC: swrdt_receive()
+    # ---------------------------
+    def swrdt_receive(self, timeout=0):
+        # next delivered message as a str; waits up to `timeout` seconds for
+        # one (None waits for as long as it takes), None if nothing arrived
+        msg = self.swrdt_receive_bytes(timeout)
+        return None if msg is None else msg.decode("utf-8", "surrogateescape")
 
-                print(f"Receive ACK {ack_seq}. Resend message {self.curr_seq} Ignored")
+    def swrdt_receive_bytes(self, timeout=0):
+        # as swrdt_receive, but the message as sent, in bytes
+        with self.lock:
+            if self._wait_for(lambda: self.app_buffer or self.closed, timeout) and self.app_buffer:
+                msg = self.app_buffer.popleft()
+                self._window_opened()
+                return msg
+        return None
 
-            # timeout
-            if time.time() - start > self.timeout:
-                print(f"Timeout! Resend message {self.curr_seq}")
-                self.network.network_send(seg_bytes)
-                start = time.time()
+    def _window_opened(self):
+        # the application read something: if the sender last heard the
+        # window was under half, tell it now that it's past half again
+        if self.advertised < self.rcv_window // 2 <= self._free_window() and not self.closed:
+            if self.metrics is not None:
+                self.metrics.event(Metrics.WINDOW_UPDATE, self._free_window())
+            self._send_ack(self._seq_add(self.expected_seq, -1))
 
     # ---------------------------
-    # PUBLIC: swrdt_receive()
+    # PUBLIC: stream calls
+    # Delivered messages are read as consecutive pieces of one byte stream,
+    # so don't mix these with swrdt_receive on the same connection.
     # ---------------------------
-    def swrdt_receive(self):
-        if self.app_buffer:
-            return self.app_buffer.pop(0)
+    def swrdt_sendall(self, data):
+        # queue all of data, cut into segments of at most mss bytes; returns
+        # once the last one is sent (use swrdt_flush to wait for the ACKs)
+        view = memoryview(data).cast("B")
+        for offset in range(0, len(view), self.mss):
+            self.swrdt_send(bytes(view[offset:offset + self.mss]))
 
-        incoming = self.network.network_receive()
-        if incoming:
-            self.byte_buffer += incoming
+    def swrdt_recv_into(self, buffer, nbytes=0, timeout=None):
+        # copy up to nbytes (default: len(buffer)) of the stream into buffer;
+        # returns how many, 0 on timeout or once the connection is closed
+        view = memoryview(buffer).cast("B")
+        nbytes = nbytes or len(view)
+        with self.lock:
+            if self.partial_offset == len(self.partial):
+                if not self._wait_for(lambda: self.app_buffer or self.closed, timeout) \
+                        or not self.app_buffer:
+                    return 0
+                self.partial = self.app_buffer.popleft()
+                self.partial_offset = 0
+                self._window_opened()
+            start = self.partial_offset
+            n = min(nbytes, len(self.partial) - start)
+            view[:n] = self.partial[start:start + n]
+            self.partial_offset += n
+        return n
 
-        self._process_incoming()
+    def swrdt_recv(self, nbytes, timeout=None):
+        buffer = bytearray(nbytes)
+        n = self.swrdt_recv_into(buffer, nbytes, timeout)
+        del buffer[n:]
+        return bytes(buffer)
 
-        if self.app_buffer:
-            return self.app_buffer.pop(0)
+    def _recv_exactly(self, buffer, timeout):
+        view = memoryview(buffer)
+        got = 0
+        while got < len(view):
+            n = self.swrdt_recv_into(view[got:], timeout=timeout)
+            if n == 0:
+                raise ConnectionError(f"stream ended after {got} of {len(view)} bytes")
+            got += n
 
-        return None
+    def swrdt_send_file(self, path, chunk_size=1024 * 1024):
+        # the file's size, then its bytes; returns once everything is ACKed
+        size = os.path.getsize(path)
+        self.swrdt_send(FILE_HEADER.pack(size))
+        buffer = bytearray(chunk_size)
+        with open(path, "rb") as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                self.swrdt_sendall(memoryview(buffer)[:n])
+        self.swrdt_flush()
+        return size
+
+    def swrdt_recv_file(self, path, timeout=None, chunk_size=1024 * 1024):
+        # counterpart of swrdt_send_file; returns the number of bytes written
+        header = bytearray(FILE_HEADER.size)
+        self._recv_exactly(header, timeout)
+        size = FILE_HEADER.unpack(header)[0]
+        buffer = bytearray(chunk_size)
+        remaining = size
+        with open(path, "wb") as f:
+            while remaining:
+                n = self.swrdt_recv_into(buffer, min(remaining, chunk_size), timeout)
+                if n == 0:
+                    raise ConnectionError(f"stream ended after {size - remaining} of {size} bytes")
+                f.write(memoryview(buffer)[:n])
+                remaining -= n
+        return size
 
 
 if __name__ == "__main__":
@@ -245,9 +1020,14 @@ if __name__ == "__main__":
     parser.add_argument("role", choices=["sender", "receiver"])
     parser.add_argument("receiver")
     parser.add_argument("port", type=int)
+    parser.add_argument("--mode", choices=SWRDT.modes, default="sw")
+    parser.add_argument("--window", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=None, help="Fixed RTO in seconds; adaptive if not given.")
+    parser.add_argument("--wire", choices=sorted(codecs), default="binary")
     args = parser.parse_args()
 
-    swrdt = SWRDT(args.role, args.receiver, args.port)
+    swrdt = SWRDT(args.role, args.receiver, args.port, timeout=args.timeout, mode=args.mode, window=args.window,
+                  wire=args.wire, metrics=Metrics.Metrics(log=print))
 
     if args.role == "sender":
         swrdt.swrdt_send("MSG_FROM_SENDER")
@@ -259,4 +1039,5 @@ if __name__ == "__main__":
         time.sleep(1)
         print(swrdt.swrdt_receive())
         swrdt.swrdt_send("MSG_FROM_RECEIVER")
+        swrdt.swrdt_flush(timeout=5)
         swrdt.disconnect()
@@ -1,6 +1,8 @@
 import argparse
-import SWRDT
 import time
+import Congestion
+import Metrics
+import SWRDT
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -8,6 +10,19 @@ if __name__ == "__main__":
     )
     parser.add_argument("receiver", help="receiver.")
     parser.add_argument("port", help="Port.", type=int)
+    parser.add_argument("--mode", help="Transport: stop-and-wait, Go-Back-N or Selective Repeat.",
+                        choices=SWRDT.SWRDT.modes, default="sw")
+    parser.add_argument("--window", help="Window size for gbn and sr.", type=int, default=8)
+    parser.add_argument("--timeout", help="Fixed retransmission timeout in seconds (default: adaptive).",
+                        type=float, default=None)
+    parser.add_argument("--wire", help="Segment format; both ends must match.",
+                        choices=sorted(SWRDT.codecs), default="binary")
+    parser.add_argument("--congestion", help="Congestion control for gbn and sr.",
+                        choices=sorted(Congestion.congestion_algorithms), default="reno")
+    parser.add_argument("--mss", help="Largest payload per segment when sending a file.",
+                        type=int, default=SWRDT.DEFAULT_MSS)
+    parser.add_argument("--file", help="Send this file instead of the quotation messages.")
+    parser.add_argument("--quiet", help="Don't print every transport event.", action="store_true")
     args = parser.parse_args()
 
     msg_L = [
@@ -25,23 +40,31 @@ if __name__ == "__main__":
 
     timeout = 2  # Receiver echo timeout (not transport-layer timeout)
 
-    swrdt = SWRDT.SWRDT("sender", args.receiver, args.port)
+    swrdt = SWRDT.SWRDT("sender", args.receiver, args.port, timeout=args.timeout, mode=args.mode, window=args.window,
+                        wire=args.wire, mss=args.mss,
+                        congestion=args.congestion, metrics=Metrics.Metrics(log=None if args.quiet else print))
+
+    if args.file:
+        # file-transfer mode: the whole file through the stream calls, timed
+        # until the last segment is ACKed
+        start = time.perf_counter()
+        size = swrdt.swrdt_send_file(args.file)
+        elapsed = time.perf_counter() - start
+        stats = swrdt.rto_stats()
+        print(f"Sent {size} bytes in {elapsed:.2f} s ({size / elapsed / 1e6:.2f} MB/s), "
+              f"{stats['retransmits']} retransmissions")
+        swrdt.disconnect()
+        raise SystemExit
 
     for message in msg_L:
         # Application-layer print (transport prints happen inside SWRDT)
         print("Sent Message: " + message)
 
-        # Send via stop-and-wait protocol
+        # Send via the reliable transport
         swrdt.swrdt_send(message)
 
-        # Now attempt to receive echo back from Receiver.py
-        reply = None
-        start_wait = time.time()
-
-        while reply is None and (time.time() - start_wait < timeout):
-            reply = swrdt.swrdt_receive()
-            if reply is None:
-                time.sleep(0.05)
+        # Now wait for the echo back from Receiver.py
+        reply = swrdt.swrdt_receive(timeout=timeout)
 
         if reply:
             print("Received Message: " + reply + "\n")
@@ -50,4 +73,10 @@ if __name__ == "__main__":
 
     # Send shutdown signal to receiver
     swrdt.swrdt_send("END")
+    # pipelined modes return before the ACK; wait for it (it may never come
+    # if the receiver has already gone)
+    swrdt.swrdt_flush(timeout=5)
+    stats = swrdt.rto_stats()
+    print(f"RTO {stats['rto'] * 1000:.1f} ms, SRTT {(stats['srtt'] or 0) * 1000:.2f} ms, "
+          f"{stats['samples']} RTT samples, {stats['timeouts']} timeouts, {stats['retransmits']} retransmissions")
     swrdt.disconnect()
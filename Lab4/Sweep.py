@@ -0,0 +1,163 @@
+# Sweep.py
+# Parameter sweeps for SWRDT: every combination of mode, loss, corruption,
+# reordering, message size and retransmission timeout is run as a real
+# sender/receiver pair over TCP on a free port. Points run in parallel in a
+# process pool -- NetworkLayer's loss settings are class attributes, so
+# each transfer needs a process to itself. Results go to a table and
+# optionally CSV / JSON, and a JSON result file from an earlier sweep can
+# be given as a baseline to flag regressions.
+#
+# These are real sockets and real timers, so lossy points vary from run to
+# run (GBN's recovery most of all). For a baseline worth comparing with, use
+# a few hundred messages, several --repeat runs, and the same machine and
+# --jobs: more workers than cores makes the workers' timers late.
+#
+#   python Sweep.py --loss 0 0.1 --size 100 1000 --json before.json
+#   python Sweep.py --loss 0 0.1 --size 100 1000 --baseline before.json
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import statistics
+import sys
+
+import Benchmark
+
+# what identifies a point; a baseline is matched on these
+PARAMS = ("mode", "window", "loss", "corr", "reorder", "size", "timeout", "count")
+METRICS = ("goodput", "completion", "retransmits", "duplicate_acks", "timeouts", "ok")
+
+
+def run_point(point):
+    """One grid point, repeated with seeds 0..repeat-1; the median of each metric."""
+    runs = []
+    for seed in range(point["repeat"]):
+        elapsed, ok, stats = Benchmark.run_transfer(
+            point["count"], point["size"], point["loss"], point["corr"], point["reorder"], seed=seed,
+            mode=point["mode"], window=point["window"], timeout=point["timeout"],
+        )
+        runs.append({
+            "goodput": point["count"] * point["size"] / elapsed,
+            "completion": elapsed,
+            "retransmits": stats["retransmits"],
+            "duplicate_acks": stats["duplicate_acks"],
+            "timeouts": stats["timeouts"],
+            "ok": ok,
+        })
+    result = {name: point[name] for name in PARAMS}
+    for metric in METRICS[:-1]:
+        result[metric] = statistics.median(run[metric] for run in runs)
+    result["ok"] = all(run["ok"] for run in runs)
+    return result
+
+
+def grid(args):
+    for mode, loss, corr, reorder, size, timeout in itertools.product(
+        args.modes, args.loss, args.corr, args.reorder, args.size, args.timeout
+    ):
+        yield {
+            "mode": mode,
+            "window": 1 if mode == "sw" else args.window,
+            "loss": loss,
+            "corr": corr,
+            "reorder": reorder,
+            "size": size,
+            "timeout": None if timeout == "adaptive" else float(timeout),
+            "count": args.count,
+            "repeat": args.repeat,
+        }
+
+
+def key(result):
+    return tuple(result[name] for name in PARAMS)
+
+
+def compare(results, baseline, tolerance, slack):
+    """Regressions against a baseline, as printable lines.
+
+    A point regresses if it delivered wrong data, its goodput fell by more
+    than `tolerance` (completion time rose, for the same amount of data), or
+    it needed that many more retransmissions. A transfer that finishes in a
+    few milliseconds either way is mostly scheduling noise, so completion
+    has to grow by `slack` seconds too.
+    """
+    before = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        name = " ".join(f"{param}={result[param]}" for param in PARAMS)
+        if old["ok"] and not result["ok"]:
+            regressions.append(f"{name}: wrong data")
+        if (result["goodput"] < old["goodput"] * (1 - tolerance)
+                and result["completion"] > old["completion"] + slack):
+            regressions.append(f"{name}: goodput {old['goodput']:.0f} -> {result['goodput']:.0f} B/s, "
+                               f"completion {old['completion']:.3f} -> {result['completion']:.3f} s")
+        # a retransmission or two more is noise, not a regression
+        if result["retransmits"] > old["retransmits"] * (1 + tolerance) + 2:
+            regressions.append(f"{name}: retransmits {old['retransmits']:g} -> {result['retransmits']:g}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep of SWRDT transfers.")
+    parser.add_argument("--modes", nargs="+", choices=("sw", "gbn", "sr"), default=["sw", "gbn", "sr"])
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.1])
+    parser.add_argument("--corr", type=float, nargs="+", default=[0.0, 0.1])
+    parser.add_argument("--reorder", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--size", type=int, nargs="+", default=[100], help="Message sizes in bytes.")
+    parser.add_argument("--timeout", nargs="+", default=["adaptive"],
+                        help="Retransmission timeouts in seconds, or 'adaptive'.")
+    parser.add_argument("--count", type=int, default=100, help="Messages per transfer.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per point; medians are reported.")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="Worker processes.")
+    parser.add_argument("--csv", metavar="PATH", help="Write the results as CSV.")
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON (usable as a baseline).")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON results of an earlier sweep to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change that counts as a regression.")
+    parser.add_argument("--slack", type=float, default=0.05,
+                        help="Seconds a completion time may grow by regardless of --tolerance.")
+    args = parser.parse_args()
+
+    points = list(grid(args))
+    print(f"{len(points)} points x {args.repeat} runs of {args.count} messages, {args.jobs} processes")
+    print(f"{'mode':>8} {'loss':>5} {'corr':>5} {'reord':>5} {'size':>6} {'timeout':>8} "
+          f"{'goodput B/s':>12} {'time s':>7} {'rexmit':>7} {'dupACK':>7} {'RTOs':>5} {'ok':>3}")
+    results = []
+    # maxtasksperchild: every point starts from a fresh process, no
+    # threads or sockets left over from the last one
+    with multiprocessing.Pool(args.jobs, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_point, points):
+            results.append(result)
+            mode = result["mode"] if result["mode"] == "sw" else f"{result['mode']}({result['window']})"
+            timeout = "adaptive" if result["timeout"] is None else f"{result['timeout']:g}"
+            print(f"{mode:>8} {result['loss']:>5} {result['corr']:>5} {result['reorder']:>5} {result['size']:>6} "
+                  f"{timeout:>8} {result['goodput']:>12.0f} {result['completion']:>7.3f} "
+                  f"{result['retransmits']:>7g} {result['duplicate_acks']:>7g} {result['timeouts']:>5g} "
+                  f"{'yes' if result['ok'] else 'NO':>3}", flush=True)
+    results.sort(key=lambda result: tuple(str(value) for value in key(result)))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=PARAMS + METRICS)
+            writer.writeheader()
+            writer.writerows(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.slack)
+        matched = len({key(result) for result in baseline} & {key(result) for result in results})
+        print(f"\n{matched} of {len(results)} points in the baseline, {len(regressions)} regressions "
+              f"(tolerance {args.tolerance * 100:g}%)")
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)